@@ -1,7 +1,12 @@
+import hashlib
+import importlib.util
 import os
 import sys
+import time
 from sqlalchemy.dialects import registry
 
+_config_started = time.perf_counter()
+
 # Dynamically detect Python version and add to path
 # This ensures compatibility with different Superset base image versions
 python_version = f"{sys.version_info.major}.{sys.version_info.minor}"
@@ -17,55 +22,34 @@ for path in python_paths:
     if path not in sys.path and os.path.exists(path):
         sys.path.insert(0, path)
 
-print(f"Python version: {python_version}")
-print(f"Python path: {sys.path[:5]}")  # Print first 5 paths
-
-# Verify critical database drivers are available
-try:
-    import psycopg2
-    print(f"✓ PostgreSQL driver (psycopg2): {psycopg2.__version__}")
-except ImportError as e:
-    print(f"✗ PostgreSQL driver (psycopg2) not available: {e}")
-
-# Add ClickHouse modules to Python path
-try:
-    import clickhouse_connect
-    print(f"✓ ClickHouse Connect version: {clickhouse_connect.__version__}")
-except ImportError as e:
-    print(f"Warning: ClickHouse Connect not available: {e}")
-
-try:
-    import clickhouse_driver
-    print(f"✓ ClickHouse Driver version: {clickhouse_driver.__version__}")
-except ImportError as e:
-    print(f"Warning: ClickHouse Driver not available: {e}")
+# Print the startup banners once per process tree: forked gunicorn workers
+# and Celery children inherit the marker. SUPERSET_CONFIG_VERBOSE=1 prints
+# them in every process.
+SHOW_CONFIG_BANNER = (
+    os.environ.get('SUPERSET_CONFIG_VERBOSE') == '1'
+    or not os.environ.get('_SUPERSET_CONFIG_LOADED')
+)
+os.environ['_SUPERSET_CONFIG_LOADED'] = '1'
 
-# Verify Pillow is available for screenshots and PDF generation
+# Database drivers are NOT imported here; SQLAlchemy imports each one when a
+# connection first needs it. Their availability comes from package metadata,
+# probed once per image and cached on disk (see superset_driver_probe.py;
+# `python3 /app/superset_driver_probe.py profile` reports import costs).
 try:
-    from PIL import Image
-    import PIL
-    print(f"✓ Pillow (PIL) version {PIL.__version__} - Screenshot and PDF generation enabled")
-except ImportError as e:
-    print(f"Warning: Pillow (PIL) not available: {e}")
+    from superset_driver_probe import get_driver_status
+    DRIVER_STATUS = get_driver_status()
+except ImportError:
+    DRIVER_STATUS = {}
 
 # Register ClickHouse dialect with proper error handling
-# Use clickhouse-driver for native protocol (Railway), clickhouse-connect for HTTP
+# Use clickhouse-driver for native protocol (Railway), clickhouse-connect for HTTP.
+# Registration only records the module path; the driver is imported on first use.
 try:
-    from sqlalchemy.dialects import registry
-    # Register native protocol dialect for Railway compatibility
     registry.register('clickhouse', 'clickhouse_driver.dbapi.extras.dialect', 'ClickHouseDialect')
     registry.register('clickhouse+native', 'clickhouse_driver.dbapi.extras.dialect', 'ClickHouseDialect')
-    print("✅ ClickHouse native dialect registered successfully")
 except Exception as e:
     print(f"Warning: Failed to register ClickHouse native dialect: {e}")
 
-# Register HTTP dialect for clickhouse-connect
-try:
-    # The clickhouse-connect package registers its own HTTP dialect
-    print("✅ ClickHouse Connect HTTP dialect available")
-except Exception as e:
-    print(f"Warning: Failed to register ClickHouse Connect dialect: {e}")
-
 # ============================================================================
 # PostgreSQL Configuration - Superset Metadata Database
 # ============================================================================
@@ -105,12 +89,19 @@ CLICKHOUSE_NATIVE_PORT = 9000
 # ============================================================================
 # SQLAlchemy Engine Configuration
 # ============================================================================
-# Enable detailed logging for database connections
-SQLALCHEMY_ENGINE_OPTIONS = {
-    'pool_pre_ping': True,
-    'pool_recycle': 300,
-    'echo': False,
-}
+# Pool size and overflow come from the gunicorn worker/thread topology and
+# the Postgres connection budget; connections are pinged only after idling
+# instead of on every checkout (see superset_db_pool.py; METADATA_DB_PGBOUNCER
+# selects PgBouncer sizing, `python3 /app/superset_db_pool.py plan` prints it).
+try:
+    from superset_db_pool import engine_options
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+except ImportError:
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_pre_ping': True,
+        'pool_recycle': 300,
+        'echo': False,
+    }
 
 # ============================================================================
 # Data Persistence Configuration
@@ -131,11 +122,9 @@ REDIS_URL = os.environ.get('REDIS_URL', None)
 if REDIS_URL:
     # Production: Use Redis for distributed rate limiting
     RATELIMIT_STORAGE_URI = REDIS_URL
-    print(f"✓ Rate limiting configured with Redis: {REDIS_URL.split('@')[1] if '@' in REDIS_URL else 'configured'}")
 else:
     # Development: Use in-memory storage (not recommended for production)
     RATELIMIT_STORAGE_URI = "memory://"
-    print("⚠ Rate limiting using in-memory storage (set REDIS_URL for production)")
 
 # Rate limiting configuration (disabled for Railway deployment)
 RATELIMIT_ENABLED = False
@@ -143,24 +132,201 @@ RATELIMIT_ENABLED = False
 # ============================================================================
 # Cache Configuration
 # ============================================================================
-# Configure Redis for caching in production if available
-# Falls back to SimpleCache for development
-if REDIS_URL:
-    # Production: Use Redis for distributed caching
-    CACHE_CONFIG = {
+# Every region goes through superset_tiered_cache.TieredCache: a per-process
+# L1 with its own memory budget in front of Redis (when REDIS_URL is set).
+# Without Redis the L1 is the only tier, like SimpleCache but size-bounded.
+# Regions that other workers mutate (filter state, explore form data) keep
+# their L1 short-lived so a worker never serves another's stale copy for long.
+_TIERED_CACHE = importlib.util.find_spec('superset_tiered_cache') is not None
+
+
+def tiered_cache_config(prefix, timeout, l1_max_bytes, l1_timeout=None, stampede_wait=0):
+    """flask-caching config for one cache region"""
+    if not _TIERED_CACHE:
+        if REDIS_URL:
+            return {
+                'CACHE_TYPE': 'RedisCache',
+                'CACHE_REDIS_URL': REDIS_URL,
+                'CACHE_DEFAULT_TIMEOUT': timeout,
+                'CACHE_KEY_PREFIX': prefix,
+            }
+        return {'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': timeout}
+    config = {
+        'CACHE_TYPE': 'superset_tiered_cache.TieredCache',
+        'CACHE_DEFAULT_TIMEOUT': timeout,
+        'CACHE_KEY_PREFIX': prefix,
+        'CACHE_L1_MAX_BYTES': l1_max_bytes,
+        'CACHE_L1_TIMEOUT': l1_timeout if REDIS_URL else None,
+        'CACHE_COMPRESS_THRESHOLD': 16 * 1024,
+        'CACHE_STAMPEDE_WAIT': stampede_wait,
+    }
+    if REDIS_URL:
+        config['CACHE_REDIS_URL'] = REDIS_URL
+    return config
+
+
+_MB = 1024 * 1024
+
+# Metadata and general-purpose caching
+CACHE_CONFIG = tiered_cache_config('superset_', 300, 32 * _MB, l1_timeout=30)
+# Chart query results: the largest payloads and the most concurrent misses
+DATA_CACHE_CONFIG = tiered_cache_config(
+    'superset_data_', 24 * 3600, 256 * _MB, l1_timeout=300, stampede_wait=5,
+)
+# Native filter state and explore form data are read-modify-written per user
+FILTER_STATE_CACHE_CONFIG = tiered_cache_config(
+    'superset_filter_', 90 * 24 * 3600, 16 * _MB, l1_timeout=10,
+)
+EXPLORE_FORM_DATA_CACHE_CONFIG = tiered_cache_config(
+    'superset_explore_', 7 * 24 * 3600, 16 * _MB, l1_timeout=10,
+)
+THUMBNAIL_CACHE_CONFIG = tiered_cache_config(
+    'superset_thumbnail_', 24 * 3600, 64 * _MB, l1_timeout=3600,
+)
+
+# ============================================================================
+# Async Query Execution (Celery)
+# ============================================================================
+# With a broker, SQL Lab and chart queries run on Celery workers (started by
+# superset_init.sh) instead of holding a web worker for up to
+# SUPERSET_WEBSERVER_TIMEOUT; the browser polls, or listens on a websocket,
+# for the result. Interactive queries, exports and cache warm-up get their
+# own queues and workers so a long export never delays a chart.
+# Without a broker everything stays synchronous, as before.
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', REDIS_URL)
+ASYNC_QUERIES_ENABLED = bool(CELERY_BROKER_URL) and os.environ.get('SUPERSET_ASYNC_QUERIES', '1') == '1'
+
+CELERY_QUEUE_INTERACTIVE = 'interactive'
+CELERY_QUEUE_EXPORTS = 'exports'
+CELERY_QUEUE_WARMUP = 'warmup'
+
+# Dashboard cache warm-up (superset_cache_warmup.py): runs once after each
+# deploy from superset_init.sh, then every WARMUP_SCHEDULE_SECONDS on the
+# warmup queue to recompute cached chart data that is about to expire
+_CACHE_WARMUP = importlib.util.find_spec('superset_cache_warmup') is not None
+WARMUP_SCHEDULE_SECONDS = int(os.environ.get('WARMUP_SCHEDULE_SECONDS', 600))
+
+
+def redis_url_parts(url):
+    """host/port/username/password/db/ssl of a redis:// or rediss:// URL"""
+    from urllib.parse import urlparse
+
+    parsed = urlparse(url)
+    return {
+        'host': parsed.hostname or 'localhost',
+        'port': parsed.port or 6379,
+        'username': parsed.username or '',
+        'password': parsed.password or '',
+        'db': int(parsed.path.lstrip('/') or 0),
+        'ssl': parsed.scheme == 'rediss',
+    }
+
+
+class CeleryConfig:
+    broker_url = CELERY_BROKER_URL
+    result_backend = CELERY_BROKER_URL
+    imports = (
+        'superset.sql_lab',
+        'superset.tasks.async_queries',
+        'superset.tasks.scheduler',
+        'superset.tasks.thumbnails',
+        'superset.tasks.cache',
+    ) + (('superset_cache_warmup',) if _CACHE_WARMUP else ())
+    # Queries are long and uneven: take one task at a time, and acknowledge
+    # it only once done so a worker restart requeues it instead of losing it
+    worker_prefetch_multiplier = 1
+    task_acks_late = True
+    task_default_queue = 'celery'
+    task_routes = {
+        'sql_lab.get_sql_results': {'queue': CELERY_QUEUE_INTERACTIVE},
+        'load_chart_data_into_cache': {'queue': CELERY_QUEUE_INTERACTIVE},
+        'load_explore_json_into_cache': {'queue': CELERY_QUEUE_INTERACTIVE},
+        'reports.execute': {'queue': CELERY_QUEUE_EXPORTS},
+        'cache_chart_thumbnail': {'queue': CELERY_QUEUE_EXPORTS},
+        'cache_dashboard_thumbnail': {'queue': CELERY_QUEUE_EXPORTS},
+        'cache_dashboard_screenshot': {'queue': CELERY_QUEUE_EXPORTS},
+        'cache-warmup': {'queue': CELERY_QUEUE_WARMUP},
+        'fetch_url': {'queue': CELERY_QUEUE_WARMUP},
+        'railway.cache_warmup': {'queue': CELERY_QUEUE_WARMUP},
+    }
+    task_annotations = {
+        'sql_lab.get_sql_results': {'rate_limit': '100/s'},
+        'reports.execute': {'soft_time_limit': 600},
+    }
+    beat_schedule = {
+        'reports.scheduler': {
+            'task': 'reports.scheduler',
+            'schedule': 60,
+        },
+        'reports.prune_log': {
+            'task': 'reports.prune_log',
+            'schedule': 24 * 3600,
+        },
+    }
+    if _CACHE_WARMUP and WARMUP_SCHEDULE_SECONDS > 0:
+        beat_schedule['railway.cache_warmup'] = {
+            'task': 'railway.cache_warmup',
+            'schedule': WARMUP_SCHEDULE_SECONDS,
+            # Recompute whatever would expire before the next run, plus slack
+            'kwargs': {'refresh_window': WARMUP_SCHEDULE_SECONDS * 1.5},
+            'options': {'expires': WARMUP_SCHEDULE_SECONDS},
+        }
+
+
+if ASYNC_QUERIES_ENABLED:
+    CELERY_CONFIG = CeleryConfig
+
+    # SQL Lab results written by workers, read back by web workers. Only
+    # databases with "Asynchronous query execution" enabled use it. They go
+    # to files on the DATA_DIR volume (LRU-swept to RESULTS_STORE_MAX_BYTES)
+    # rather than Redis memory; SQL Lab still loads each result whole.
+    # SQLLAB_RESULTS_STORE=redis keeps them in Redis instead.
+    if (os.environ.get('SQLLAB_RESULTS_STORE', 'file') == 'file'
+            and importlib.util.find_spec('superset_results_store') is not None):
+        from superset_results_store import FileResultsBackend
+
+        RESULTS_BACKEND = FileResultsBackend(
+            os.path.join(DATA_DIR, 'results'),
+            max_bytes=int(os.environ.get('RESULTS_STORE_MAX_BYTES', 2 * 1024 ** 3)),
+            default_timeout=24 * 3600,
+        )
+    else:
+        from cachelib.redis import RedisCache as _ResultsRedisCache
+        from redis import from_url as _redis_from_url
+
+        RESULTS_BACKEND = _ResultsRedisCache(
+            host=_redis_from_url(CELERY_BROKER_URL),
+            key_prefix='superset_results_',
+            default_timeout=24 * 3600,
+        )
+    SQLLAB_ASYNC_TIME_LIMIT_SEC = int(os.environ.get('SQLLAB_ASYNC_TIME_LIMIT_SEC', 3600))
+
+    # Chart queries go through the interactive queue; results land in
+    # DATA_CACHE_CONFIG (shared through its Redis tier) and the browser is
+    # told over polling, or a websocket when SUPERSET_ASYNC_TRANSPORT=ws and
+    # the superset-websocket service runs at SUPERSET_WEBSOCKET_URL
+    FEATURE_FLAGS['GLOBAL_ASYNC_QUERIES'] = True
+    _async_redis = redis_url_parts(CELERY_BROKER_URL)
+    GLOBAL_ASYNC_QUERIES_REDIS_CONFIG = _async_redis
+    GLOBAL_ASYNC_QUERIES_CACHE_BACKEND = {
         'CACHE_TYPE': 'RedisCache',
-        'CACHE_REDIS_URL': REDIS_URL,
+        'CACHE_REDIS_HOST': _async_redis['host'],
+        'CACHE_REDIS_PORT': _async_redis['port'],
+        'CACHE_REDIS_USER': _async_redis['username'],
+        'CACHE_REDIS_PASSWORD': _async_redis['password'],
+        'CACHE_REDIS_DB': _async_redis['db'],
+        'CACHE_REDIS_SSL': _async_redis['ssl'],
         'CACHE_DEFAULT_TIMEOUT': 300,
-        'CACHE_KEY_PREFIX': 'superset_'
-    }
-    print("✓ Cache configured with Redis")
-else:
-    # Development: Use simple in-memory cache
-    CACHE_CONFIG = {
-        'CACHE_TYPE': 'SimpleCache',
-        'CACHE_DEFAULT_TIMEOUT': 300
     }
-    print("⚠ Cache using in-memory storage (set REDIS_URL for production)")
+    GLOBAL_ASYNC_QUERIES_TRANSPORT = os.environ.get('SUPERSET_ASYNC_TRANSPORT', 'polling')
+    GLOBAL_ASYNC_QUERIES_POLLING_DELAY = 500  # ms
+    GLOBAL_ASYNC_QUERIES_WEBSOCKET_URL = os.environ.get('SUPERSET_WEBSOCKET_URL', 'ws://127.0.0.1:8080/')
+    # Must be at least 32 bytes and shared with the websocket service; derived
+    # from SECRET_KEY unless set explicitly
+    GLOBAL_ASYNC_QUERIES_JWT_SECRET = os.environ.get('GLOBAL_ASYNC_QUERIES_JWT_SECRET') or (
+        hashlib.sha256(f'async-queries:{SECRET_KEY}'.encode('utf-8')).hexdigest()
+    )
+    GLOBAL_ASYNC_QUERIES_JWT_COOKIE_SECURE = os.environ.get('SUPERSET_ENV') == 'production'
 
 # ============================================================================
 # Helper Functions
@@ -169,6 +335,12 @@ else:
 def validate_clickhouse_connection(uri):
     """Validate ClickHouse connection string format"""
     try:
+        if uri.startswith('clickhouse+native://'):
+            # Reuse the process-wide engine (and its pooled connection)
+            # instead of opening a new connection on every validation
+            from clickhouse_railway_engine import create_railway_engine
+            return create_railway_engine(uri).ping()
+
         from sqlalchemy import create_engine
         engine = create_engine(uri)
         with engine.connect() as conn:
@@ -244,15 +416,34 @@ SUPERSET_WEBSERVER_TIMEOUT = 300
 ROW_LIMIT = 50000
 
 # Print configuration summary
-print("=" * 70)
-print("Superset Configuration Summary")
-print("=" * 70)
-print(f"Python Version: {python_version}")
-print(f"Metadata Database: {SQLALCHEMY_DATABASE_URI.split('@')[0] if '@' in SQLALCHEMY_DATABASE_URI else 'SQLite'}")
-print(f"Data Directory: {DATA_DIR}")
-print(f"Upload Directory: {UPLOAD_FOLDER}")
-print(f"ClickHouse Support: Enabled (Native Protocol)")
-print(f"Rate Limiting: {'Redis' if REDIS_URL else 'In-Memory'}")
-print(f"Cache Backend: {'Redis' if REDIS_URL else 'SimpleCache'}")
-print(f"MCP Server: {MCP_SERVICE_HOST}:{MCP_SERVICE_PORT} (auth={'enabled' if MCP_AUTH_ENABLED else 'dev-mode'})")
-print("=" * 70)
+if SHOW_CONFIG_BANNER:
+    print("=" * 70)
+    print("Superset Configuration Summary")
+    print("=" * 70)
+    print(f"Python Version: {python_version}")
+    print(f"Metadata Database: {SQLALCHEMY_DATABASE_URI.split('@')[0] if '@' in SQLALCHEMY_DATABASE_URI else 'SQLite'}")
+    if 'pool_size' in SQLALCHEMY_ENGINE_OPTIONS:
+        print(f"Metadata DB Pool: {SQLALCHEMY_ENGINE_OPTIONS['pool_size']} "
+              f"+ {SQLALCHEMY_ENGINE_OPTIONS['max_overflow']} overflow per worker")
+    print(f"Data Directory: {DATA_DIR}")
+    print(f"Upload Directory: {UPLOAD_FOLDER}")
+    print(f"ClickHouse Support: Enabled (Native Protocol)")
+    for label, info in DRIVER_STATUS.items():
+        if info['available']:
+            print(f"  ✓ {label}: {info['version'] or 'installed'}")
+        else:
+            print(f"  ✗ {label}: not installed")
+    if ASYNC_QUERIES_ENABLED:
+        print(f"Async Queries: Celery ({GLOBAL_ASYNC_QUERIES_TRANSPORT}; queues: "
+              f"{CELERY_QUEUE_INTERACTIVE}, {CELERY_QUEUE_EXPORTS}, {CELERY_QUEUE_WARMUP})")
+        print(f"Results Backend: {type(RESULTS_BACKEND).__name__}")
+    else:
+        print("Async Queries: Disabled (set REDIS_URL or CELERY_BROKER_URL)")
+    print(f"Rate Limiting: {'Redis' if REDIS_URL else 'In-Memory (set REDIS_URL for production)'}")
+    if _TIERED_CACHE:
+        print(f"Cache Backend: Tiered ({'L1 + Redis' if REDIS_URL else 'L1 only, set REDIS_URL for production'})")
+    else:
+        print(f"Cache Backend: {CACHE_CONFIG['CACHE_TYPE']}")
+    print(f"MCP Server: {MCP_SERVICE_HOST}:{MCP_SERVICE_PORT} (auth={'enabled' if MCP_AUTH_ENABLED else 'dev-mode'})")
+    print(f"Config loaded in {(time.perf_counter() - _config_started) * 1000:.1f}ms")
+    print("=" * 70)
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Query-pattern recorder and rollup advisor for the Railway ClickHouse engine
+Dashboards run the same GROUP BY shapes against large tables over and over.
+The recorder fingerprints every executed SELECT (normalized SQL, tables,
+group-by keys, filtered columns, aggregates) and appends per-pattern cost
+totals to a JSON-lines log. The advisor reads that log offline, ranks the
+heaviest patterns and proposes PROJECTION or MATERIALIZED VIEW DDL that
+would pre-aggregate them, with an estimate of the work saved.
+
+Usage:
+    python3 clickhouse_railway_advisor.py patterns --top 20
+    python3 clickhouse_railway_advisor.py advise --top 5 --dry-run
+    CLICKHOUSE_URI=clickhouse+native://... python3 clickhouse_railway_advisor.py advise --apply 1
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from clickhouse_railway_cache import mask_literals, normalize_sql
+
+log = logging.getLogger(__name__)
+
+DATA_DIR = os.environ.get('DATA_DIR', '/app/superset_home/data')
+DEFAULT_PATTERN_LOG = os.path.join(DATA_DIR, 'clickhouse_query_patterns.jsonl')
+DEFAULT_FLUSH_INTERVAL = 60  # seconds between appends to the pattern log
+DEFAULT_MAX_LOG_BYTES = 64 * 1024 * 1024  # rotated to <log>.1 beyond this
+MAX_ROLLUP_DIMENSIONS = 8  # wider rollups rarely shrink a table enough
+MAX_MEMOIZED_QUERIES = 10000  # parsed query texts kept by a recorder
+
+AGGREGATE_FUNCTIONS = (
+    'count', 'sum', 'avg', 'min', 'max', 'any', 'anyLast', 'uniq', 'uniqExact',
+    'uniqCombined', 'uniqHLL12', 'quantile', 'quantiles', 'quantileTDigest',
+    'argMin', 'argMax', 'groupArray', 'groupUniqArray', 'sumIf', 'countIf',
+    'avgIf', 'minIf', 'maxIf', 'uniqIf', 'median',
+)
+_AGGREGATE_RE = re.compile(
+    r'\b(?P<name>' + '|'.join(sorted(AGGREGATE_FUNCTIONS, key=len, reverse=True)) + r')\s*\(',
+    re.I,
+)
+_CLAUSE_END = r'(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\bSETTINGS\b|\bFORMAT\b|\bWITH\s+(?:TOTALS|ROLLUP|CUBE)\b|$)'
+_GROUP_BY_RE = re.compile(r'\bGROUP\s+BY\b(?P<keys>.*?)' + _CLAUSE_END, re.I | re.S)
+_WHERE_RE = re.compile(
+    r'\b(?:PREWHERE|WHERE)\b(?P<cond>.*?)(?=\bWHERE\b|\bGROUP\s+BY\b|\bHAVING\b|\bORDER\s+BY\b'
+    r'|\bLIMIT\b|\bSETTINGS\b|\bFORMAT\b|$)',
+    re.I | re.S,
+)
+_SELECT_RE = re.compile(r'^\s*SELECT\s+(?:DISTINCT\s+)?(?P<items>.*?)\bFROM\b', re.I | re.S)
+_TABLE_RE = re.compile(
+    r'\b(?:FROM|JOIN)\s+(?P<table>(?:`[^`]+`|[A-Za-z_]\w*)(?:\.(?:`[^`]+`|[A-Za-z_]\w*))?)(?!\s*\()',
+    re.I,
+)
+# Left-hand side of a comparison: a column, or a function of one column
+_FILTER_RE = re.compile(
+    r'(?P<expr>(?:[A-Za-z_]\w*\s*\(\s*)?`?[A-Za-z_][\w.]*`?(?:\s*\))?)\s*'
+    r'(?:=|!=|<>|<=|>=|<|>|\bNOT\s+IN\b|\bIN\b|\bNOT\s+LIKE\b|\bLIKE\b|\bILIKE\b|\bBETWEEN\b)',
+    re.I,
+)
+_LITERAL_VALUE_RE = re.compile(r"'(?:[^'\\]|\\.)*'|%\(\w+\)s|\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.I)
+_KEYWORDS = {'and', 'or', 'not', 'where', 'prewhere', 'on', 'in', 'like', 'between', 'is', 'null'}
+
+
+def _split_top_level(text: str) -> list:
+    """Split on commas that are not inside parentheses"""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            parts.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if ''.join(current).strip():
+        parts.append(''.join(current).strip())
+    return parts
+
+
+def _collapse(expr: str) -> str:
+    return re.sub(r'\s*([(),])\s*', r'\1', re.sub(r'\s+', ' ', expr.strip())).replace(',', ', ')
+
+
+def _split_alias(item: str):
+    match = re.match(r'(?P<expr>.*?)\s+AS\s+(?P<alias>`[^`]+`|[A-Za-z_]\w*)\s*$', item, re.I | re.S)
+    if match:
+        return _collapse(match.group('expr')), match.group('alias').strip('`')
+    return _collapse(item), None
+
+
+class QueryPattern:
+    """The shape of one SELECT, independent of its literal values"""
+
+    __slots__ = ('fingerprint', 'normalized', 'tables', 'group_by', 'filters',
+                 'aggregates', 'final')
+
+    def __init__(self, normalized: str, tables, group_by, filters, aggregates, final: bool):
+        self.normalized = normalized
+        self.tables = list(tables)
+        self.group_by = list(group_by)
+        self.filters = sorted(set(filters))
+        self.aggregates = sorted(set(aggregates))
+        self.final = final
+        self.fingerprint = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def fingerprint_query(query: str):
+    """``QueryPattern`` for a SELECT, or None for anything else"""
+    if not re.match(r'\s*(?:SELECT|WITH)\b', query, re.I):
+        return None
+    normalized = _LITERAL_VALUE_RE.sub('?', normalize_sql(query))
+    masked = mask_literals(query.strip().rstrip(';'))
+
+    tables = []
+    for match in _TABLE_RE.finditer(masked):
+        table = match.group('table').replace('`', '')
+        if table not in tables:
+            tables.append(table)
+
+    aliases, aggregates = {}, []
+    select = _SELECT_RE.search(masked)
+    if select is not None:
+        for item in _split_top_level(select.group('items')):
+            expr, alias = _split_alias(item)
+            if alias:
+                aliases[alias] = expr
+            if _AGGREGATE_RE.search(expr):
+                aggregates.append(expr)
+
+    group_by = []
+    match = _GROUP_BY_RE.search(masked)
+    if match is not None:
+        for key in _split_top_level(match.group('keys')):
+            key = _collapse(key).strip('`')
+            group_by.append(aliases.get(key, key))
+
+    filters = []
+    for match in _WHERE_RE.finditer(masked):
+        for filter_match in _FILTER_RE.finditer(match.group('cond')):
+            expr = _collapse(filter_match.group('expr')).replace('`', '')
+            if expr.lower() not in _KEYWORDS:
+                filters.append(expr)
+
+    final = bool(re.search(r'\bFINAL\b', masked, re.I))
+    return QueryPattern(normalized, tables, group_by, filters, aggregates, final)
+
+
+class PatternRecorder:
+    """Query hook that totals the cost of each query pattern and logs it
+
+    Add it with ``ClickHouseRailwayEngine(uri, pattern_log=path)`` or as one
+    of the engine's ``query_hooks``. Totals are kept per fingerprint and
+    appended to ``path`` as JSON lines every ``flush_interval`` seconds and
+    at exit; the advisor merges lines from every process and flush.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATTERN_LOG,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 max_bytes: int = DEFAULT_MAX_LOG_BYTES):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self._pending = {}  # fingerprint -> record dict
+        self._patterns = {}  # query text -> QueryPattern (or None)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def _pattern(self, query: str):
+        pattern = self._patterns.get(query)
+        if pattern is None and query not in self._patterns:
+            if len(self._patterns) >= MAX_MEMOIZED_QUERIES:
+                self._patterns.clear()
+            pattern = self._patterns[query] = fingerprint_query(query)
+        return pattern
+
+    def __call__(self, metrics):
+        if metrics.error:
+            return
+        with self._lock:
+            pattern = self._pattern(metrics.query)
+            if pattern is None:
+                return
+            record = self._pending.get(pattern.fingerprint)
+            if record is None:
+                record = self._pending[pattern.fingerprint] = dict(
+                    pattern.as_dict(), count=0, total_time=0.0, rows_read=0,
+                    bytes_read=0, max_result_rows=0, first_seen=metrics.started_at,
+                )
+            record['count'] += 1
+            record['total_time'] += metrics.total or 0.0
+            record['rows_read'] += metrics.rows_read or 0
+            record['bytes_read'] += metrics.bytes_read or 0
+            record['max_result_rows'] = max(record['max_result_rows'], metrics.result_rows or 0)
+            record['last_seen'] = metrics.started_at
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Append pending totals to the log"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        lines = ''.join(json.dumps(record, sort_keys=True) + '\n' for record in pending.values())
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        except OSError as e:
+            log.warning(f"Failed to write query patterns to {self.path}: {e}")
+
+
+def load_patterns(path: str = DEFAULT_PATTERN_LOG) -> list:
+    """Merge the recorder's log (and its rotated predecessor) per fingerprint"""
+    merged = {}
+    for name in (path + '.1', path):
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                total = merged.get(record['fingerprint'])
+                if total is None:
+                    merged[record['fingerprint']] = record
+                    continue
+                for field in ('count', 'total_time', 'rows_read', 'bytes_read'):
+                    total[field] += record[field]
+                total['max_result_rows'] = max(total['max_result_rows'], record['max_result_rows'])
+                total['first_seen'] = min(total['first_seen'], record['first_seen'])
+                total['last_seen'] = max(total['last_seen'], record['last_seen'])
+    return sorted(merged.values(), key=lambda record: record['total_time'], reverse=True)
+
+
+def _dimensions(record: dict) -> list:
+    """Rollup dimensions a pattern needs: its group keys plus filtered columns
+
+    A filtered column already covered by a group key expression (``ts``
+    under ``toStartOfHour(ts)``) is served at that key's granularity.
+    """
+    dims = list(record['group_by'])
+    for column in record['filters']:
+        if not any(re.search(rf'\b{re.escape(column)}\b', key) for key in dims):
+            dims.append(column)
+    return dims
+
+
+def _state(expr: str) -> str:
+    """``sum(x)`` -> ``sumState(x)`` for AggregatingMergeTree views"""
+    return re.sub(r'^(\w+)\s*\(', r'\1State(', expr, count=1)
+
+
+def _identifier(expr: str) -> str:
+    return re.sub(r'\W+', '_', expr).strip('_') or 'value'
+
+
+class Rollup:
+    """A proposed pre-aggregation of one table and the patterns it serves"""
+
+    def __init__(self, table: str, dimensions, kind: str):
+        self.table = table
+        self.dimensions = list(dimensions)
+        self.aggregates = []
+        self.kind = kind
+        self.served = []  # pattern records
+
+    @property
+    def name(self) -> str:
+        material = '\x00'.join([self.table] + sorted(self.dimensions) + sorted(self.aggregates))
+        table = self.table.rsplit('.', 1)[-1]
+        return f"{table}_rollup_{hashlib.sha1(material.encode('utf-8')).hexdigest()[:8]}"
+
+    def serves(self, record: dict) -> bool:
+        return (record['tables'] == [self.table]
+                and set(_dimensions(record)) <= set(self.dimensions)
+                and set(record['aggregates']) <= set(self.aggregates))
+
+    def estimate(self) -> dict:
+        """Executions, seconds and bytes read by the served patterns, and the share saved
+
+        A served query would read about as many rows as the rollup holds,
+        estimated from the largest result its patterns returned; this is a
+        lower bound, so the savings are an upper bound.
+        """
+        executions = sum(record['count'] for record in self.served)
+        seconds = sum(record['total_time'] for record in self.served)
+        bytes_read = sum(record['bytes_read'] for record in self.served)
+        rows_read = sum(record['rows_read'] for record in self.served)
+        rollup_rows = max((record['max_result_rows'] for record in self.served), default=0)
+        per_query = rows_read / executions if executions else 0
+        saved = 1 - min(1.0, rollup_rows / per_query) if per_query else 0.0
+        return {
+            'executions': executions,
+            'seconds': seconds,
+            'bytes_read': bytes_read,
+            'saved_fraction': saved,
+            'seconds_saved': seconds * saved,
+            'bytes_saved': int(bytes_read * saved),
+        }
+
+    def _select(self, state: bool) -> str:
+        """Rollup SELECT list; view columns need names, projections match expressions"""
+        items = [
+            dim if not state or re.fullmatch(r'[A-Za-z_]\w*', dim)
+            else f'{dim} AS {_identifier(dim)}'
+            for dim in self.dimensions
+        ]
+        for expr in self.aggregates:
+            items.append(f'{_state(expr)} AS {_identifier(expr)}' if state else expr)
+        return ', '.join(items)
+
+    def ddl(self) -> list:
+        """Statements that create and backfill the rollup"""
+        keys = ', '.join(self.dimensions)
+        if self.kind == 'projection':
+            return [
+                f'ALTER TABLE {self.table} ADD PROJECTION {self.name} '
+                f'(SELECT {self._select(False)} GROUP BY {keys})',
+                f'ALTER TABLE {self.table} MATERIALIZE PROJECTION {self.name}',
+            ]
+        database = self.table.rsplit('.', 1)[0] + '.' if '.' in self.table else ''
+        order_by = ', '.join(
+            dim if re.fullmatch(r'[A-Za-z_]\w*', dim) else _identifier(dim)
+            for dim in self.dimensions
+        )
+        return [
+            f'CREATE MATERIALIZED VIEW IF NOT EXISTS {database}{self.name} '
+            f'ENGINE = AggregatingMergeTree ORDER BY ({order_by}) POPULATE AS '
+            f'SELECT {self._select(True)} FROM {self.table} GROUP BY {keys}'
+        ]
+
+
+def propose_rollups(records: list, kind: str = 'auto', min_count: int = 2) -> list:
+    """Rollups for aggregating single-table patterns, heaviest savings first
+
+    Patterns needing the same dimensions share one rollup carrying all of
+    their aggregates. ``kind='auto'`` proposes a projection, which the
+    server uses transparently, unless a pattern reads with FINAL (which
+    projections don't serve); then an AggregatingMergeTree materialized
+    view is proposed, whose ``-Merge`` aggregates queries must target.
+    """
+    rollups = {}
+    for record in records:
+        if (record['count'] < min_count or len(record['tables']) != 1
+                or not record['aggregates'] or not record['group_by']):
+            continue
+        dims = _dimensions(record)
+        if len(dims) > MAX_ROLLUP_DIMENSIONS:
+            continue
+        table = record['tables'][0]
+        key = (table, frozenset(dims))
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup_kind = kind
+            if kind == 'auto':
+                rollup_kind = 'view' if record['final'] else 'projection'
+            rollup = rollups[key] = Rollup(table, dims, rollup_kind)
+        elif kind == 'auto' and record['final']:
+            rollup.kind = 'view'
+        for expr in record['aggregates']:
+            if expr not in rollup.aggregates:
+                rollup.aggregates.append(expr)
+
+    proposals = list(rollups.values())
+    for rollup in proposals:
+        rollup.served = [record for record in records if rollup.serves(record)]
+    return sorted(proposals, key=lambda rollup: rollup.estimate()['seconds_saved'], reverse=True)
+
+
+def _print_patterns(records: list, top: int):
+    print(f"{'fingerprint':<18}{'count':>8}{'total (s)':>12}{'rows read':>16}  pattern")
+    print('-' * 100)
+    for record in records[:top]:
+        print(f"{record['fingerprint']:<18}{record['count']:>8}{record['total_time']:>12.1f}"
+              f"{record['rows_read']:>16}  {record['normalized'][:200]}")
+
+
+def _print_rollups(proposals: list, top: int, dry_run: bool):
+    for rank, rollup in enumerate(proposals[:top], 1):
+        estimate = rollup.estimate()
+        print(f"#{rank} {rollup.kind} {rollup.name} on {rollup.table}")
+        print(f"   dimensions: {', '.join(rollup.dimensions)}")
+        print(f"   aggregates: {', '.join(rollup.aggregates)}")
+        print(f"   serves {len(rollup.served)} pattern(s), {estimate['executions']} executions, "
+              f"{estimate['seconds']:.1f}s; estimated saving up to {estimate['saved_fraction']:.0%} "
+              f"(~{estimate['seconds_saved']:.1f}s, {estimate['bytes_saved'] / 1024 / 1024:.1f} MB read)")
+        for statement in rollup.ddl():
+            print(f"   {statement};")
+        if dry_run:
+            for record in rollup.served:
+                print(f"     - [{record['fingerprint']}] x{record['count']}: {record['normalized'][:160]}")
+        print()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--log', default=DEFAULT_PATTERN_LOG,
+                        help=f'pattern log written by PatternRecorder (default: {DEFAULT_PATTERN_LOG})')
+    parser.add_argument('--top', type=int, default=10)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('patterns', help='list the heaviest recorded query patterns')
+    advise = sub.add_parser('advise', help='propose PROJECTION / MATERIALIZED VIEW DDL')
+    advise.add_argument('--kind', choices=('auto', 'projection', 'view'), default='auto')
+    advise.add_argument('--min-count', type=int, default=2,
+                        help='ignore patterns executed fewer times than this')
+    advise.add_argument('--dry-run', action='store_true',
+                        help='list the recorded queries each rollup would serve')
+    advise.add_argument('--apply', type=int, default=0, metavar='N',
+                        help='run the DDL of the top N proposals against --uri')
+    advise.add_argument('--uri', default=os.environ.get('CLICKHOUSE_URI'),
+                        help='clickhouse+native:// URI for --apply (default: $CLICKHOUSE_URI)')
+    args = parser.parse_args(argv)
+    if args.command == 'advise' and args.apply:
+        if args.dry_run:
+            parser.error('--apply and --dry-run are mutually exclusive')
+        if not args.uri:
+            parser.error('set --uri or CLICKHOUSE_URI to apply DDL')
+
+    records = load_patterns(args.log)
+    if not records:
+        print(f"No query patterns recorded in {args.log}")
+        return 1
+    if args.command == 'patterns':
+        _print_patterns(records, args.top)
+        return 0
+
+    proposals = propose_rollups(records, kind=args.kind, min_count=args.min_count)
+    if not proposals:
+        print("No aggregating single-table pattern is frequent enough to roll up")
+        return 0
+    _print_rollups(proposals, args.top, args.dry_run)
+
+    if args.apply:
+        from clickhouse_railway_engine import create_railway_engine
+
+        engine = create_railway_engine(args.uri)
+        for rollup in proposals[:args.apply]:
+            for statement in rollup.ddl():
+                print(f"Running: {statement}")
+                engine.execute(statement, profile='background')
+        engine.metadata.invalidate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Multi-host load balancing for the Railway ClickHouse engine
+Spreads queries over several ClickHouse hosts (e.g. read replicas), each
+with its own client pool. Hosts that keep failing at the connection level
+are ejected for a backoff period and then tried again, so a restarting node
+costs a few failed queries instead of every chart.
+"""
+
+import itertools
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from clickhouse_driver import errors
+
+log = logging.getLogger(__name__)
+
+STRATEGIES = ('round_robin', 'least_outstanding')
+DEFAULT_STRATEGY = 'least_outstanding'
+DEFAULT_EJECT_AFTER = 3  # consecutive connection failures before ejection
+DEFAULT_EJECT_BACKOFF = 5  # seconds for the first ejection
+DEFAULT_MAX_EJECT_BACKOFF = 300  # cap for repeated ejections
+
+# Failures that say something about the host rather than the query
+HOST_FAILURES = (
+    errors.NetworkError,
+    errors.SocketTimeoutError,
+    errors.UnexpectedPacketFromServerError,
+    ConnectionError,
+    EOFError,
+    socket.timeout,
+)
+
+
+def is_host_failure(exc: BaseException) -> bool:
+    """True when an error means the host is unreachable or misbehaving"""
+    return isinstance(exc, HOST_FAILURES)
+
+
+def parse_hosts(host_ports: str, default_port: int = 9000) -> list:
+    """``'h1:9000,h2:9001,h3'`` -> ``[('h1', 9000), ('h2', 9001), ('h3', 9000)]``"""
+    hosts = []
+    for entry in host_ports.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(':')
+        hosts.append((host, int(port) if port else default_port))
+    if not hosts:
+        raise ValueError(f"No hosts in {host_ports!r}")
+    return hosts
+
+
+class NoHostAvailableError(Exception):
+    """Raised when every host has been excluded for this query"""
+
+
+class HostNode:
+    """One ClickHouse host: its pool plus load and health counters"""
+
+    __slots__ = (
+        'host', 'port', 'pool', 'outstanding', 'requests', 'failures',
+        'consecutive_failures', 'ejections', 'ejected_until',
+    )
+
+    def __init__(self, host: str, port: int, pool):
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    @property
+    def address(self) -> str:
+        return f'{self.host}:{self.port}'
+
+    def is_ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+
+class HostBalancer:
+    """Pool-compatible front for one ClickHousePool per host
+
+    ``acquire`` / ``release`` / ``connection`` / ``close`` / ``get_stats``
+    behave like ``ClickHousePool``, so the engine uses either interchangeably.
+    ``round_robin`` rotates through healthy hosts; ``least_outstanding``
+    picks the healthy host with the fewest checked-out clients (ties rotate).
+    Health tracking is passive: ``eject_after`` consecutive connection-level
+    failures eject a host for ``eject_backoff`` seconds, doubling on each
+    repeat up to ``max_eject_backoff``; one success clears the record. If
+    every host is ejected, the one due back soonest is tried anyway.
+    """
+
+    def __init__(self, hosts, pool_factory, strategy: str = DEFAULT_STRATEGY,
+                 eject_after: int = DEFAULT_EJECT_AFTER,
+                 eject_backoff: float = DEFAULT_EJECT_BACKOFF,
+                 max_eject_backoff: float = DEFAULT_MAX_EJECT_BACKOFF):
+        if strategy not in STRATEGIES:
+            raise ValueError(
+                f"Unknown load balancing strategy {strategy!r}; expected one of {STRATEGIES}"
+            )
+        self.strategy = strategy
+        self.eject_after = eject_after
+        self.eject_backoff = eject_backoff
+        self.max_eject_backoff = max_eject_backoff
+        self.nodes = [HostNode(host, port, pool_factory(host, port)) for host, port in hosts]
+        self._rotation = itertools.count()
+        self._checked_out = {}  # id(client) -> HostNode
+        self._lock = threading.Lock()
+
+    def _choose_locked(self, exclude) -> HostNode:
+        now = time.monotonic()
+        candidates = [node for node in self.nodes if node.address not in exclude]
+        if not candidates:
+            raise NoHostAvailableError(
+                f"All ClickHouse hosts already tried: {sorted(exclude)}"
+            )
+        healthy = [node for node in candidates if not node.is_ejected(now)]
+        if not healthy:
+            return min(candidates, key=lambda node: node.ejected_until)
+
+        start = next(self._rotation) % len(healthy)
+        rotated = healthy[start:] + healthy[:start]
+        if self.strategy == 'least_outstanding':
+            return min(rotated, key=lambda node: node.outstanding)
+        return rotated[0]
+
+    def acquire(self, timeout: float = None, exclude=()):
+        """Check out a client from the chosen host's pool"""
+        with self._lock:
+            node = self._choose_locked(exclude)
+            node.outstanding += 1
+            node.requests += 1
+        try:
+            client = node.pool.acquire(timeout)
+        except Exception:
+            with self._lock:
+                node.outstanding -= 1
+            raise
+        with self._lock:
+            self._checked_out[id(client)] = node
+        return client
+
+    def release(self, client, discard: bool = False, error: BaseException = None):
+        """Return a client to its host's pool, recording the query's outcome"""
+        with self._lock:
+            node = self._checked_out.pop(id(client))
+            node.outstanding -= 1
+        if error is None:
+            self.record_success(node)
+        elif is_host_failure(error):
+            self.record_failure(node, error)
+        node.pool.release(client, discard=discard)
+
+    @contextmanager
+    def connection(self, timeout: float = None, exclude=()):
+        """Context manager that checks a client out and always returns it"""
+        client = self.acquire(timeout, exclude)
+        error = None
+        try:
+            yield client
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(client, error=error)
+
+    def node_for(self, client) -> HostNode:
+        with self._lock:
+            return self._checked_out.get(id(client))
+
+    def record_success(self, node: HostNode):
+        with self._lock:
+            recovered = node.ejections and node.consecutive_failures
+            node.consecutive_failures = 0
+            node.ejected_until = 0.0
+        if recovered:
+            log.info(f"ClickHouse host {node.address} recovered")
+
+    def record_failure(self, node: HostNode, error: BaseException):
+        with self._lock:
+            node.failures += 1
+            node.consecutive_failures += 1
+            if node.consecutive_failures < self.eject_after:
+                return
+            backoff = min(
+                self.max_eject_backoff, self.eject_backoff * 2 ** node.ejections
+            )
+            node.ejections += 1
+            node.ejected_until = time.monotonic() + backoff
+        log.warning(
+            f"Ejecting ClickHouse host {node.address} for {backoff:.0f}s after "
+            f"{node.consecutive_failures} consecutive failures: {error}"
+        )
+
+    def close(self):
+        for node in self.nodes:
+            node.pool.close()
+
+    def get_stats(self) -> dict:
+        """Per-host load, health and pool statistics"""
+        now = time.monotonic()
+        with self._lock:
+            hosts = {
+                node.address: {
+                    'outstanding': node.outstanding,
+                    'requests': node.requests,
+                    'failures': node.failures,
+                    'consecutive_failures': node.consecutive_failures,
+                    'ejections': node.ejections,
+                    'ejected_for': max(0.0, node.ejected_until - now),
+                }
+                for node in self.nodes
+            }
+        for node in self.nodes:
+            hosts[node.address]['pool'] = node.pool.get_stats()
+        return {'strategy': self.strategy, 'hosts': hosts}
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Railway ClickHouse engine
+Compares result modes against a live server so engine changes can be judged
+on real latency and memory numbers.
+
+Usage:
+    CLICKHOUSE_URI=clickhouse+native://... python3 clickhouse_railway_bench.py results
+    CLICKHOUSE_URI=clickhouse+native://... python3 clickhouse_railway_bench.py compression
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+from clickhouse_railway_engine import ClickHouseRailwayEngine, create_railway_engine
+
+# 50k rows (our ROW_LIMIT) with the column shapes typical of chart queries
+DEFAULT_QUERY = (
+    "SELECT number AS id, "
+    "toDateTime('2024-01-01 00:00:00') + number AS ts, "
+    "toLowCardinality(concat('region_', toString(number % 12))) AS region, "
+    "concat('user_', toString(number % 5000)) AS user, "
+    "number % 1000 AS small_int, "
+    "number * 1.5 AS value "
+    "FROM numbers(50000)"
+)
+
+
+def _measure(fn, repeat: int):
+    """Best wall time and peak traced allocation of ``fn`` over ``repeat`` runs"""
+    best_time, peak = float('inf'), 0
+    for _ in range(repeat):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        _, run_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        best_time = min(best_time, elapsed)
+        peak = max(peak, run_peak)
+    return best_time, peak
+
+
+def _print_table(rows):
+    print(f"{'mode':<28}{'best time (ms)':>16}{'peak memory (MB)':>20}")
+    print('-' * 64)
+    for name, elapsed, peak in rows:
+        print(f"{name:<28}{elapsed * 1000:>16.1f}{peak / 1024 / 1024:>20.2f}")
+
+
+class _CountingSocket:
+    """Socket proxy that counts bytes received, i.e. bytes on the wire"""
+
+    def __init__(self, sock, counter: list):
+        self._sock = sock
+        self._counter = counter
+
+    def recv_into(self, buffer, *args):
+        received = self._sock.recv_into(buffer, *args)
+        self._counter[0] += received
+        return received
+
+    def recv(self, *args):
+        data = self._sock.recv(*args)
+        self._counter[0] += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+def _count_wire_bytes(engine) -> list:
+    """Make every client the engine creates count its received bytes
+
+    Only for engines private to the benchmark, never registry-shared ones.
+    """
+    counter = [0]
+    create_client = engine._create_client
+
+    def counting_client(host: str = None, port: int = None):
+        client = create_client(host, port)
+        connection = client.connection
+        create_socket = connection._create_socket
+        connection._create_socket = lambda host, port: _CountingSocket(
+            create_socket(host, port), counter
+        )
+        return client
+
+    engine._create_client = counting_client
+    return counter
+
+
+def _with_options(uri: str, **options) -> str:
+    query = '&'.join(f'{key}={value}' for key, value in options.items())
+    return f"{uri}{'&' if '?' in uri else '?'}{query}"
+
+
+def bench_compression(uri: str, query: str, repeat: int, block_sizes):
+    """Bytes on the wire and client decode time per compression/block size"""
+    print(f"{'compression':<14}{'max_block_size':>16}{'wire MB':>12}"
+          f"{'wall (ms)':>12}{'decode cpu (ms)':>18}")
+    print('-' * 72)
+    for compression in ('none', 'lz4', 'zstd'):
+        for block_size in block_sizes:
+            # A private engine: the counting clients must not leak into the
+            # registry's shared engine, and close() below must not close it
+            engine = ClickHouseRailwayEngine(_with_options(
+                uri, compression=compression, max_block_size=block_size
+            ))
+            counter = _count_wire_bytes(engine)
+            try:
+                engine.connect()
+                best_wall = best_cpu = float('inf')
+                wire = 0
+                for _ in range(repeat):
+                    before = counter[0]
+                    wall, cpu = time.perf_counter(), time.process_time()
+                    engine.execute(query, use_cache=False)
+                    best_wall = min(best_wall, time.perf_counter() - wall)
+                    best_cpu = min(best_cpu, time.process_time() - cpu)
+                    wire = counter[0] - before
+            except Exception as e:
+                print(f"⚠️  {compression}/{block_size} skipped: {e}")
+                continue
+            finally:
+                engine.close()
+            print(f"{compression:<14}{block_size:>16}{wire / 1024 / 1024:>12.2f}"
+                  f"{best_wall * 1000:>12.1f}{best_cpu * 1000:>18.1f}")
+
+
+def bench_results(engine, query: str, repeat: int):
+    """Row dicts versus row tuples, columnar NumPy and Arrow results"""
+    modes = [
+        ('dict rows (to_dicts)', lambda: engine.execute(query).to_dicts()),
+        ('tuple rows (execute)', lambda: engine.execute(query)),
+        ('columnar numpy', lambda: engine.execute_columnar(query, downcast=False)),
+        ('columnar numpy + downcast', lambda: engine.execute_columnar(query)),
+        ('arrow table', lambda: engine.execute_columnar(query, arrow=True)),
+    ]
+    rows = []
+    for name, fn in modes:
+        try:
+            elapsed, peak = _measure(fn, repeat)
+        except Exception as e:
+            print(f"⚠️  {name} skipped: {e}")
+            continue
+        rows.append((name, elapsed, peak))
+    _print_table(rows)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--uri', default=os.environ.get('CLICKHOUSE_URI'),
+                        help='clickhouse+native:// URI (default: $CLICKHOUSE_URI)')
+    parser.add_argument('--query', default=DEFAULT_QUERY)
+    parser.add_argument('--repeat', type=int, default=3)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('results', help=bench_results.__doc__)
+    compression = sub.add_parser('compression', help=bench_compression.__doc__)
+    compression.add_argument('--block-sizes', default='8192,65536,262144',
+                             help='comma-separated max_block_size values')
+    args = parser.parse_args(argv)
+
+    if not args.uri:
+        parser.error('set --uri or CLICKHOUSE_URI')
+
+    if args.command == 'compression':
+        block_sizes = [int(size) for size in args.block_sizes.split(',')]
+        bench_compression(args.uri, args.query, args.repeat, block_sizes)
+        return 0
+
+    engine = create_railway_engine(args.uri)
+    try:
+        if args.command == 'results':
+            bench_results(engine, args.query, args.repeat)
+    finally:
+        engine.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Local result cache for the Railway ClickHouse engine
+Keeps recent query results in process memory under a byte budget, so
+identical chart queries stop hitting ClickHouse on every page load. An
+optional shared second tier (any cachelib/flask-caching style cache, e.g.
+Redis) lets workers reuse each other's results.
+"""
+
+import hashlib
+import logging
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_CACHE_TTL = 300  # seconds
+
+CACHEABLE_PREFIXES = ('select', 'with', 'show', 'describe', 'desc', 'exists')
+
+# Quoted strings/identifiers are kept verbatim; everything else is
+# whitespace-collapsed so formatting differences don't split the cache
+_TOKEN_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|\s+|[^'\"`\s]+")
+
+# String literals and comments, blanked by mask_literals()
+_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.)*'|--[^\n]*|/\*.*?\*/", re.S)
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace outside quotes and drop a trailing semicolon"""
+    parts = []
+    for token in _TOKEN_RE.findall(query.strip().rstrip(';').strip()):
+        parts.append(' ' if token.isspace() else token)
+    return ''.join(parts)
+
+
+def mask_literals(query: str) -> str:
+    """Blank out string literals and comments, keeping offsets
+
+    Lets callers search a query for keywords without matching text inside
+    strings or comments, then slice the original query at the same offsets.
+    """
+    return _LITERAL_RE.sub(lambda m: ' ' * len(m.group(0)), query)
+
+
+def is_cacheable(query: str) -> bool:
+    """True for read-only statements whose result can be reused"""
+    head = query.lstrip().split(None, 1)
+    return bool(head) and head[0].lower().lstrip('(') in CACHEABLE_PREFIXES
+
+
+def make_cache_key(query: str, params=None, settings=None, scope: str = '') -> str:
+    """Stable key for a query, its parameters and settings
+
+    ``scope`` separates results per server/database/user.
+    """
+    material = '\x00'.join((
+        scope,
+        normalize_sql(query),
+        repr(sorted(params.items())) if isinstance(params, dict) else repr(params),
+        repr(sorted((settings or {}).items())),
+    ))
+    return 'clickhouse_railway:' + hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class CacheStats:
+    """Hit/miss/eviction counters for a ResultCache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.second_tier_hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0  # single results larger than the whole budget
+
+    def as_dict(self) -> dict:
+        stats = dict(vars(self))
+        lookups = self.hits + self.misses
+        stats['hit_ratio'] = self.hits / lookups if lookups else 0.0
+        return stats
+
+
+class ResultCache:
+    """Byte-bounded LRU of query results with per-entry TTLs
+
+    Entry size is the length of the pickled result, the same bytes that are
+    written to the second tier. When the budget is exceeded the least
+    recently used entries are evicted. ``second_tier`` needs ``get(key)``
+    and ``set(key, value, timeout=...)``; it is read on a local miss and
+    written on every store. Second-tier entries carry their wall-clock
+    expiry, so a promoted entry keeps only the lifetime it has left.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 default_ttl: float = DEFAULT_CACHE_TTL, second_tier=None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.second_tier = second_tier
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def _remove_locked(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _store_locked(self, key, value, size: int, ttl: float):
+        if key in self._entries:
+            self._remove_locked(key)
+        self._entries[key] = (value, size, time.monotonic() + ttl)
+        self._bytes += size
+        self.stats.stores += 1
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove_locked(oldest)
+            self.stats.evictions += 1
+
+    def get(self, key: str):
+        """Cached value or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, _, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return value
+                self._remove_locked(key)
+                self.stats.expirations += 1
+
+        if self.second_tier is not None:
+            try:
+                blob = self.second_tier.get(key)
+            except Exception as e:
+                log.warning(f"Result cache second tier read failed: {e}")
+                blob = None
+            if blob is not None:
+                try:
+                    expires_at, value = pickle.loads(blob)
+                    remaining = expires_at - time.time()
+                except (TypeError, ValueError):
+                    # Not written by ResultCache.set(); treat as a miss
+                    remaining = 0
+                if remaining > 0:
+                    with self._lock:
+                        self.stats.hits += 1
+                        self.stats.second_tier_hits += 1
+                        if len(blob) <= self.max_bytes:
+                            self._store_locked(key, value, len(blob), remaining)
+                    return value
+
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def ttl(self, key: str):
+        """Seconds until the local entry for ``key`` expires, or None if absent"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            remaining = entry[2] - time.monotonic()
+        return remaining if remaining > 0 else None
+
+    def set(self, key: str, value, ttl: float = None, size: int = None):
+        """Store a value; ``ttl`` of 0 skips caching
+
+        ``size`` skips pickling the value to measure it, for callers that
+        already hold its serialized form; a second tier still gets a pickle
+        of ``(expires_at, value)``.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        blob = None
+        if size is None or self.second_tier is not None:
+            blob = pickle.dumps((time.time() + ttl, value), protocol=pickle.HIGHEST_PROTOCOL)
+        if size is None:
+            size = len(blob)
+        with self._lock:
+            if size > self.max_bytes:
+                self.stats.rejected += 1
+            else:
+                self._store_locked(key, value, size, ttl)
+
+        if self.second_tier is not None:
+            try:
+                self.second_tier.set(key, blob, timeout=int(ttl))
+            except Exception as e:
+                log.warning(f"Result cache second tier write failed: {e}")
+
+    def invalidate(self, key: str = None):
+        """Drop one key (locally and in the second tier) or the whole local cache"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._remove_locked(key)
+        if key is not None and self.second_tier is not None:
+            try:
+                self.second_tier.delete(key)
+            except Exception as e:
+                log.warning(f"Result cache second tier delete failed: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = self.stats.as_dict()
+            stats.update(
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+            )
+        return stats
+
+
+class CoalescedWaitTimeout(Exception):
+    """Raised when a coalesced caller gives up waiting for the shared execution"""
+
+
+class _InFlightCall:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls into one execution
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait and receive the same result, or the same exception.
+    Nothing is kept once the call finishes, so this never serves stale data.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0  # executions saved
+        self.errors = 0
+        self.wait_timeouts = 0
+
+    def do(self, key: str, fn, timeout: float = None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _InFlightCall()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                    self.executions += 1
+                    if call.error is not None:
+                        self.errors += 1
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.wait_timeouts += 1
+            raise CoalescedWaitTimeout(
+                f"Gave up after {timeout}s waiting for an identical in-flight query"
+            )
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'wait_timeouts': self.wait_timeouts,
+                'in_flight': len(self._calls),
+            }
@@ -5,20 +5,141 @@ This module provides a custom engine that can connect to Railway ClickHouse
 using the clickhouse-driver directly, bypassing SQLAlchemy dialect issues.
 """
 
+import asyncio
+import csv
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 from clickhouse_driver import Client
 
+from clickhouse_railway_advisor import PatternRecorder
+from clickhouse_railway_balancer import (
+    DEFAULT_STRATEGY,
+    HostBalancer,
+    is_host_failure,
+    parse_hosts,
+)
+from clickhouse_railway_cache import (
+    DEFAULT_CACHE_TTL,
+    CoalescedWaitTimeout,
+    ResultCache,
+    SingleFlight,
+    is_cacheable,
+    make_cache_key,
+)
+from clickhouse_railway_hedge import HedgeAttempt, HedgeRace
+from clickhouse_railway_ingest import (
+    BulkLoader,
+    DEFAULT_UPLOAD_FOLDER,
+    resolve_upload_path,
+)
+from clickhouse_railway_metadata import DEFAULT_METADATA_TTL, MetadataCache
+from clickhouse_railway_metrics import (
+    DEFAULT_HISTORY,
+    QueryInstrumentation,
+    capture_profile_events,
+)
+from clickhouse_railway_pool import (
+    ClickHousePool,
+    DEFAULT_CHECKOUT_TIMEOUT,
+    DEFAULT_HEALTH_CHECK_INTERVAL,
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_MAX_SIZE,
+    DEFAULT_MIN_SIZE,
+)
+from clickhouse_railway_registry import EngineRegistry
+from clickhouse_railway_result import (
+    TRUNCATED_METADATA_KEY,
+    BatchQueryResult,
+    ColumnarResult,
+    RowResult,
+)
+from clickhouse_railway_sampling import ApproximateExecutor, DEFAULT_LATENCY_BUDGET
+from clickhouse_railway_settings import (
+    DEFAULT_PROFILE,
+    DEFAULT_ROW_LIMIT,
+    QueryDeadline,
+    QueryTimeoutError,
+    new_query_id,
+    push_down_row_limit,
+    resolve_settings,
+)
+from clickhouse_railway_timeseries import TimeBucketCache
+
 log = logging.getLogger(__name__)
 
+SUPPORTED_COMPRESSION = ('lz4', 'lz4hc', 'zstd')
+
+
+def _detached(result):
+    """A caller's own copy of a cached or shared ``RowResult``"""
+    return result.copy() if isinstance(result, RowResult) else result
+
+
 class ClickHouseRailwayEngine:
     """Custom ClickHouse engine for Railway compatibility"""
 
-    def __init__(self, uri: str):
+    def __init__(self, uri: str,
+                 pool_min_size: int = DEFAULT_MIN_SIZE,
+                 pool_max_size: int = DEFAULT_MAX_SIZE,
+                 pool_idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 pool_health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL,
+                 pool_timeout: float = DEFAULT_CHECKOUT_TIMEOUT,
+                 metadata_ttl: float = DEFAULT_METADATA_TTL,
+                 max_concurrency: int = None,
+                 cache_max_bytes: int = 0,
+                 cache_ttl: float = DEFAULT_CACHE_TTL,
+                 cache_second_tier=None,
+                 coalesce: bool = True,
+                 query_hooks=None,
+                 metrics_history: int = DEFAULT_HISTORY,
+                 hedge_policy=None,
+                 row_limit: int = DEFAULT_ROW_LIMIT,
+                 pattern_log: str = None):
         self.uri = uri
-        self.client = None
+        self.pool = None
+        self._pool_options = {
+            'min_size': pool_min_size,
+            'max_size': pool_max_size,
+            'idle_timeout': pool_idle_timeout,
+            'health_check_interval': pool_health_check_interval,
+            'checkout_timeout': pool_timeout,
+        }
+        self._pool_lock = threading.Lock()
+        # Cap on queries this engine runs at once for async/batch callers
+        self.max_concurrency = max_concurrency or pool_max_size
+        self._executor = None
+        self.last_used = time.monotonic()
         self._parse_uri()
+        # Table/column metadata; call self.metadata.invalidate() after DDL
+        self.metadata = MetadataCache(self, ttl=metadata_ttl)
+        # Result cache is opt-in: cache_max_bytes=0 disables it
+        self.result_cache = None
+        if cache_max_bytes:
+            self.result_cache = ResultCache(
+                max_bytes=cache_max_bytes,
+                default_ttl=cache_ttl,
+                second_tier=cache_second_tier,
+            )
+        # Per-bucket cache for execute_timeseries(); uses result_cache when enabled
+        self.timeseries = TimeBucketCache(self)
+        # Sampled execution for exploratory charts, see execute_approx()
+        self.approximate = ApproximateExecutor(self)
+        # Identical read-only queries running at the same time share one execution
+        self.inflight = SingleFlight() if coalesce else None
+        # Per-query timings and server counters, see clickhouse_railway_metrics
+        self.instrumentation = QueryInstrumentation(query_hooks, history=metrics_history)
+        # Optional JSON-lines log of query shapes and costs for the rollup advisor
+        if pattern_log:
+            self.instrumentation.add_hook(PatternRecorder(pattern_log))
+        # Optional HedgePolicy: duplicate slow read-only queries to another host
+        self.hedging = hedge_policy
+        # Read-only queries stop on the server after this many rows (0: no limit)
+        self.row_limit = row_limit
 
     def _parse_uri(self):
         """Parse the ClickHouse URI to extract connection parameters"""
@@ -44,6 +165,10 @@ class ClickHouseRailwayEngine:
                 self.password = ''
                 host_port_db = connection_str
 
+            # Optional tuning parameters after '?', e.g. ?compression=lz4&max_block_size=65536
+            host_port_db, _, query_string = host_port_db.partition('?')
+            self._parse_options(dict(parse_qsl(query_string)))
+
             # Parse host:port/database
             if '/' in host_port_db:
                 host_port, self.database = host_port_db.split('/', 1)
@@ -51,60 +176,798 @@ class ClickHouseRailwayEngine:
                 host_port = host_port_db
                 self.database = 'default'
 
-            if ':' in host_port:
-                self.host = host_port.split(':')[0]
-                self.port = int(host_port.split(':')[1])
-            else:
-                self.host = host_port
-                self.port = 9000
+            # One or more hosts: host1:port1,host2:port2
+            self.hosts = parse_hosts(host_port)
+            self.host, self.port = self.hosts[0]
         else:
             raise ValueError(f"Unsupported URI format: {self.uri}")
 
+    def _parse_options(self, options: dict):
+        """Split URI query parameters into client options and query settings
+
+        ``compression`` (lz4, lz4hc, zstd or false) and ``compress_block_size``
+        shape the wire format; ``connect_timeout`` / ``send_receive_timeout``
+        tune the socket; ``max_block_size`` sets the server's block size for
+        every query, on top of the settings profile; ``load_balancing``
+        (round_robin or least_outstanding) applies when several hosts are given.
+        """
+        options = dict(options)
+        compression = options.pop('compression', 'false').lower()
+        if compression in ('', 'false', 'none', '0'):
+            compression = False
+        elif compression in ('true', '1'):
+            compression = 'lz4'
+        elif compression not in SUPPORTED_COMPRESSION:
+            raise ValueError(
+                f"Unsupported compression {compression!r}; "
+                f"expected one of {SUPPORTED_COMPRESSION} or false"
+            )
+        self.client_options = {'compression': compression}
+        if 'compress_block_size' in options:
+            self.client_options['compress_block_size'] = int(options.pop('compress_block_size'))
+        for name in ('connect_timeout', 'send_receive_timeout'):
+            if name in options:
+                self.client_options[name] = float(options.pop(name))
+
+        self.load_balancing = options.pop('load_balancing', DEFAULT_STRATEGY)
+
+        self.engine_settings = {}
+        if 'max_block_size' in options:
+            self.engine_settings['max_block_size'] = int(options.pop('max_block_size'))
+
+        for name in options:
+            log.warning(f"Ignoring unknown ClickHouse URI parameter: {name}")
+
+    def _create_client(self, host: str = None, port: int = None) -> Client:
+        """Build an unconnected client; the pool connects it on first use"""
+        return capture_profile_events(Client(
+            host=host or self.host,
+            port=port or self.port,
+            user=self.username,
+            password=self.password,
+            database=self.database,
+            **self.client_options
+        ))
+
     def connect(self):
-        """Create a ClickHouse client connection"""
+        """Create the client pool and verify the server accepts our credentials
+
+        With several hosts the pool is a ``HostBalancer`` holding one pool
+        per host; connecting succeeds once any host accepts the handshake.
+        """
+        with self._pool_lock:
+            if self.pool is not None:
+                return self.pool
+            if len(self.hosts) == 1:
+                pool = ClickHousePool(self._create_client, **self._pool_options)
+            else:
+                pool = HostBalancer(
+                    self.hosts,
+                    lambda host, port: ClickHousePool(
+                        lambda: self._create_client(host, port), **self._pool_options
+                    ),
+                    strategy=self.load_balancing,
+                )
+            tried, address = [], None
+            while address is None:
+                try:
+                    # The handshake authenticates without a SELECT 1 round-trip
+                    with self._checkout(pool, tried) as client:
+                        tried.append(self._client_address(client))
+                        client.connection.force_connect()
+                    address = tried[-1]
+                except Exception as e:
+                    log.error(f"Failed to connect to ClickHouse: {e}")
+                    if len(tried) >= len(self.hosts) or not is_host_failure(e):
+                        pool.close()
+                        raise
+            self.pool = pool
+            log.info(f"Successfully connected to ClickHouse at {address}")
+            return pool
+
+    def _checkout(self, pool, exclude=()):
+        """Check out a client, avoiding hosts in ``exclude`` when balancing"""
+        self.last_used = time.monotonic()
+        if isinstance(pool, HostBalancer):
+            return pool.connection(exclude=exclude)
+        return pool.connection()
+
+    def _client_address(self, client) -> str:
+        hosts = getattr(client.connection, 'hosts', None)
+        host, port = hosts[0] if hosts else (self.host, self.port)
+        return f'{host}:{port}'
+
+    def close(self):
+        """Close every pooled client"""
+        with self._pool_lock:
+            pool, self.pool = self.pool, None
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if pool is not None:
+            pool.close()
+
+    def ping(self) -> bool:
+        """True if a pooled client can round-trip a ping to the server"""
         try:
-            self.client = Client(
-                host=self.host,
-                port=self.port,
-                user=self.username,
-                password=self.password,
-                database=self.database
+            pool = self.pool or self.connect()
+            with self._checkout(pool) as client:
+                # Connects a fresh client, or pings (and reconnects) a pooled one
+                client.connection.force_connect()
+            return True
+        except Exception as e:
+            log.error(f"ClickHouse ping failed: {e}")
+            return False
+
+    def pool_stats(self) -> dict:
+        """Pool size, checkout and wait-time statistics"""
+        return self.pool.get_stats() if self.pool else {}
+
+    def execute(self, query: str, cache_ttl: float = None, use_cache: bool = True,
+                profile: str = DEFAULT_PROFILE, timeout: float = None,
+                row_limit: int = None, **kwargs):
+        """Execute a query using the clickhouse-driver client
+
+        SELECT-like queries return a ``RowResult``: the server's column names
+        and types plus the driver's row tuples, with rows addressable by
+        position or name. INSERTs with data return the inserted row count.
+
+        When the result cache is enabled, read-only queries are served from
+        it; ``cache_ttl`` overrides the cache's default TTL for this query
+        (0 skips storing) and ``use_cache=False`` bypasses it entirely.
+        Identical read-only queries already in flight are coalesced: every
+        caller gets the one server execution's result or exception, or
+        ``QueryTimeoutError`` once its own ``timeout`` passes first. Cached
+        and coalesced callers each get their own ``RowResult``, so trimming
+        or reordering ``rows`` never leaks into another caller.
+
+        Settings come from the named ``profile`` (see
+        ``clickhouse_railway_settings.SETTINGS_PROFILES``) merged with any
+        ``settings`` passed in. Each query gets a ``query_id`` (generated
+        unless given) and is killed with ``KILL QUERY`` if it is still
+        running after ``timeout`` seconds (default: the profile's
+        ``max_execution_time``), raising ``QueryTimeoutError``.
+
+        Read-only queries return at most ``row_limit`` rows (default: the
+        engine's ``row_limit``; 0 disables it). The limit is pushed down so
+        the server stops producing rows, and a cut-off result has
+        ``truncated`` set.
+        """
+        row_limit = self.row_limit if row_limit is None else row_limit
+        # Metrics and the pattern recorder see the caller's SQL, not the
+        # row-limit wrapper sent to the server
+        statement = query
+        if row_limit and not kwargs.get('columnar') and is_cacheable(query):
+            query, kwargs['settings'] = push_down_row_limit(
+                query, row_limit, kwargs.get('settings')
+            )
+        else:
+            row_limit = None
+
+        cache = self.result_cache if use_cache else None
+        cache_key = None
+        if ((cache is not None or self.inflight is not None)
+                and not kwargs.get('columnar') and is_cacheable(query)):
+            # Keyed on the settings the query actually runs with, so profiles
+            # that change results (row caps, sampling, overflow modes) never
+            # share an entry; the timeout only bounds the run and is left out
+            resolved, _ = resolve_settings(
+                profile, kwargs.get('settings'), None, self.engine_settings
+            )
+            cache_key = make_cache_key(
+                query, kwargs.get('params'), resolved, scope=self._cache_scope(),
+            )
+        if cache is not None and cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return _detached(cached)
+
+        def run():
+            result = self._execute_uncached(
+                query, profile, timeout, statement=statement, **kwargs
+            )
+            if row_limit and isinstance(result, RowResult) and len(result.rows) > row_limit:
+                result.rows = result.rows[:row_limit]
+                result.truncated = True
+            if cache is not None and cache_key is not None:
+                cache.set(cache_key, result, ttl=cache_ttl)
+            return result
+
+        if self.inflight is not None and cache_key is not None:
+            # A caller joining a slower leader still gives up at its own deadline
+            _, deadline = resolve_settings(
+                profile, kwargs.get('settings'), timeout, self.engine_settings
+            )
+            kwargs['query_id'] = kwargs.get('query_id') or new_query_id()
+            try:
+                return _detached(self.inflight.do(cache_key, run, timeout=deadline))
+            except CoalescedWaitTimeout as e:
+                raise QueryTimeoutError(kwargs['query_id'], deadline, killed=False) from e
+        return _detached(run()) if cache_key is not None else run()
+
+    def execute_timeseries(self, query: str, bucket_column: str, bucket_seconds: int,
+                           start, end, **kwargs) -> RowResult:
+        """Execute a query grouped by time bucket, caching closed buckets
+
+        ``query`` filters its time column with ``%(start)s`` / ``%(end)s``
+        and returns the bucket start in ``bucket_column``; only the open
+        tail and buckets missing from the cache are read from ClickHouse.
+        See ``clickhouse_railway_timeseries.TimeBucketCache``.
+        """
+        return self.timeseries.execute(
+            query, bucket_column, bucket_seconds, start, end, **kwargs
+        )
+
+    def execute_approx(self, query: str, latency_budget: float = DEFAULT_LATENCY_BUDGET,
+                       **kwargs):
+        """Answer a single-table SELECT from a sample sized to ``latency_budget``
+
+        Uses ``SAMPLE`` on tables with a sampling key and a ``LIMIT``-bounded
+        scan otherwise; queries that can't be rewritten run exactly. Returns
+        an ``ApproximateResult`` carrying the fraction actually read and a
+        relative error estimate. See ``clickhouse_railway_sampling``.
+        """
+        return self.approximate.execute(query, latency_budget, **kwargs)
+
+    def execute_progressive(self, query: str, latency_budget: float = DEFAULT_LATENCY_BUDGET,
+                            total_budget: float = None, **kwargs):
+        """Yield a fast sampled answer, then refinements at larger sample rates
+
+        Refinement ends with the exact result, or earlier once the next step
+        would not fit in ``total_budget`` seconds.
+        """
+        return self.approximate.execute_progressive(
+            query, latency_budget, total_budget, **kwargs
+        )
+
+    def _cache_scope(self) -> str:
+        return f"{self.username}@{self.host}:{self.port}/{self.database}"
+
+    def _execute_uncached(self, query: str, profile: str = DEFAULT_PROFILE,
+                          timeout: float = None, statement: str = None, **kwargs):
+        """Run ``query`` on the server; ``statement`` is the SQL to record (default: ``query``)"""
+        pool = self.pool or self.connect()
+        statement = statement or query
+        kwargs.pop('with_column_types', None)
+        columnar = kwargs.get('columnar', False)
+        settings, deadline = resolve_settings(
+            profile, kwargs.pop('settings', None), timeout, self.engine_settings
+        )
+        query_id = kwargs.pop('query_id', None) or new_query_id()
+        # Plain SELECTs are read block by block so time to first block is known;
+        # INSERTs with data and driver-specific options go through execute()
+        streamed = not columnar and set(kwargs) <= {'params'} and is_cacheable(query)
+
+        hedged = (streamed and self.hedging is not None
+                  and isinstance(pool, HostBalancer))
+
+        # A read-only query that hit a connection-level failure is retried
+        # once per remaining host
+        tried = []
+        while True:
+            try:
+                if hedged:
+                    result = self._execute_hedged(
+                        pool, tried, query, kwargs.get('params'), settings,
+                        deadline, query_id, profile, statement
+                    )
+                else:
+                    result = self._execute_once(
+                        pool, tried, query, settings, deadline, query_id,
+                        profile, streamed, kwargs, statement
+                    )
+                break
+            except Exception as e:
+                if (streamed and is_host_failure(e) and tried
+                        and len(tried) < len(self.hosts)):
+                    log.warning(f"Query {query_id} failed on {tried[-1]}: {e}; trying another host")
+                    continue
+                log.error(f"Query execution failed: {e}")
+                raise
+
+        if not isinstance(result, tuple):
+            return result
+        data, columns_with_types = result
+        if columnar:
+            return data
+        return RowResult(data, columns_with_types)
+
+    def _execute_once(self, pool, tried: list, query: str, settings, deadline,
+                      query_id: str, profile: str, streamed: bool, kwargs,
+                      statement: str):
+        """Run a query on one host, appending that host to ``tried``"""
+        with self.instrumentation.record(query_id, statement, profile) as metrics, \
+                self._checkout(pool, tried) as client, \
+                QueryDeadline(query_id, deadline, self.kill_query):
+            tried.append(self._client_address(client))
+            metrics.checked_out(tried[-1])
+            if streamed:
+                result = self._read_rows(
+                    client, query, kwargs.get('params'), settings, query_id, metrics
+                )
+            else:
+                result = client.execute(
+                    query, with_column_types=True, settings=settings,
+                    query_id=query_id, **kwargs
+                )
+            metrics.read_client(client)
+        return result
+
+    def _read_rows(self, client, query: str, params, settings, query_id: str,
+                   metrics, on_first_block=None):
+        """Read a whole SELECT as ``(rows, columns_with_types)``, timing each block
+
+        ``on_first_block`` is called when the first block with rows arrives;
+        if it returns False reading stops and None is returned, leaving the
+        query running for the caller to cancel.
+        """
+        columns_with_types, rows = None, []
+        for block in self._iter_blocks(client, query, params, settings, query_id):
+            metrics.block_received(block.num_rows)
+            if columns_with_types is None:
+                columns_with_types = block.columns_with_types
+            if block.num_rows:
+                if not rows and on_first_block is not None and not on_first_block():
+                    return None
+                with metrics.converting():
+                    rows.extend(block.get_rows())
+        return rows, columns_with_types or []
+
+    def _run_attempt(self, pool, race: HedgeRace, attempt: HedgeAttempt, exclude,
+                     query: str, params, settings, deadline, profile: str,
+                     statement: str):
+        """Run one copy of a hedged query; None when the other copy won"""
+        with self.instrumentation.record(attempt.query_id, statement, profile) as metrics, \
+                self._checkout(pool, exclude) as client:
+            attempt.host = self._client_address(client)
+            metrics.checked_out(attempt.host)
+            if race.lost(attempt):
+                return None
+
+            def on_first_block():
+                attempt.first_block = time.perf_counter() - attempt.started
+                return race.claim(attempt)
+
+            result = None
+            try:
+                with QueryDeadline(attempt.query_id, deadline, self.kill_query):
+                    result = self._read_rows(
+                        client, query, params, settings, attempt.query_id,
+                        metrics, on_first_block
+                    )
+                if result is not None:
+                    metrics.read_client(client)
+            finally:
+                if result is None and getattr(client.connection, 'is_query_executing', False):
+                    self._cancel_stream(client)
+        # An empty result claims the race when it finishes
+        return result if result is not None and race.claim(attempt) else None
+
+    def _execute_hedged(self, pool, tried: list, query: str, params, settings,
+                        deadline, query_id: str, profile: str, statement: str):
+        """Run a read-only query, duplicating it on another host if it is slow
+
+        The primary runs on the calling thread. If it has no data block after
+        ``hedging.delay()`` seconds and the budget allows, a timer thread
+        sends a copy (with its own query_id) to a different host. The first
+        copy to deliver a block wins; the loser is killed on its host.
+        """
+        policy = self.hedging
+        policy.start_request()
+
+        def cancel(attempt):
+            if attempt.host is not None:
+                self.kill_query(attempt.query_id, attempt.host)
+
+        race = HedgeRace(cancel)
+        primary = HedgeAttempt(query_id)
+        race.join(primary)
+
+        def run(attempt, exclude):
+            try:
+                attempt.result = self._run_attempt(
+                    pool, race, attempt, exclude, query, params, settings,
+                    deadline, profile, statement
+                )
+            except Exception as e:
+                attempt.error = e
+            finally:
+                attempt.done.set()
+
+        def launch_hedge():
+            if primary.host is None or primary.done.is_set() or race.winner is not None:
+                return
+            if not policy.try_hedge():
+                return
+            hedge = HedgeAttempt(new_query_id(), hedge=True)
+            if race.join(hedge):
+                log.debug(f"Hedging query {query_id} as {hedge.query_id}")
+                run(hedge, tried + [primary.host])
+
+        timer = None
+        delay = policy.delay()
+        if delay is not None and len(self.hosts) - len(tried) > 1:
+            timer = threading.Timer(delay, launch_hedge)
+            timer.daemon = True
+            timer.start()
+
+        run(primary, tried)
+        if timer is not None:
+            timer.cancel()
+        if primary.host is not None:
+            tried.append(primary.host)
+        if primary.error is None or race.lost(primary):
+            policy.observe(
+                primary.first_block if primary.first_block is not None
+                else time.perf_counter() - primary.started
             )
-            # Test connection
-            self.client.execute('SELECT 1')
-            log.info(f"Successfully connected to ClickHouse at {self.host}:{self.port}")
-            return self.client
+        if primary.result is not None:
+            race.close()
+            return primary.result
+
+        race.close()
+        hedge = race.hedge
+        if hedge is None:
+            raise primary.error
+        hedge.done.wait()
+        if hedge.result is not None:
+            policy.record_win()
+            return hedge.result
+        raise primary.error or hedge.error
+
+    def kill_query(self, query_id: str, host: str = None):
+        """Ask the server to stop a running query
+
+        Uses a throwaway client so a kill never waits behind a busy pool.
+        With several hosts and no ``host:port`` given, the KILL is sent to
+        every host, since only the one running the query knows it.
+        """
+        if host is not None:
+            name, _, port = host.rpartition(':')
+            targets = [(name, int(port))]
+        else:
+            targets = self.hosts
+        errors = []
+        for target_host, target_port in targets:
+            client = self._create_client(target_host, target_port)
+            try:
+                client.execute(
+                    'KILL QUERY WHERE query_id = %(query_id)s ASYNC',
+                    {'query_id': query_id},
+                )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                client.disconnect()
+        if len(errors) == len(targets):
+            raise errors[0]
+
+    def cache_stats(self) -> dict:
+        """Result cache hit/miss/eviction counters and byte usage"""
+        return self.result_cache.get_stats() if self.result_cache else {}
+
+    def coalescing_stats(self) -> dict:
+        """Executions run and executions saved by in-flight coalescing"""
+        return self.inflight.get_stats() if self.inflight else {}
+
+    def timeseries_stats(self) -> dict:
+        """Closed buckets served from cache vs. queried, and range queries issued"""
+        return self.timeseries.get_stats()
+
+    def approx_stats(self) -> dict:
+        """Sampled/limited/exact answers, refinements and learned scan rates"""
+        return self.approximate.get_stats()
+
+    def hedge_stats(self) -> dict:
+        """Hedge rate, hedge win rate, budget denials and the current hedge delay"""
+        return self.hedging.get_stats() if self.hedging else {}
+
+    def query_report(self, profile: str = None) -> dict:
+        """Percentiles of queueing, first-block, total and conversion time and rows/bytes read
+
+        Covers the most recent ``metrics_history`` server executions,
+        optionally only those run under one settings profile.
+        """
+        return self.instrumentation.report(profile)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._pool_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix='clickhouse-railway',
+                )
+            return self._executor
+
+    async def execute_async(self, query: str, **kwargs):
+        """Awaitable execute(), run on the engine's bounded worker threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), lambda: self.execute(query, **kwargs)
+        )
+
+    @staticmethod
+    def _batch_item(item):
+        """Normalize a batch entry: SQL string, (sql, params) or execute() kwargs"""
+        if isinstance(item, str):
+            return item, {}
+        if isinstance(item, dict):
+            kwargs = dict(item)
+            return kwargs.pop('query'), kwargs
+        query, params = item
+        return query, {'params': params}
+
+    async def execute_many_async(self, queries, concurrency: int = None) -> list:
+        """Run a batch of queries concurrently, e.g. every tile of a dashboard
+
+        At most ``max_concurrency`` queries run at once across the whole
+        engine; ``concurrency`` lowers the cap for this batch only. Failures
+        are captured per query, so one broken chart does not fail the rest.
+        Returns one ``BatchQueryResult`` per query, in input order.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        semaphore = asyncio.Semaphore(concurrency or self.max_concurrency)
+
+        def timed(query, kwargs):
+            started = time.perf_counter()
+            try:
+                return self.execute(query, **kwargs), None, started, time.perf_counter()
+            except Exception as e:
+                return None, e, started, time.perf_counter()
+
+        async def run(item):
+            query, kwargs = self._batch_item(item)
+            async with semaphore:
+                submitted = time.perf_counter()
+                result, error, started, finished = await loop.run_in_executor(
+                    executor, timed, query, kwargs
+                )
+            return BatchQueryResult(
+                query, result, error,
+                queued=started - submitted, elapsed=finished - started,
+            )
+
+        return await asyncio.gather(*(run(item) for item in queries))
+
+    def execute_many(self, queries, concurrency: int = None) -> list:
+        """Synchronous wrapper around ``execute_many_async()``"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.execute_many_async(queries, concurrency))
+        raise RuntimeError(
+            "execute_many() cannot be called from a running event loop; "
+            "await execute_many_async() instead"
+        )
+
+    def _iter_blocks(self, client, query: str, params=None, settings=None,
+                     query_id: str = None):
+        """Send a query on ``client`` and yield its blocks as they arrive
+
+        The first block is the zero-row header carrying ``columns_with_types``.
+        """
+        with client.disconnect_on_error(query, settings):
+            if params is not None:
+                query = client.substitute_params(
+                    query, params, client.connection.context
+                )
+            client.connection.send_query(query, query_id=query_id, params=params)
+            client.connection.send_external_tables(None)
+
+        for packet in client.packet_generator():
+            block = getattr(packet, 'block', None)
+            if block is not None:
+                yield block
+
+    def _cancel_stream(self, client):
+        """Cancel a partially read query and drain it without keeping the data"""
+        try:
+            client.connection.send_cancel()
+            for _ in client.packet_generator():
+                pass
+        except Exception as e:
+            log.warning(f"Failed to cancel streaming query cleanly: {e}")
+            client.disconnect()
+
+    def execute_iter(self, query: str, params=None, settings=None,
+                     query_id: str = None, with_column_types: bool = False,
+                     blocks: bool = False, profile: str = 'export',
+                     timeout: float = None):
+        """Stream a SELECT, yielding row tuples as each block arrives
+
+        Only the current block is held in memory. With ``blocks=True`` each
+        block is yielded as one list of rows instead. With
+        ``with_column_types=True`` the first item is the list of
+        ``(name, type)`` pairs, as in clickhouse-driver's ``execute_iter``.
+        Stopping early (``break``, ``close()``) cancels the query on the
+        server and returns the client to the pool. Profiles and deadlines
+        work as in ``execute()``; the deadline covers the whole stream.
+        """
+        pool = self.pool or self.connect()
+        settings, deadline = resolve_settings(
+            profile, settings, timeout, self.engine_settings
+        )
+        query_id = query_id or new_query_id()
+        try:
+            with self.instrumentation.record(query_id, query, profile) as metrics, \
+                    self._checkout(pool) as client:
+                metrics.checked_out(self._client_address(client))
+                finished = False
+                try:
+                    with QueryDeadline(query_id, deadline, self.kill_query):
+                        header_sent = not with_column_types
+                        for block in self._iter_blocks(client, query, params, settings, query_id):
+                            metrics.block_received(block.num_rows)
+                            if not header_sent:
+                                header_sent = True
+                                yield block.columns_with_types
+                            if not block.num_rows:
+                                continue
+                            with metrics.converting():
+                                rows = block.get_rows()
+                            if blocks:
+                                yield rows
+                            else:
+                                yield from rows
+                    metrics.read_client(client)
+                    finished = True
+                finally:
+                    if not finished and getattr(client.connection, 'is_query_executing', False):
+                        self._cancel_stream(client)
         except Exception as e:
-            log.error(f"Failed to connect to ClickHouse: {e}")
+            log.error(f"Streaming query failed: {e}")
             raise
 
-    def execute(self, query: str, **kwargs):
-        """Execute a query using the clickhouse-driver client"""
-        if not self.client:
-            self.connect()
+    def execute_columnar(self, query: str, params=None, settings=None,
+                         query_id: str = None, downcast: bool = True,
+                         arrow: bool = False, profile: str = DEFAULT_PROFILE,
+                         timeout: float = None, row_limit: int = None):
+        """Run a SELECT and return it column-wise, without per-row Python objects
 
+        Blocks are decoded by clickhouse-driver's NumPy readers and joined per
+        column into a ``ColumnarResult``. LowCardinality columns arrive as
+        pandas Categoricals; ``downcast`` additionally shrinks integer dtypes
+        and turns repetitive string columns into Categoricals. With
+        ``arrow=True`` the driver builds a ``pyarrow.Table`` directly.
+        Profiles, deadlines and ``row_limit`` work as in ``execute()``; a
+        cut-off Arrow table carries ``truncated: true`` in its schema
+        metadata (see ``is_truncated()``).
+        """
+        pool = self.pool or self.connect()
+        row_limit = self.row_limit if row_limit is None else row_limit
+        statement = query
+        if row_limit:
+            query, settings = push_down_row_limit(query, row_limit, settings)
+        settings, deadline = resolve_settings(
+            profile, settings, timeout, self.engine_settings
+        )
+        query_id = query_id or new_query_id()
         try:
-            result = self.client.execute(query, **kwargs)
-
-            # Convert clickhouse-driver format to something more standard
-            if isinstance(result, list) and len(result) > 0:
-                if isinstance(result[0], tuple):
-                    # Return list of dicts for better compatibility
-                    columns = [f'col_{i}' for i in range(len(result[0]))]
-                    return [dict(zip(columns, row)) for row in result]
-                else:
+            with self.instrumentation.record(query_id, statement, profile) as metrics:
+                with self._checkout(pool) as client, \
+                        QueryDeadline(query_id, deadline, self.kill_query):
+                    metrics.checked_out(self._client_address(client))
+                    if arrow:
+                        table = client.query_arrow(
+                            query, params=params, settings=settings, query_id=query_id
+                        )
+                        metrics.read_client(client)
+                        if row_limit and table.num_rows > row_limit:
+                            metadata = dict(table.schema.metadata or {})
+                            metadata[TRUNCATED_METADATA_KEY] = b'true'
+                            table = table.slice(0, row_limit).replace_schema_metadata(metadata)
+                        return table
+                    settings['use_numpy'] = True
+                    columns_with_types, chunks = None, []
+                    for block in self._iter_blocks(client, query, params, settings, query_id):
+                        metrics.block_received(block.num_rows)
+                        if columns_with_types is None:
+                            columns_with_types = block.columns_with_types
+                        if block.num_rows:
+                            chunks.append(block.get_columns())
+                    metrics.read_client(client)
+                with metrics.converting():
+                    result = ColumnarResult.from_chunks(
+                        columns_with_types or [], chunks, downcast=downcast
+                    )
+                    if row_limit and result.num_rows > row_limit:
+                        result.columns = [values[:row_limit] for values in result.columns]
+                        result.truncated = True
                     return result
-            return result
+        except Exception as e:
+            log.error(f"Columnar query execution failed: {e}")
+            raise
+
+    def execute_to_store(self, query: str, store, key: str, timeout: int = None,
+                         **kwargs) -> int:
+        """Run a SELECT as Arrow into a results store, returning the row count
+
+        ``store`` is anything with ``put_table(key, table, timeout)``, such as
+        superset_results_store.FileResultsBackend, whose ``read_page()`` then
+        serves the result a page at a time. Other keyword arguments go to
+        ``execute_columnar()``. The engine's ``row_limit`` does not apply
+        here, since the store exists to hold large results on disk; pass
+        ``row_limit`` explicitly to cap one.
+        """
+        kwargs.setdefault('row_limit', 0)
+        table = self.execute_columnar(query, arrow=True, **kwargs)
+        if not store.put_table(key, table, timeout):
+            raise RuntimeError(f"Results store rejected {key}")
+        return table.num_rows
+
+    def export_csv(self, query: str, fileobj, params=None, settings=None,
+                   header: bool = True) -> int:
+        """Stream a query result into a CSV file object, returning the row count"""
+        writer = csv.writer(fileobj)
+        stream = self.execute_iter(
+            query, params=params, settings=settings,
+            with_column_types=True, blocks=True
+        )
+        columns = next(stream)
+        if header:
+            writer.writerow([name for name, _ in columns])
+        count = 0
+        for rows in stream:
+            writer.writerows(rows)
+            count += len(rows)
+        return count
 
+    def insert_dataframe(self, table: str, dataframe, settings=None,
+                         profile: str = 'background', timeout: float = None) -> int:
+        """Insert a pandas DataFrame as native column blocks, returning the row count
+
+        Columns are matched by name, so the frame may hold a subset of the
+        table's columns in any order; the rest take their defaults.
+        """
+        pool = self.pool or self.connect()
+        settings, deadline = resolve_settings(
+            profile, settings, timeout, self.engine_settings
+        )
+        settings['use_numpy'] = True
+        columns = ', '.join(
+            '`' + str(name).replace('`', '\\`') + '`' for name in dataframe.columns
+        )
+        query = f'INSERT INTO {table} ({columns}) VALUES'
+        query_id = new_query_id()
+        try:
+            with self.instrumentation.record(query_id, query, profile) as metrics, \
+                    self._checkout(pool) as client, \
+                    QueryDeadline(query_id, deadline, self.kill_query):
+                metrics.checked_out(self._client_address(client))
+                inserted = client.insert_dataframe(
+                    query, dataframe, settings=settings, query_id=query_id
+                )
+                metrics.read_client(client)
+                return inserted
         except Exception as e:
-            log.error(f"Query execution failed: {e}")
+            log.error(f"Insert into {table} failed: {e}")
             raise
 
+    def load_file(self, table: str, path: str, format: str = None,
+                  upload_folder: str = None, progress=None, **options):
+        """Bulk-load a CSV/TSV/Parquet upload into ``table``
+
+        ``path`` is resolved inside the upload folder. Loader tuning
+        (``chunk_bytes``, ``batch_rows``, ``parse_workers``, ``max_pending``,
+        ``settings``) and format options (``delimiter``, ``header``,
+        ``column_names``, ``columns``) are passed through; see
+        ``clickhouse_railway_ingest.BulkLoader``. Returns the final
+        ``IngestProgress``.
+        """
+        loader_options = {
+            name: options.pop(name) for name in
+            ('chunk_bytes', 'batch_rows', 'parse_workers', 'max_pending', 'settings')
+            if name in options
+        }
+        path = resolve_upload_path(path, upload_folder or DEFAULT_UPLOAD_FOLDER)
+        loader = BulkLoader(self, table, progress=progress, **loader_options)
+        return loader.load(path, format=format, **options)
+
     def get_table_names(self):
         """Get list of tables in the database"""
         try:
-            result = self.execute('SHOW TABLES')
-            return [list(row.values())[0] for row in result] if result else []
+            return self.metadata.get_table_names()
         except Exception as e:
             log.error(f"Failed to get table names: {e}")
             return []
@@ -112,23 +975,21 @@ class ClickHouseRailwayEngine:
     def get_columns(self, table_name: str):
         """Get column information for a table"""
         try:
-            result = self.execute(f'DESCRIBE TABLE {table_name}')
-            columns = []
-            for row in result:
-                if isinstance(row, dict):
-                    columns.append({
-                        'name': list(row.values())[0],
-                        'type': list(row.values())[1],
-                        'nullable': True  # ClickHouse columns are generally nullable
-                    })
-            return columns
+            return self.metadata.get_columns(table_name)
         except Exception as e:
             log.error(f"Failed to get columns for table {table_name}: {e}")
             return []
 
-def create_railway_engine(uri: str) -> ClickHouseRailwayEngine:
-    """Factory function to create a Railway ClickHouse engine"""
-    return ClickHouseRailwayEngine(uri)
+# One engine per normalized URI + options for the whole process
+_registry = EngineRegistry(ClickHouseRailwayEngine)
+
+def create_railway_engine(uri: str, **options) -> ClickHouseRailwayEngine:
+    """Shared Railway ClickHouse engine for a URI
+
+    Callers passing an equivalent URI and the same constructor ``options``
+    get the same engine, pool and caches; see ``clickhouse_railway_registry``.
+    """
+    return _registry.get(uri, **options)
 
 # Test function
 def test_railway_connection():
@@ -141,15 +1002,15 @@ def test_railway_connection():
 
         # Test basic connection
         result = engine.execute('SELECT 1 as test_value')
-        print(f'✅ Custom engine connection successful! Test query returned: {result}')
+        print(f'✅ Custom engine connection successful! Test query returned: {result[0]}')
 
         # Test ClickHouse version
         version_result = engine.execute('SELECT version() as version')
-        print(f'✅ ClickHouse version: {version_result}')
+        print(f'✅ ClickHouse version: {version_result[0]["version"]}')
 
         # List available databases
         databases = engine.execute('SHOW DATABASES')
-        db_names = [list(row.values())[0] for row in databases] if databases else []
+        db_names = databases.column('name')
         print(f'✅ Available databases: {db_names}')
 
         # List tables
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Hedged requests for the Railway ClickHouse engine
+When a read-only query has not produced its first block within a recent
+latency percentile, a duplicate is sent to another replica; the first copy
+to answer wins and the other is cancelled. A token budget caps hedges to a
+fraction of traffic so a slow cluster never sees its load doubled.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HEDGE_PERCENTILE = 95  # hedge queries slower than this percentile
+DEFAULT_HEDGE_BUDGET = 0.1  # hedges allowed per query, on average
+DEFAULT_HEDGE_BURST = 10  # hedges that may be saved up for a burst
+DEFAULT_HEDGE_MIN_SAMPLES = 50  # latencies needed before hedging starts
+DEFAULT_HEDGE_WINDOW = 1000  # recent latencies the percentile is taken over
+DEFAULT_HEDGE_MIN_DELAY = 0.05  # never hedge sooner than this (seconds)
+
+
+class HedgePolicy:
+    """Decides when to hedge and keeps the hedge budget and statistics
+
+    The delay is the ``percentile`` of recent time-to-first-block samples,
+    floored at ``min_delay``. Each query earns ``budget`` tokens (capped at
+    ``burst``) and each hedge spends one, so over time at most ``budget``
+    of all queries are duplicated.
+    """
+
+    def __init__(self, percentile: float = DEFAULT_HEDGE_PERCENTILE,
+                 budget: float = DEFAULT_HEDGE_BUDGET,
+                 burst: float = DEFAULT_HEDGE_BURST,
+                 min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+                 window: int = DEFAULT_HEDGE_WINDOW,
+                 min_delay: float = DEFAULT_HEDGE_MIN_DELAY):
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._samples = deque(maxlen=window)
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def observe(self, latency: float):
+        """Record one primary's time to first block (or to cancellation)"""
+        with self._lock:
+            self._samples.append(latency)
+
+    def delay(self):
+        """Seconds to wait before hedging, or None until enough samples exist"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        index = min(len(samples) - 1, math.ceil(len(samples) * self.percentile / 100.0) - 1)
+        return max(self.min_delay, samples[max(index, 0)])
+
+    def start_request(self):
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def try_hedge(self) -> bool:
+        """Spend a budget token for a hedge; False when the budget is exhausted"""
+        with self._lock:
+            if self._tokens < 1:
+                self.budget_denied += 1
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def get_stats(self) -> dict:
+        delay = self.delay()
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'budget_denied': self.budget_denied,
+                'hedge_rate': self.hedges / self.requests if self.requests else 0.0,
+                'win_rate': self.hedge_wins / self.hedges if self.hedges else 0.0,
+                'delay': delay,
+                'samples': len(self._samples),
+            }
+
+
+class HedgeAttempt:
+    """One copy of a hedged query"""
+
+    __slots__ = ('query_id', 'hedge', 'host', 'started', 'first_block',
+                 'result', 'error', 'done')
+
+    def __init__(self, query_id: str, hedge: bool = False):
+        self.query_id = query_id
+        self.hedge = hedge
+        self.host = None
+        self.started = time.perf_counter()
+        self.first_block = None  # seconds from start, once a block with rows arrived
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class HedgeRace:
+    """Shared state of a primary and its hedge
+
+    The first attempt to ``claim`` (on its first data block, or on finishing
+    with an empty result) wins; ``cancel`` is called for every other attempt
+    still running. Once ``close`` is called no new hedge may join.
+    """
+
+    def __init__(self, cancel):
+        self.attempts = []
+        self.winner = None
+        self.closed = False
+        self._cancel = cancel
+        self._lock = threading.Lock()
+
+    def join(self, attempt: HedgeAttempt) -> bool:
+        with self._lock:
+            if self.closed or self.winner is not None:
+                return False
+            self.attempts.append(attempt)
+            return True
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+
+    def claim(self, attempt: HedgeAttempt) -> bool:
+        with self._lock:
+            if self.winner is not None:
+                return self.winner is attempt
+            self.winner = attempt
+            self.closed = True
+            losers = [other for other in self.attempts
+                      if other is not attempt and not other.done.is_set()]
+        for loser in losers:
+            try:
+                self._cancel(loser)
+            except Exception as e:
+                log.warning(f"Failed to cancel hedged query {loser.query_id}: {e}")
+        return True
+
+    def lost(self, attempt: HedgeAttempt) -> bool:
+        winner = self.winner
+        return winner is not None and winner is not attempt
+
+    @property
+    def hedge(self):
+        with self._lock:
+            return next((attempt for attempt in self.attempts if attempt.hedge), None)
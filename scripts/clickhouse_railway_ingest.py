@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Bulk file ingestion for the Railway ClickHouse engine
+Streams CSV/TSV/Parquet files from the Superset upload folder into a
+ClickHouse table as native-protocol column blocks. Chunks are parsed in
+parallel by pyarrow (which releases the GIL) while the previous chunk is
+being inserted, and the number of parsed-but-not-inserted chunks is capped,
+so memory stays bounded no matter how large the file is.
+"""
+
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', '/app/superset_home/uploads')
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024  # CSV bytes parsed per chunk
+DEFAULT_BATCH_ROWS = 500_000  # Parquet rows per chunk
+DEFAULT_PARSE_WORKERS = 4
+DEFAULT_MAX_PENDING = 4  # parsed chunks allowed to wait for insertion
+
+CSV_EXTENSIONS = ('.csv', '.tsv', '.txt')
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+# Compressed uploads by extension, as pyarrow's Codec.detect names them
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd', '.lz4': 'lz4', '.br': 'brotli',
+}
+
+
+def compression_for(path: str):
+    """pyarrow codec name for a compressed file, or None for plain text"""
+    lower = path.lower()
+    for extension, codec in COMPRESSION_EXTENSIONS.items():
+        if lower.endswith(extension):
+            return codec
+    return None
+
+
+def resolve_upload_path(path: str, upload_folder: str = DEFAULT_UPLOAD_FOLDER) -> str:
+    """Absolute path of an upload, refusing anything outside the upload folder"""
+    root = os.path.realpath(upload_folder)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"{path!r} is outside the upload folder {root}")
+    if not os.path.isfile(resolved):
+        raise FileNotFoundError(resolved)
+    return resolved
+
+
+def arrow_type_for(clickhouse_type: str):
+    """pyarrow type to parse a CSV column as, or None to let pyarrow infer"""
+    import pyarrow as pa
+
+    inner = clickhouse_type
+    for wrapper in ('LowCardinality(', 'Nullable('):
+        if inner.startswith(wrapper):
+            inner = inner[len(wrapper):-1]
+    simple = {
+        'Int8': pa.int8(), 'Int16': pa.int16(), 'Int32': pa.int32(), 'Int64': pa.int64(),
+        'UInt8': pa.uint8(), 'UInt16': pa.uint16(), 'UInt32': pa.uint32(),
+        'UInt64': pa.uint64(), 'Float32': pa.float32(), 'Float64': pa.float64(),
+        'Bool': pa.bool_(), 'String': pa.string(), 'UUID': pa.string(),
+        'Date': pa.date32(), 'Date32': pa.date32(),
+    }
+    if inner in simple:
+        return simple[inner]
+    if inner.startswith(('FixedString', 'Enum')):
+        return pa.string()
+    if inner.startswith('DateTime'):
+        return pa.timestamp('s') if inner == 'DateTime' or inner.startswith('DateTime(') else None
+    return None
+
+
+def to_frame(table):
+    """pandas DataFrame of an Arrow table/batch, in dtypes the driver's NumPy writers accept"""
+    import pandas as pd
+
+    frame = table.to_pandas()
+    for name, dtype in frame.dtypes.items():
+        # pandas 3 maps Arrow strings to StringDtype; the driver writes object arrays
+        if isinstance(dtype, pd.StringDtype):
+            frame[name] = frame[name].astype(object)
+    return frame
+
+
+class IngestProgress:
+    """Running totals reported to the progress callback"""
+
+    def __init__(self, total_bytes: int):
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.rows = 0
+        self.chunks = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def fraction(self) -> float:
+        return self.bytes_read / self.total_bytes if self.total_bytes else 1.0
+
+    def __repr__(self):
+        return (
+            f'IngestProgress(rows={self.rows}, chunks={self.chunks}, '
+            f'{self.fraction:.0%} of {self.total_bytes} bytes, {self.elapsed:.1f}s)'
+        )
+
+
+class BulkLoader:
+    """Load one file into one table through the engine's native inserts
+
+    ``parse_workers`` threads parse chunks while the loader inserts them in
+    file order; at most ``max_pending`` parsed chunks are held at once,
+    which is the backpressure that keeps memory bounded when ClickHouse is
+    slower than parsing. ``progress`` is called with an ``IngestProgress``
+    after every inserted chunk.
+    """
+
+    def __init__(self, engine, table: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                 batch_rows: int = DEFAULT_BATCH_ROWS,
+                 parse_workers: int = DEFAULT_PARSE_WORKERS,
+                 max_pending: int = DEFAULT_MAX_PENDING, progress=None,
+                 settings: dict = None):
+        self.engine = engine
+        self.table = table
+        self.chunk_bytes = chunk_bytes
+        self.batch_rows = batch_rows
+        self.parse_workers = parse_workers
+        self.max_pending = max(1, max_pending)
+        self.progress = progress
+        self.settings = settings
+
+    def _table_types(self) -> dict:
+        self.engine.metadata.invalidate(self.table)
+        columns = self.engine.metadata.get_columns(self.table)
+        if not columns:
+            raise ValueError(f"Table {self.table} does not exist or has no columns")
+        return {column['name']: column['type'] for column in columns}
+
+    def load(self, path: str, format: str = None, **options) -> IngestProgress:
+        """Load a CSV/TSV or Parquet file; format defaults to the file extension"""
+        lower = path.lower()
+        if format is None:
+            if lower.endswith(PARQUET_EXTENSIONS):
+                format = 'parquet'
+            elif lower.endswith(CSV_EXTENSIONS) or '.csv.' in lower or '.tsv.' in lower:
+                format = 'tsv' if '.tsv' in lower else 'csv'
+            else:
+                raise ValueError(f"Cannot infer the format of {path}; pass format=")
+        if format == 'parquet':
+            return self.load_parquet(path, **options)
+        if format in ('csv', 'tsv'):
+            options.setdefault('delimiter', '\t' if format == 'tsv' else ',')
+            return self.load_csv(path, **options)
+        raise ValueError(f"Unsupported format {format!r}")
+
+    def _run(self, tasks, progress: IngestProgress) -> IngestProgress:
+        """Parse tasks in parallel and insert their DataFrames in order
+
+        ``tasks`` yields ``(parse_fn, n_bytes)``; at most ``max_pending``
+        are submitted ahead of the insert that is currently running.
+        """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.parse_workers,
+                                thread_name_prefix='clickhouse-ingest') as executor:
+            try:
+                for parse, n_bytes in tasks:
+                    if len(pending) >= self.max_pending:
+                        self._insert_next(pending, progress)
+                    pending.append((executor.submit(parse), n_bytes))
+                while pending:
+                    self._insert_next(pending, progress)
+            except BaseException:
+                for future, _ in pending:
+                    future.cancel()
+                # Close the reader now rather than whenever the traceback is freed
+                if hasattr(tasks, 'close'):
+                    tasks.close()
+                raise
+        log.info(
+            f"Loaded {progress.rows} rows into {self.table} in {progress.elapsed:.1f}s "
+            f"({progress.rows_per_second:,.0f} rows/s)"
+        )
+        return progress
+
+    def _insert_next(self, pending, progress: IngestProgress):
+        future, n_bytes = pending.popleft()
+        dataframe = future.result()
+        if len(dataframe):
+            self.engine.insert_dataframe(self.table, dataframe, settings=self.settings)
+        progress.rows += len(dataframe)
+        progress.bytes_read += n_bytes
+        progress.chunks += 1
+        if self.progress is not None:
+            self.progress(progress)
+
+    def load_csv(self, path: str, delimiter: str = ',', header: bool = True,
+                 column_names: list = None) -> IngestProgress:
+        """Load a delimited text file
+
+        Uncompressed files are split on line boundaries into ``chunk_bytes``
+        pieces parsed concurrently; this assumes no quoted field contains a
+        newline (set ``parse_workers=1`` otherwise, or for compressed files,
+        which are always streamed by one reader).
+        """
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+
+        table_types = self._table_types()
+        with pa.input_stream(path, compression='detect') as f:
+            head = f.read(1 << 20) if header else b''
+        header_line = head[:head.find(b'\n') + 1] if b'\n' in head else head
+        if column_names is None:
+            if not header:
+                raise ValueError("column_names is required when the file has no header")
+            column_names = [
+                name.strip().strip('"') for name in
+                header_line.decode('utf-8').rstrip('\r\n').split(delimiter)
+            ]
+        unknown = [name for name in column_names if name not in table_types]
+        if unknown:
+            raise ValueError(f"Columns not in {self.table}: {unknown}")
+
+        column_types = {
+            name: arrow_type_for(table_types[name]) for name in column_names
+        }
+        convert = pacsv.ConvertOptions(
+            column_types={k: v for k, v in column_types.items() if v is not None},
+            strings_can_be_null=True,
+        )
+        parse = pacsv.ParseOptions(delimiter=delimiter)
+        read = pacsv.ReadOptions(column_names=column_names, block_size=min(self.chunk_bytes, 1 << 26))
+
+        progress = IngestProgress(os.path.getsize(path))
+        if compression_for(path) is not None or self.parse_workers <= 1:
+            tasks = self._stream_csv_tasks(path, header, read, parse, convert)
+        else:
+            tasks = self._split_csv_tasks(path, len(header_line), read, parse, convert)
+        return self._run(tasks, progress)
+
+    def _split_csv_tasks(self, path, header_bytes, read, parse, convert):
+        import io
+
+        import pyarrow.csv as pacsv
+
+        def parser(data):
+            return lambda: to_frame(pacsv.read_csv(
+                io.BytesIO(data), read_options=read, parse_options=parse,
+                convert_options=convert,
+            ))
+
+        with open(path, 'rb') as f:
+            f.seek(header_bytes)
+            while True:
+                data = f.read(self.chunk_bytes)
+                if not data:
+                    break
+                # Finish the last line so every chunk holds whole rows
+                data += f.readline()
+                yield parser(data), len(data)
+
+    def _stream_csv_tasks(self, path, header, read, parse, convert):
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+
+        read = pacsv.ReadOptions(
+            column_names=read.column_names, block_size=read.block_size,
+            skip_rows=1 if header else 0,
+        )
+        compression = compression_for(path)
+        # Closed on exhaustion, error or the generator being closed early
+        with pa.OSFile(path) as raw:
+            stream = raw
+            if compression is not None:
+                stream = pa.CompressedInputStream(raw, compression)
+            try:
+                reader = pacsv.open_csv(stream, read_options=read, parse_options=parse,
+                                        convert_options=convert)
+                position = 0
+                for batch in reader:
+                    # Progress counts bytes of the file on disk, compressed or not
+                    consumed, position = raw.tell() - position, raw.tell()
+                    yield (lambda batch=batch: to_frame(batch)), consumed
+            finally:
+                if stream is not raw:
+                    stream.close()
+
+    def load_parquet(self, path: str, columns: list = None) -> IngestProgress:
+        """Load a Parquet file in ``batch_rows`` batches, converted to DataFrames in parallel"""
+        import pyarrow.parquet as pq
+
+        table_types = self._table_types()
+        metadata = pq.ParquetFile(path).metadata
+        file_size = os.path.getsize(path)
+        names = columns or [
+            name for name in metadata.schema.names if name in table_types
+        ]
+        unknown = [name for name in names if name not in table_types]
+        if unknown:
+            raise ValueError(f"Columns not in {self.table}: {unknown}")
+
+        def tasks():
+            # Each row group is decoded once, batch by batch; only the
+            # DataFrame conversion runs on the parse workers, so at most
+            # max_pending batches are held, never whole row groups
+            reader = pq.ParquetFile(path)
+            for batch in reader.iter_batches(batch_size=self.batch_rows, columns=names):
+                share = file_size * batch.num_rows // max(metadata.num_rows, 1)
+                yield (lambda batch=batch: to_frame(batch)), share
+
+        progress = IngestProgress(file_size)
+        return self._run(tasks(), progress)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Schema metadata cache for the Railway ClickHouse engine
+Loads tables and columns for a whole database from system.tables and
+system.columns in bulk, instead of one SHOW TABLES / DESCRIBE TABLE
+round-trip per call through the Railway TCP proxy.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_METADATA_TTL = 300  # seconds before system.tables is re-checked
+
+TABLES_QUERY = (
+    "SELECT name, engine, metadata_modification_time, sorting_key, "
+    "sampling_key, total_rows, total_bytes "
+    "FROM system.tables WHERE database = %(database)s"
+)
+
+COLUMNS_QUERY = (
+    "SELECT table, name, type, default_kind, default_expression, comment, "
+    "is_in_primary_key, is_in_sorting_key "
+    "FROM system.columns WHERE database = %(database)s{table_filter} "
+    "ORDER BY table, position"
+)
+
+# Above this many changed tables one unfiltered columns query is cheaper
+# than a long IN list
+MAX_TABLE_FILTER = 200
+
+
+class _DatabaseMetadata:
+    __slots__ = ('tables', 'checked_at')
+
+    def __init__(self):
+        self.tables = {}  # name -> table info dict (with 'columns')
+        self.checked_at = 0.0
+
+
+class MetadataCache:
+    """Per-database table and column metadata with TTL-based refresh
+
+    Within ``ttl`` seconds of the last check every lookup is served from
+    memory. After that, one system.tables query lists the tables with their
+    ``metadata_modification_time``; only new or modified tables have their
+    columns re-read from system.columns, and dropped tables are forgotten.
+    """
+
+    def __init__(self, engine, ttl: float = DEFAULT_METADATA_TTL):
+        self._engine = engine
+        self.ttl = ttl
+        self._databases = {}
+        self._lock = threading.RLock()
+
+    def _split_name(self, table_name: str, database: str = None):
+        if database is None and '.' in table_name:
+            database, table_name = table_name.split('.', 1)
+        return database or self._engine.database, table_name.strip('`"')
+
+    def _load_columns(self, database: str, tables) -> dict:
+        params = {'database': database}
+        table_filter = ''
+        if tables is not None:
+            params['tables'] = tuple(tables)
+            table_filter = ' AND table IN %(tables)s'
+        columns = {}
+        for row in self._engine.execute_iter(
+                COLUMNS_QUERY.format(table_filter=table_filter), params=params):
+            table, name, type_, default_kind, default_expr, comment, in_pk, in_sk = row
+            columns.setdefault(table, []).append({
+                'name': name,
+                'type': type_,
+                'nullable': True,  # ClickHouse columns are generally nullable
+                'default': default_expr if default_kind else None,
+                'default_kind': default_kind or None,
+                'comment': comment,
+                'primary_key': bool(in_pk),
+                'sorting_key': bool(in_sk),
+            })
+        return columns
+
+    def refresh(self, database: str = None, force: bool = False):
+        """Bring one database's metadata up to date, reloading only changed tables"""
+        database = database or self._engine.database
+        with self._lock:
+            meta = self._databases.setdefault(database, _DatabaseMetadata())
+            if not force and time.monotonic() - meta.checked_at < self.ttl:
+                return meta
+
+            current = {}
+            for name, engine, modified, sorting_key, sampling_key, rows, size in (
+                    self._engine.execute_iter(TABLES_QUERY, params={'database': database})):
+                current[name] = {
+                    'name': name,
+                    'engine': engine,
+                    'modified': modified,
+                    'sorting_key': sorting_key,
+                    'sampling_key': sampling_key,
+                    'total_rows': rows,
+                    'total_bytes': size,
+                }
+
+            changed = [
+                name for name, info in current.items()
+                if name not in meta.tables
+                or meta.tables[name]['modified'] != info['modified']
+            ]
+            if changed:
+                filter_tables = changed if len(changed) <= MAX_TABLE_FILTER else None
+                columns = self._load_columns(database, filter_tables)
+                for name in changed:
+                    current[name]['columns'] = columns.get(name, [])
+            for name, info in current.items():
+                if 'columns' not in info:
+                    info['columns'] = meta.tables[name]['columns']
+
+            dropped = len(set(meta.tables) - set(current))
+            meta.tables = current
+            meta.checked_at = time.monotonic()
+            log.debug(
+                f"Metadata for {database}: {len(current)} tables, "
+                f"{len(changed)} reloaded, {dropped} dropped"
+            )
+            return meta
+
+    def get_table_names(self, database: str = None) -> list:
+        return sorted(self.refresh(database).tables)
+
+    def get_table(self, table_name: str, database: str = None):
+        """Table info dict (engine, keys, sizes, columns) or None if unknown"""
+        database, table_name = self._split_name(table_name, database)
+        return self.refresh(database).tables.get(table_name)
+
+    def get_columns(self, table_name: str, database: str = None) -> list:
+        table = self.get_table(table_name, database)
+        return list(table['columns']) if table else []
+
+    def invalidate(self, table_name: str = None, database: str = None):
+        """Forget cached metadata
+
+        With a table, only that table's columns are reloaded on next access;
+        with just a database, that database is reloaded in full; with no
+        arguments everything is dropped.
+        """
+        with self._lock:
+            if table_name is not None:
+                database, table_name = self._split_name(table_name, database)
+                meta = self._databases.get(database)
+                if meta is not None:
+                    meta.tables.pop(table_name, None)
+                    meta.checked_at = 0.0
+            elif database is not None:
+                self._databases.pop(database, None)
+            else:
+                self._databases.clear()
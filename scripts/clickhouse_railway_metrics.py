@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Per-query instrumentation for the Railway ClickHouse engine
+Splits every query's latency into pool queueing, time to first data block,
+total time and Python-side result conversion, and records what the server
+reported reading (progress, profile info and ProfileEvents). Records go to
+pluggable hooks: a log line, a StatsD-style stats logger, or an in-memory
+ring buffer that produces percentile reports.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HISTORY = 1000  # records kept for percentile reports
+REPORT_FIELDS = ('queued', 'first_block', 'total', 'conversion', 'rows_read', 'bytes_read')
+REPORT_PERCENTILES = (50, 90, 95, 99)
+
+# ProfileEvents worth a log line; the full set stays on the record
+LOGGED_PROFILE_EVENTS = (
+    'SelectedParts', 'SelectedMarks', 'ReadCompressedBytes',
+    'MarkCacheHits', 'MarkCacheMisses', 'OSCPUVirtualTimeMicroseconds',
+)
+
+
+def capture_profile_events(client):
+    """Make ``client`` accumulate the server's ProfileEvents per query
+
+    The driver reads ProfileEvents packets but drops them; this wraps each
+    connection's ``receive_packet`` to sum the ``increment`` events into
+    ``client.profile_events``, which ``QueryMetrics.read_client`` collects
+    and clears.
+    """
+    from clickhouse_driver.protocol import ServerPacketTypes
+
+    client.profile_events = {}
+    connections = list(client.connections)
+    if getattr(client, 'connection', None) is not None:
+        connections.append(client.connection)
+
+    for connection in connections:
+        receive = connection.receive_packet
+
+        def receive_packet(receive=receive):
+            packet = receive()
+            if packet.type == ServerPacketTypes.PROFILE_EVENTS and packet.block is not None:
+                names = [name for name, _ in packet.block.columns_with_types]
+                try:
+                    name_idx, type_idx, value_idx = (
+                        names.index('name'), names.index('type'), names.index('value')
+                    )
+                except ValueError:
+                    return packet
+                events = client.profile_events
+                for row in packet.block.get_rows():
+                    if row[type_idx] == 'increment':
+                        events[row[name_idx]] = events.get(row[name_idx], 0) + int(row[value_idx])
+            return packet
+
+        connection.receive_packet = receive_packet
+    return client
+
+
+class QueryMetrics:
+    """Timings and server-side counters for one query
+
+    Times are seconds from when the engine started handling the query:
+    ``queued`` until a pooled client was checked out, ``first_block`` until
+    the first block with rows arrived (None if the result was empty or not
+    streamed), ``total`` until the result was ready for the caller.
+    ``conversion`` is Python time spent turning blocks into the result.
+    """
+
+    __slots__ = (
+        'query_id', 'query', 'profile', 'host', 'started_at', 'queued',
+        'first_block', 'total', 'conversion', 'rows_read', 'bytes_read',
+        'result_rows', 'result_bytes', 'profile_events', 'error', '_start',
+    )
+
+    def __init__(self, query_id: str, query: str, profile: str = None, host: str = None):
+        self.query_id = query_id
+        self.query = query
+        self.profile = profile
+        self.host = host
+        self.started_at = time.time()
+        self.queued = None
+        self.first_block = None
+        self.total = None
+        self.conversion = 0.0
+        self.rows_read = 0
+        self.bytes_read = 0
+        self.result_rows = None
+        self.result_bytes = None
+        self.profile_events = {}
+        self.error = None
+        self._start = time.perf_counter()
+
+    def checked_out(self, host: str = None):
+        self.queued = time.perf_counter() - self._start
+        if host is not None:
+            self.host = host
+
+    def block_received(self, num_rows: int):
+        if num_rows and self.first_block is None:
+            self.first_block = time.perf_counter() - self._start
+
+    @contextmanager
+    def converting(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.conversion += time.perf_counter() - started
+
+    def read_client(self, client):
+        """Copy the driver's progress/profile info for the last query"""
+        last = getattr(client, 'last_query', None)
+        if last is not None:
+            self.rows_read = last.progress.rows
+            self.bytes_read = last.progress.bytes
+            self.result_rows = last.profile_info.rows
+            self.result_bytes = last.profile_info.bytes
+        events = getattr(client, 'profile_events', None)
+        if events:
+            self.profile_events = dict(events)
+            events.clear()
+
+    def finish(self, error: BaseException = None):
+        self.total = time.perf_counter() - self._start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
+
+    def __repr__(self):
+        return f'QueryMetrics(query_id={self.query_id!r}, total={self.total})'
+
+
+class LogHook:
+    """Log one line per query; at WARNING when it ran longer than ``slow_threshold``"""
+
+    def __init__(self, level: int = logging.DEBUG, slow_threshold: float = None,
+                 logger: logging.Logger = None):
+        self.level = level
+        self.slow_threshold = slow_threshold
+        self.logger = logger or log
+
+    def __call__(self, metrics: QueryMetrics):
+        slow = self.slow_threshold is not None and (metrics.total or 0) >= self.slow_threshold
+        level = logging.WARNING if slow or metrics.error else self.level
+        if not self.logger.isEnabledFor(level):
+            return
+
+        def ms(value):
+            return '-' if value is None else f'{value * 1000:.1f}ms'
+
+        events = ' '.join(
+            f'{name}={metrics.profile_events[name]}'
+            for name in LOGGED_PROFILE_EVENTS if name in metrics.profile_events
+        )
+        self.logger.log(
+            level,
+            f"query_id={metrics.query_id} profile={metrics.profile} host={metrics.host} "
+            f"queued={ms(metrics.queued)} first_block={ms(metrics.first_block)} "
+            f"total={ms(metrics.total)} conversion={ms(metrics.conversion)} "
+            f"rows_read={metrics.rows_read} bytes_read={metrics.bytes_read} "
+            f"result_rows={metrics.result_rows}"
+            + (f" {events}" if events else '')
+            + (f" error={metrics.error}" if metrics.error else '')
+        )
+
+
+class StatsHook:
+    """Send timings and counters to a StatsD-style stats logger
+
+    ``stats`` needs ``timing(key, value)`` and ``incr(key)``, which
+    Superset's ``STATS_LOGGER`` provides; timings are sent in milliseconds.
+    """
+
+    def __init__(self, stats, prefix: str = 'clickhouse'):
+        self.stats = stats
+        self.prefix = prefix
+
+    def __call__(self, metrics: QueryMetrics):
+        key = f'{self.prefix}.{metrics.profile or "query"}'
+        self.stats.incr(f'{key}.error' if metrics.error else f'{key}.ok')
+        for name in ('queued', 'first_block', 'total', 'conversion'):
+            value = getattr(metrics, name)
+            if value is not None:
+                self.stats.timing(f'{key}.{name}', value * 1000)
+        if hasattr(self.stats, 'gauge'):
+            self.stats.gauge(f'{key}.rows_read', metrics.rows_read)
+            self.stats.gauge(f'{key}.bytes_read', metrics.bytes_read)
+
+
+def percentile(values: list, pct: float):
+    """Linearly interpolated percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = (len(values) - 1) * pct / 100.0
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class RingBufferHook:
+    """Keep the last ``size`` records in memory for percentile reports"""
+
+    def __init__(self, size: int = DEFAULT_HISTORY):
+        self._records = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics: QueryMetrics):
+        with self._lock:
+            self._records.append(metrics)
+
+    def records(self, profile: str = None) -> list:
+        with self._lock:
+            records = list(self._records)
+        if profile is not None:
+            records = [record for record in records if record.profile == profile]
+        return records
+
+    def find(self, query_id: str):
+        """Most recent record for ``query_id``, or None if it has been dropped"""
+        with self._lock:
+            for record in reversed(self._records):
+                if record.query_id == query_id:
+                    return record
+        return None
+
+    def report(self, profile: str = None) -> dict:
+        """Count, error count and p50/p90/p95/p99/max of each recorded field"""
+        records = self.records(profile)
+        report = {
+            'count': len(records),
+            'errors': sum(1 for record in records if record.error),
+        }
+        for field in REPORT_FIELDS:
+            values = sorted(
+                getattr(record, field) for record in records
+                if getattr(record, field) is not None
+            )
+            summary = {f'p{pct}': percentile(values, pct) for pct in REPORT_PERCENTILES}
+            summary['max'] = values[-1] if values else None
+            report[field] = summary
+        return report
+
+
+class QueryInstrumentation:
+    """Fan finished ``QueryMetrics`` out to hooks; a failing hook is logged and skipped"""
+
+    def __init__(self, hooks=None, history: int = DEFAULT_HISTORY):
+        self.history = RingBufferHook(history) if history else None
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def record(self, query_id: str, query: str, profile: str = None, host: str = None):
+        """Context manager yielding a ``QueryMetrics`` that is emitted on exit"""
+        metrics = QueryMetrics(query_id, query, profile, host)
+        try:
+            yield metrics
+        except GeneratorExit:
+            # A streaming consumer stopped early; not a query failure
+            metrics.finish()
+            self.emit(metrics)
+            raise
+        except BaseException as e:
+            metrics.finish(e)
+            self.emit(metrics)
+            raise
+        metrics.finish()
+        self.emit(metrics)
+
+    def emit(self, metrics: QueryMetrics):
+        if self.history is not None:
+            self.history(metrics)
+        for hook in self.hooks:
+            try:
+                hook(metrics)
+            except Exception as e:
+                log.warning(f"Query metrics hook {hook!r} failed: {e}")
+
+    def find(self, query_id: str):
+        return self.history.find(query_id) if self.history else None
+
+    def report(self, profile: str = None) -> dict:
+        return self.history.report(profile) if self.history else {}
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Thread-safe client pool for the Railway ClickHouse engine
+Keeps a bounded set of clickhouse-driver clients so concurrent chart queries
+each get their own native connection instead of sharing (or rebuilding) one.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MIN_SIZE = 1
+DEFAULT_MAX_SIZE = 10
+DEFAULT_IDLE_TIMEOUT = 300  # seconds an idle client is kept above min_size
+DEFAULT_HEALTH_CHECK_INTERVAL = 30  # idle seconds before a checkout pings
+DEFAULT_CHECKOUT_TIMEOUT = 30  # seconds to wait for a free client
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no client becomes available before the checkout timeout"""
+
+
+class PoolClosedError(Exception):
+    """Raised when checking out from a pool that has been closed"""
+
+
+class PoolStats:
+    """Usage counters for a ClickHousePool"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.closed = 0
+        self.idle_evictions = 0
+        self.health_checks = 0
+        self.health_check_failures = 0
+        self.fork_resets = 0
+
+    def record_checkout(self, wait_time: float, waited: bool):
+        self.checkouts += 1
+        if waited:
+            self.waits += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def as_dict(self) -> dict:
+        stats = dict(vars(self))
+        stats['wait_time_avg'] = (
+            self.wait_time_total / self.checkouts if self.checkouts else 0.0
+        )
+        return stats
+
+
+class ClickHousePool:
+    """Bounded pool of clickhouse-driver clients
+
+    Clients are created lazily up to ``max_size`` and handed out LIFO so the
+    most recently used (warmest) socket is reused first. Clients idle for
+    longer than ``idle_timeout`` are closed while the pool is above
+    ``min_size``. A checkout only pings the server when the client has been
+    idle for at least ``health_check_interval`` seconds.
+
+    The pool remembers the pid that created it. The first checkout or
+    release in a forked child drops every client inherited from the parent,
+    without closing them, and starts over with fresh connections.
+    """
+
+    def __init__(self, factory, min_size: int = DEFAULT_MIN_SIZE,
+                 max_size: int = DEFAULT_MAX_SIZE,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL,
+                 checkout_timeout: float = DEFAULT_CHECKOUT_TIMEOUT):
+        if max_size < 1:
+            raise ValueError(f"max_size must be at least 1, got {max_size}")
+        if not 0 <= min_size <= max_size:
+            raise ValueError(
+                f"min_size must be between 0 and max_size ({max_size}), got {min_size}"
+            )
+
+        self._factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = deque()  # (client, last_used), oldest on the left
+        self._size = 0  # idle + checked out
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._pid = os.getpid()
+        self.stats = PoolStats()
+
+        # Clients connect lazily, so pre-creating min_size is cheap
+        now = time.monotonic()
+        for _ in range(min_size):
+            self._idle.append((self._create(), now))
+            self._size += 1
+
+    def _create(self):
+        client = self._factory()
+        with self._cond:
+            self.stats.created += 1
+        return client
+
+    def _close_client(self, client):
+        try:
+            client.disconnect()
+        except Exception as e:
+            log.warning(f"Error while closing pooled ClickHouse client: {e}")
+        with self._cond:
+            self.stats.closed += 1
+
+    def _evict_idle_locked(self, now: float) -> list:
+        """Pop clients idle past idle_timeout; caller closes them unlocked"""
+        evicted = []
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] >= self.idle_timeout):
+            client, _ = self._idle.popleft()
+            self._size -= 1
+            self.stats.idle_evictions += 1
+            evicted.append(client)
+        return evicted
+
+    def _check_pid(self) -> bool:
+        """Reset the pool if this is a forked child; True if it was reset
+
+        The parent's sockets are only dereferenced, never disconnected: a
+        disconnect would shut down the connection the parent is still using,
+        while dropping the child's copy of the descriptor leaves it alone.
+        """
+        if os.getpid() == self._pid:
+            return False
+        # The parent may have held the lock at fork time; don't wait for it
+        self._cond = threading.Condition(threading.Lock())
+        inherited = len(self._idle)
+        self._idle = deque()
+        self._size = 0
+        self._pid = os.getpid()
+        self.stats.fork_resets += 1
+        log.info(f"Dropped {inherited} ClickHouse client(s) inherited across fork")
+        now = time.monotonic()
+        for _ in range(self.min_size):
+            self._idle.append((self._create(), now))
+            self._size += 1
+        return True
+
+    def _is_healthy(self, client) -> bool:
+        connection = client.connection
+        # A disconnected client reconnects on its next query
+        if not connection.connected:
+            return True
+        try:
+            return bool(connection.ping())
+        except Exception:
+            return False
+
+    def acquire(self, timeout: float = None):
+        """Check out a client, waiting up to ``timeout`` seconds for one"""
+        if timeout is None:
+            timeout = self.checkout_timeout
+        self._check_pid()
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        evicted = []
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("ClickHouse client pool is closed")
+                now = time.monotonic()
+                evicted.extend(self._evict_idle_locked(now))
+                if self._idle:
+                    client, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    client, last_used = None, None
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.stats.timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {timeout}s waiting for a ClickHouse "
+                        f"client (max_size={self.max_size})"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            self.stats.record_checkout(time.monotonic() - start, waited)
+
+        for stale in evicted:
+            self._close_client(stale)
+
+        if client is None:
+            try:
+                return self._create()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        if time.monotonic() - last_used >= self.health_check_interval:
+            healthy = self._is_healthy(client)
+            with self._cond:
+                self.stats.health_checks += 1
+                if not healthy:
+                    self.stats.health_check_failures += 1
+            if not healthy:
+                log.warning("Pooled ClickHouse client failed health check; replacing it")
+                self._close_client(client)
+                try:
+                    client = self._create()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+        return client
+
+    def release(self, client, discard: bool = False):
+        """Return a client to the pool, closing it if it can't be reused"""
+        if self._check_pid():
+            # Checked out before the fork: its socket belongs to the parent
+            return
+        # A query that was not read to the end leaves the socket mid-stream
+        if getattr(client.connection, 'is_query_executing', False):
+            discard = True
+
+        with self._cond:
+            if not (discard or self._closed):
+                self._idle.append((client, time.monotonic()))
+                self._cond.notify()
+                return
+            self._size -= 1
+            self._cond.notify()
+        self._close_client(client)
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Context manager that checks a client out and always returns it"""
+        client = self.acquire(timeout)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def close(self):
+        """Close idle clients; checked-out clients are closed on release"""
+        with self._cond:
+            self._closed = True
+            idle = [client for client, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for client in idle:
+            self._close_client(client)
+
+    def get_stats(self) -> dict:
+        """Snapshot of pool size and usage counters"""
+        with self._cond:
+            stats = self.stats.as_dict()
+            stats.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                min_size=self.min_size,
+                max_size=self.max_size,
+            )
+        return stats
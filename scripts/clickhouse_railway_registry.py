@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Process-wide engine registry for the Railway ClickHouse engine
+Hands every caller asking for the same URI and options the same engine, so
+pools, metadata and result caches are shared instead of rebuilt per call.
+Engines are dropped in forked children (gunicorn workers must never use
+sockets opened by the master) and closed after sitting idle.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from clickhouse_railway_balancer import parse_hosts
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ENGINE_IDLE_TIMEOUT = 3600  # seconds before an unused engine is closed
+
+
+def normalize_uri(uri: str) -> str:
+    """Canonical form of a clickhouse+native URI, used as the registry key
+
+    Defaults are filled in (user ``default``, port 9000, database
+    ``default``), host names are lower-cased and query parameters sorted,
+    so equivalent spellings of one connection share an engine.
+    """
+    prefix = 'clickhouse+native://'
+    if not uri.startswith(prefix):
+        raise ValueError(f"Unsupported URI format: {uri}")
+    rest = uri[len(prefix):]
+    auth, host_part = rest.split('@', 1) if '@' in rest else ('default', rest)
+    if ':' not in auth:
+        auth += ':'
+    host_part, _, query = host_part.partition('?')
+    host_ports, _, database = host_part.partition('/')
+    hosts = ','.join(f'{host.lower()}:{port}' for host, port in parse_hosts(host_ports))
+    params = urlencode(sorted(parse_qsl(query)))
+    return f"{prefix}{auth}@{hosts}/{database or 'default'}" + (f'?{params}' if params else '')
+
+
+def _options_key(options: dict) -> str:
+    # Hooks and second-tier caches are compared by identity via their repr
+    return repr(sorted(options.items()))
+
+
+def _in_use(engine) -> int:
+    """Clients currently checked out of an engine's pool (or per-host pools)"""
+    stats = engine.pool_stats()
+    if 'hosts' in stats:
+        return sum(host['outstanding'] for host in stats['hosts'].values())
+    return stats.get('in_use', 0)
+
+
+class _Entry:
+    __slots__ = ('engine', 'last_used')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.last_used = time.monotonic()
+
+
+class EngineRegistry:
+    """Memoizes engines by normalized URI plus constructor options
+
+    ``factory(uri, **options)`` builds an engine on a miss. Each lookup
+    closes engines that have neither been handed out nor run a query for
+    ``idle_timeout`` seconds and have no client checked out; a closed
+    engine reconnects lazily if a caller still holds it.
+    """
+
+    def __init__(self, factory, idle_timeout: float = DEFAULT_ENGINE_IDLE_TIMEOUT):
+        self._factory = factory
+        self.idle_timeout = idle_timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.dispose_all)
+
+    def _after_fork(self):
+        """Forget the parent's engines without touching their sockets
+
+        Closing them here would shut down connections the parent is still
+        using; the child simply builds its own on first use. Engines that
+        callers already hold reset their own pools on first use in the
+        child (see ``ClickHousePool``).
+        """
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._pid = os.getpid()
+
+    def get(self, uri: str, **options):
+        """Shared engine for ``uri`` and ``options``, created on first use"""
+        if os.getpid() != self._pid:
+            # Forked without register_at_fork (e.g. multiprocessing on old Pythons)
+            self._after_fork()
+        key = (normalize_uri(uri), _options_key(options))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(self._factory(uri, **options))
+                log.debug(f"Registered ClickHouse engine for {key[0].split('@')[-1]}")
+            entry.last_used = time.monotonic()
+            idle = self._pop_idle_locked(exclude=entry)
+        for stale in idle:
+            self._close(stale)
+        return entry.engine
+
+    def _pop_idle_locked(self, exclude=None) -> list:
+        if not self.idle_timeout:
+            return []
+        now = time.monotonic()
+        idle = []
+        for key, entry in list(self._entries.items()):
+            last_used = max(entry.last_used, getattr(entry.engine, 'last_used', 0))
+            if entry is exclude or now - last_used < self.idle_timeout:
+                continue
+            if _in_use(entry.engine):
+                continue
+            del self._entries[key]
+            idle.append(entry.engine)
+        return idle
+
+    @staticmethod
+    def _close(engine):
+        try:
+            engine.close()
+        except Exception as e:
+            log.warning(f"Failed to close idle ClickHouse engine: {e}")
+
+    def dispose_idle(self) -> int:
+        """Close engines idle past ``idle_timeout``; returns how many were closed"""
+        with self._lock:
+            idle = self._pop_idle_locked()
+        for engine in idle:
+            self._close(engine)
+        return len(idle)
+
+    def dispose_all(self):
+        """Close every registered engine (run at interpreter exit)"""
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            engines = [entry.engine for entry in self._entries.values()]
+            self._entries.clear()
+        for engine in engines:
+            self._close(engine)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Result containers for the Railway ClickHouse engine
+Column-oriented results built straight from clickhouse-driver's NumPy blocks,
+so large chart queries never turn into one Python object per row.
+"""
+
+import logging
+from itertools import chain
+
+log = logging.getLogger(__name__)
+
+# Object (string) columns whose distinct/total ratio is at or below this
+# become pandas Categoricals when downcasting
+CATEGORICAL_MAX_RATIO = 0.5
+
+# Schema metadata key set on Arrow tables cut off at the engine's row limit
+TRUNCATED_METADATA_KEY = b'truncated'
+
+
+def is_truncated(table) -> bool:
+    """Whether an Arrow table from ``execute_columnar(arrow=True)`` was cut off"""
+    metadata = table.schema.metadata or {}
+    return metadata.get(TRUNCATED_METADATA_KEY) == b'true'
+
+
+def _concat_chunks(chunks):
+    """Join the per-block pieces of one column"""
+    import numpy as np
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+
+    first = chunks[0]
+    if isinstance(first, np.ndarray):
+        return np.concatenate(chunks) if len(chunks) > 1 else first
+    if isinstance(first, pd.Categorical):
+        return union_categoricals(chunks) if len(chunks) > 1 else first
+    # Types without a NumPy reader come back as tuples of Python values.
+    # Filling a preallocated array keeps Array/Tuple values (equal-length
+    # sequences) as one object each instead of a second dimension.
+    values = list(chain.from_iterable(chunks))
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def downcast_column(values):
+    """Shrink a column's dtype where no value can change
+
+    Integers move to the smallest dtype of the same signedness holding
+    their min and max, so signed columns stay signed and arithmetic on
+    them can still go negative. Low-cardinality object (string) columns become Categoricals. Floats and
+    datetimes are left alone.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if not isinstance(values, np.ndarray) or not len(values):
+        return values
+    kind = values.dtype.kind
+    if kind in 'iu':
+        low, high = values.min(), values.max()
+        targets = (np.int8, np.int16, np.int32) if kind == 'i' else (np.uint8, np.uint16, np.uint32)
+        for target in targets:
+            if np.dtype(target).itemsize >= values.dtype.itemsize:
+                break
+            info = np.iinfo(target)
+            if info.min <= low and high <= info.max:
+                return values.astype(target)
+    elif kind == 'O':
+        try:
+            distinct = len(pd.unique(values))
+        except TypeError:  # unhashable values (arrays, maps)
+            return values
+        if distinct <= len(values) * CATEGORICAL_MAX_RATIO:
+            return pd.Categorical(values)
+    return values
+
+
+class ColumnarResult:
+    """Query result stored as one array per column"""
+
+    def __init__(self, columns_with_types, columns):
+        self.columns_with_types = list(columns_with_types)
+        self.column_names = [name for name, _ in self.columns_with_types]
+        self.column_types = [type_ for _, type_ in self.columns_with_types]
+        self.columns = list(columns)
+        self.truncated = False  # cut off at the engine's row limit
+
+    @classmethod
+    def from_chunks(cls, columns_with_types, chunks, downcast: bool = True):
+        """Build a result from the ``block.get_columns()`` of each data block"""
+        import numpy as np
+
+        if chunks:
+            columns = [_concat_chunks(list(parts)) for parts in zip(*chunks)]
+        else:
+            columns = [np.array([], dtype=object) for _ in columns_with_types]
+        if downcast:
+            columns = [downcast_column(values) for values in columns]
+        return cls(columns_with_types, columns)
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __len__(self):
+        return self.num_rows
+
+    def column(self, name: str):
+        """Array for the named column"""
+        return self.columns[self.column_names.index(name)]
+
+    def to_dict(self) -> dict:
+        return dict(zip(self.column_names, self.columns))
+
+    def to_pandas(self):
+        """DataFrame sharing the column arrays where pandas allows it"""
+        import pandas as pd
+
+        return pd.DataFrame(self.to_dict(), columns=self.column_names, copy=False)
+
+    def to_arrow(self):
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(self.to_pandas(), preserve_index=False)
+
+
+class ResultHeader:
+    """Column names, types and name->position index shared by every row"""
+
+    __slots__ = ('names', 'types', 'index')
+
+    def __init__(self, columns_with_types):
+        self.names = tuple(name for name, _ in columns_with_types)
+        self.types = tuple(type_ for _, type_ in columns_with_types)
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+
+class ResultRow:
+    """View over one row tuple, indexable by position or column name
+
+    Wraps the driver's tuple without copying it. ``keys()``/``values()``/
+    ``items()``/``get()`` keep code written against the old per-row dicts
+    working; iteration yields values, like a tuple.
+    """
+
+    __slots__ = ('_header', '_values')
+
+    def __init__(self, header: ResultHeader, values: tuple):
+        self._header = header
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._header.index[key]]
+        return self._values[key]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, ResultRow):
+            return self._values == other._values
+        return self._values == other
+
+    def __hash__(self):
+        return hash(self._values)
+
+    def __repr__(self):
+        pairs = ', '.join(f'{k}={v!r}' for k, v in zip(self._header.names, self._values))
+        return f'ResultRow({pairs})'
+
+    def get(self, name: str, default=None):
+        position = self._header.index.get(name)
+        return default if position is None else self._values[position]
+
+    def keys(self):
+        return self._header.names
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._header.names, self._values)
+
+    def as_dict(self) -> dict:
+        return dict(zip(self._header.names, self._values))
+
+
+class RowResult:
+    """Row-oriented query result: one shared header plus the driver's tuples
+
+    Rows are stored exactly as clickhouse-driver returned them; ``ResultRow``
+    views are created only while iterating or indexing, so holding a result
+    costs no per-row objects beyond the tuples themselves.
+    """
+
+    def __init__(self, rows, columns_with_types, truncated: bool = False):
+        self.rows = rows
+        self.header = ResultHeader(columns_with_types)
+        self.truncated = truncated  # cut off at the engine's row limit
+
+    @property
+    def columns(self):
+        return self.header.names
+
+    @property
+    def column_types(self):
+        return self.header.types
+
+    @property
+    def columns_with_types(self):
+        return list(zip(self.header.names, self.header.types))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        header = self.header
+        for values in self.rows:
+            yield ResultRow(header, values)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [ResultRow(self.header, values) for values in self.rows[key]]
+        return ResultRow(self.header, self.rows[key])
+
+    def __repr__(self):
+        truncated = ', truncated' if self.truncated else ''
+        return f'RowResult(columns={list(self.columns)}, rows={len(self.rows)}{truncated})'
+
+    def copy(self) -> 'RowResult':
+        """A result with its own ``rows`` list; header and row tuples are shared"""
+        result = RowResult.__new__(RowResult)
+        result.rows = list(self.rows)
+        result.header = self.header
+        result.truncated = self.truncated
+        return result
+
+    def column(self, name: str) -> list:
+        """All values of one column"""
+        position = self.header.index[name]
+        return [values[position] for values in self.rows]
+
+    def to_dicts(self) -> list:
+        """List of ``{column: value}`` dicts (allocates one dict per row)"""
+        names = self.header.names
+        return [dict(zip(names, values)) for values in self.rows]
+
+
+class BatchQueryResult:
+    """Outcome and timings of one query run through ``execute_many``"""
+
+    __slots__ = ('query', 'result', 'error', 'queued', 'elapsed')
+
+    def __init__(self, query: str, result=None, error: Exception = None,
+                 queued: float = 0.0, elapsed: float = 0.0):
+        self.query = query
+        self.result = result
+        self.error = error
+        self.queued = queued  # seconds waiting for a worker
+        self.elapsed = elapsed  # seconds executing
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'error={self.error!r}'
+        return (
+            f'BatchQueryResult({status}, queued={self.queued:.3f}s, '
+            f'elapsed={self.elapsed:.3f}s)'
+        )
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Approximate query execution for the Railway ClickHouse engine
+Exploratory charts rarely need exact answers over billions of rows. This
+rewrites a single-table SELECT to read a sample (``SAMPLE k`` when the
+table has a sampling key, a ``LIMIT``-bounded scan otherwise), picks the
+largest sample expected to finish within the caller's latency budget, and
+can follow the first answer with refinements at larger sample rates.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+
+from clickhouse_railway_cache import mask_literals
+from clickhouse_railway_settings import QueryTimeoutError, new_query_id
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_FRACTIONS = (0.001, 0.01, 0.1, 1.0)  # refinement ladder
+DEFAULT_LATENCY_BUDGET = 1.0  # seconds for the first answer
+DEFAULT_SCAN_ROWS_PER_SECOND = 20_000_000  # until a table's scan rate is measured
+MIN_SAMPLE_ROWS = 10_000  # smaller samples are too noisy to be worth returning
+SCAN_RATE_WEIGHT = 0.3  # EWMA weight of the newest scan-rate measurement
+
+_IDENT = r'(?:`[^`]+`|"[^"]+"|[A-Za-z_]\w*)'
+_CLAUSE_WORDS = (
+    r'PREWHERE|WHERE|GROUP|ORDER|LIMIT|HAVING|SETTINGS|FORMAT|FINAL|SAMPLE|'
+    r'WITH|UNION|ARRAY|LEFT|RIGHT|INNER|FULL|CROSS|GLOBAL|ANY|ALL|JOIN'
+)
+_FROM_RE = re.compile(
+    rf'\bFROM\s+(?P<table>{_IDENT}(?:\s*\.\s*{_IDENT})?)(?!\w)(?!\s*[(.])'
+    rf'(?:\s+(?:AS\s+)?(?P<alias>(?!(?:{_CLAUSE_WORDS})\b){_IDENT}))?'
+    r'(?P<final>\s+FINAL\b)?',
+    re.I,
+)
+_INELIGIBLE_RE = re.compile(r'\b(?:JOIN|UNION|INTERSECT|EXCEPT|SAMPLE)\b', re.I)
+
+
+def _unquote(identifier: str) -> str:
+    return identifier.strip().strip('`"')
+
+
+class SampleTarget:
+    """Where and how a query can be sampled"""
+
+    __slots__ = ('table', 'alias', 'start', 'end', 'final')
+
+    def __init__(self, table: str, alias: str, start: int, end: int, final: bool):
+        self.table = table  # as written in the query, possibly db.table
+        self.alias = alias
+        self.start = start  # span of "FROM table [AS alias] [FINAL]"
+        self.end = end
+        self.final = final
+
+    @property
+    def table_name(self) -> str:
+        """``db.table`` or ``table`` without quoting, for metadata lookups"""
+        return '.'.join(_unquote(part) for part in self.table.split('.'))
+
+
+def find_sample_target(query: str):
+    """The single table a SELECT reads, or None if the query can't be sampled
+
+    Eligible queries are one SELECT over one named table: no joins, unions,
+    subqueries, table functions or existing SAMPLE clause.
+    """
+    masked = mask_literals(query.strip().rstrip(';'))
+    if not re.match(r'\s*SELECT\b', masked, re.I) or _INELIGIBLE_RE.search(masked):
+        return None
+    if len(re.findall(r'\bFROM\b', masked, re.I)) != 1:
+        return None
+    if re.search(r'\(\s*SELECT\b', masked, re.I):
+        return None
+    match = _FROM_RE.search(masked)
+    if match is None:
+        return None
+    table = re.sub(r'\s+', '', query[match.start('table'):match.end('table')])
+    alias = match.group('alias')
+    return SampleTarget(table, alias, match.start(), match.end(), bool(match.group('final')))
+
+
+def format_fraction(fraction: float) -> str:
+    return f'{fraction:.10f}'.rstrip('0').rstrip('.')
+
+
+def rewrite_sampled(query: str, target: SampleTarget, fraction: float,
+                    limit: int = None) -> str:
+    """Rewrite ``query`` to read ``fraction`` of its table
+
+    With ``limit`` the table is replaced by a ``LIMIT``-bounded subquery
+    (aliased like the table so qualified column references still resolve);
+    otherwise ``SAMPLE fraction`` is added after the table reference.
+    """
+    query = query.strip().rstrip(';')
+    if limit is None:
+        return f'{query[:target.end]} SAMPLE {format_fraction(fraction)}{query[target.end:]}'
+    alias = target.alias or _unquote(target.table.split('.')[-1])
+    final = ' FINAL' if target.final else ''
+    source = f'FROM (SELECT * FROM {target.table}{final} LIMIT {int(limit)}) AS `{_unquote(alias)}`'
+    return f'{query[:target.start]}{source}{query[target.end:]}'
+
+
+class ApproximateResult:
+    """A query result together with how it was sampled
+
+    ``fraction`` is the share of the table actually read (1.0 when the
+    query ran exactly); ``method`` is ``sample``, ``limit`` or ``exact``.
+    ``relative_error`` is the relative standard error of a whole-table
+    count or sum scaled up by ``1 / fraction``; a group holding fewer
+    sampled rows has a larger error, see ``error_for()``. ``limit`` scans
+    read the first rows in storage order, so their estimate assumes those
+    rows are representative (``biased`` is True).
+    """
+
+    __slots__ = ('result', 'fraction', 'method', 'table', 'total_rows', 'sampled_rows',
+                 'elapsed', 'query_id', 'rows_read', 'step')
+
+    def __init__(self, result, fraction: float, method: str, table: str = None,
+                 total_rows: int = None, elapsed: float = 0.0, query_id: str = None,
+                 rows_read: int = None, step: int = 0):
+        self.result = result
+        self.fraction = fraction
+        self.method = method
+        self.table = table
+        self.total_rows = total_rows
+        self.sampled_rows = (
+            min(total_rows, math.ceil(total_rows * fraction)) if total_rows else None
+        )
+        self.elapsed = elapsed
+        self.query_id = query_id
+        self.rows_read = rows_read
+        self.step = step  # 0 for the first answer, then 1, 2... per refinement
+
+    @property
+    def exact(self) -> bool:
+        return self.method == 'exact'
+
+    @property
+    def biased(self) -> bool:
+        return self.method == 'limit'
+
+    @property
+    def relative_error(self) -> float:
+        return self.error_for(self.sampled_rows) if not self.exact else 0.0
+
+    def error_for(self, sampled_count) -> float:
+        """Relative standard error of an estimate built from ``sampled_count`` rows
+
+        ``sqrt((1 - f) / n)`` for a Bernoulli sample at fraction ``f``; pass
+        a group's ``count()`` from the sampled result to judge that group.
+        """
+        if self.exact or self.fraction >= 1:
+            return 0.0
+        if not sampled_count:
+            return float('inf')
+        return math.sqrt((1 - self.fraction) / sampled_count)
+
+    def scale(self, value):
+        """Scale a sampled count/sum up to a whole-table estimate"""
+        return value / self.fraction if value is not None else None
+
+    def __repr__(self):
+        return (
+            f'ApproximateResult(method={self.method}, fraction={self.fraction:g}, '
+            f'relative_error={self.relative_error:.4f}, elapsed={self.elapsed:.3f}s)'
+        )
+
+
+class ApproximateExecutor:
+    """Runs sampled queries for an engine and learns each table's scan rate
+
+    The first answer uses the largest fraction in ``fractions`` whose
+    expected scan (``fraction * total_rows`` at the table's measured rows
+    per second) fits the latency budget, but never fewer than
+    ``min_sample_rows`` rows. Tables without row counts (views) or queries
+    that can't be rewritten run exactly.
+    """
+
+    def __init__(self, engine, fractions=DEFAULT_SAMPLE_FRACTIONS,
+                 min_sample_rows: int = MIN_SAMPLE_ROWS,
+                 default_rate: float = DEFAULT_SCAN_ROWS_PER_SECOND):
+        self.engine = engine
+        self.fractions = tuple(sorted(set(fractions) | {1.0}))
+        self.min_sample_rows = min_sample_rows
+        self.default_rate = default_rate
+        self._rates = {}  # table -> rows scanned per second (EWMA)
+        self._lock = threading.Lock()
+        self.stats = {'queries': 0, 'sampled': 0, 'limited': 0, 'exact': 0,
+                      'refinements': 0, 'refinements_timed_out': 0}
+
+    def _plan(self, query: str):
+        """``(target, table_info)`` for a sampleable query, else ``(None, None)``"""
+        target = find_sample_target(query)
+        if target is None:
+            return None, None
+        try:
+            table = self.engine.metadata.get_table(target.table_name)
+        except Exception as e:
+            log.warning(f"No metadata for {target.table_name}, running exactly: {e}")
+            return None, None
+        if not table or not table.get('total_rows'):
+            return None, None
+        return target, table
+
+    def _rate(self, table: str) -> float:
+        with self._lock:
+            return self._rates.get(table, self.default_rate)
+
+    def _observe(self, table: str, rows: float, elapsed: float):
+        if rows <= 0 or elapsed <= 0:
+            return
+        with self._lock:
+            rate = rows / elapsed
+            previous = self._rates.get(table)
+            self._rates[table] = rate if previous is None else (
+                SCAN_RATE_WEIGHT * rate + (1 - SCAN_RATE_WEIGHT) * previous
+            )
+
+    def _ladder(self, total_rows: int) -> list:
+        """Fractions worth running for a table, smallest first"""
+        floor = min(1.0, self.min_sample_rows / total_rows)
+        ladder = [f for f in self.fractions if f >= floor and f < 1.0]
+        return ladder + [1.0]
+
+    def choose_fraction(self, table_name: str, total_rows: int, budget: float) -> float:
+        ladder = self._ladder(total_rows)
+        rate = self._rate(table_name)
+        fitting = [f for f in ladder if f * total_rows / rate <= budget]
+        return fitting[-1] if fitting else ladder[0]
+
+    def _run(self, query: str, target, table, fraction: float, step: int,
+             params=None, timeout: float = None, **kwargs) -> ApproximateResult:
+        if target is None or fraction >= 1.0:
+            sql, method = query, 'exact'
+            fraction = 1.0
+        elif table.get('sampling_key'):
+            sql, method = rewrite_sampled(query, target, fraction), 'sample'
+        else:
+            limit = math.ceil(table['total_rows'] * fraction)
+            sql, method = rewrite_sampled(query, target, fraction, limit=limit), 'limit'
+
+        query_id = kwargs.pop('query_id', None) or new_query_id()
+        started = time.perf_counter()
+        result = self.engine.execute(
+            sql, params=params, timeout=timeout, query_id=query_id, **kwargs
+        )
+        elapsed = time.perf_counter() - started
+
+        metrics = self.engine.instrumentation.find(query_id)
+        rows_read = metrics.rows_read if metrics is not None else None
+        if table is not None:
+            self._observe(
+                target.table_name, rows_read or table['total_rows'] * fraction,
+                metrics.total if metrics is not None and metrics.total else elapsed,
+            )
+        with self._lock:
+            self.stats['queries'] += 1
+            self.stats[{'sample': 'sampled', 'limit': 'limited', 'exact': 'exact'}[method]] += 1
+        return ApproximateResult(
+            result, fraction, method,
+            table=target.table_name if target is not None else None,
+            total_rows=table['total_rows'] if table is not None else None,
+            elapsed=elapsed, query_id=query_id, rows_read=rows_read, step=step,
+        )
+
+    def execute(self, query: str, latency_budget: float = DEFAULT_LATENCY_BUDGET,
+                params=None, **kwargs) -> ApproximateResult:
+        """One answer from the largest sample expected to fit ``latency_budget``"""
+        target, table = self._plan(query)
+        fraction = 1.0
+        if table is not None:
+            fraction = self.choose_fraction(target.table_name, table['total_rows'], latency_budget)
+        return self._run(query, target, table, fraction, 0, params=params, **kwargs)
+
+    def execute_progressive(self, query: str, latency_budget: float = DEFAULT_LATENCY_BUDGET,
+                            total_budget: float = None, params=None, **kwargs):
+        """Yield a first answer within ``latency_budget``, then refinements
+
+        Each refinement reads the next larger fraction on the ladder, ending
+        with the exact query. Refinement stops early when the next step is
+        not expected to finish within what is left of ``total_budget``
+        seconds (None: no limit); a step that overruns it is killed and the
+        last answer yielded stands. A ``timeout`` keyword still caps every
+        single query, the first answer included.
+        """
+        started = time.monotonic()
+        query_timeout = kwargs.pop('timeout', None)
+        first = self.execute(query, latency_budget, params=params, timeout=query_timeout, **kwargs)
+        yield first
+        if first.exact:
+            return
+
+        target, table = self._plan(query)
+        if table is None:
+            return
+        ladder = [f for f in self._ladder(table['total_rows']) if f > first.fraction]
+        last = first.fraction
+        for step, fraction in enumerate(ladder, 1):
+            timeout = query_timeout
+            if total_budget is not None:
+                remaining = total_budget - (time.monotonic() - started)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+                expected = fraction * table['total_rows'] / self._rate(target.table_name)
+                if timeout <= 0 or expected > timeout:
+                    log.debug(
+                        f"Stopping refinement of {target.table_name} at fraction {last:g}: "
+                        f"next step needs ~{expected:.2f}s"
+                    )
+                    return
+            try:
+                refined = self._run(
+                    query, target, table, fraction, step,
+                    params=params, timeout=timeout, **kwargs
+                )
+            except QueryTimeoutError:
+                with self._lock:
+                    self.stats['refinements_timed_out'] += 1
+                return
+            with self._lock:
+                self.stats['refinements'] += 1
+            last = fraction
+            yield refined
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['scan_rates'] = dict(self._rates)
+        return stats
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Per-query settings profiles and deadlines for the Railway ClickHouse engine
+Every query runs under a named profile (interactive, export, background)
+that bounds its execution time and memory, carries its own query_id, and is
+killed on the server if it is still running when its deadline passes.
+"""
+
+import logging
+import math
+import re
+import threading
+import uuid
+
+from clickhouse_railway_cache import mask_literals
+
+log = logging.getLogger(__name__)
+
+GiB = 1024 ** 3
+
+SETTINGS_PROFILES = {
+    # Dashboard tiles and SQL Lab previews: fail fast, well under
+    # SUPERSET_WEBSERVER_TIMEOUT so a runaway query can't pin a worker
+    'interactive': {
+        'max_execution_time': 60,
+        'max_block_size': 65536,
+        'max_memory_usage': 4 * GiB,
+        'priority': 1,
+    },
+    # CSV/Parquet exports and large result downloads
+    'export': {
+        'max_execution_time': 600,
+        'max_block_size': 262144,
+        'max_memory_usage': 8 * GiB,
+        'priority': 5,
+    },
+    # Cache warm-up, advisor and maintenance work
+    'background': {
+        'max_execution_time': 1800,
+        'max_block_size': 262144,
+        'max_memory_usage': 8 * GiB,
+        'max_threads': 4,
+        'priority': 10,
+    },
+}
+
+DEFAULT_PROFILE = 'interactive'
+
+# Rows execute() returns at most; mirrors ROW_LIMIT in superset_config.py
+DEFAULT_ROW_LIMIT = 50000
+
+
+class QueryTimeoutError(Exception):
+    """Raised when a query outlives its deadline and is killed
+
+    Also raised with ``killed=False`` when a caller coalesced onto an
+    identical in-flight query stops waiting at its own deadline; the
+    shared execution keeps running for its other callers.
+    """
+
+    def __init__(self, query_id: str, timeout: float, killed: bool = True):
+        if killed:
+            message = f"Query {query_id} exceeded its {timeout}s deadline and was killed"
+        else:
+            message = (f"Query {query_id} gave up after {timeout}s waiting for an "
+                       f"identical in-flight query")
+        super().__init__(message)
+        self.query_id = query_id
+        self.timeout = timeout
+        self.killed = killed
+
+
+def new_query_id() -> str:
+    return str(uuid.uuid4())
+
+
+def resolve_settings(profile: str = DEFAULT_PROFILE, settings: dict = None,
+                     timeout: float = None, engine_settings: dict = None):
+    """Merge a profile with engine-wide and per-query overrides
+
+    Precedence, lowest first: the profile, ``engine_settings`` (from the
+    connection URI), ``timeout``, then ``settings``. Returns
+    ``(settings, deadline)``; ``timeout`` is also the client-side deadline.
+    """
+    if profile not in SETTINGS_PROFILES:
+        raise ValueError(
+            f"Unknown settings profile {profile!r}; "
+            f"expected one of {sorted(SETTINGS_PROFILES)}"
+        )
+    merged = dict(SETTINGS_PROFILES[profile])
+    merged.update(engine_settings or {})
+    if timeout is not None:
+        merged['max_execution_time'] = max(1, math.ceil(timeout))
+    merged.update(settings or {})
+    deadline = timeout if timeout is not None else merged.get('max_execution_time')
+    return merged, deadline
+
+
+def push_down_row_limit(query: str, row_limit: int, settings: dict = None):
+    """Make the server stop a read-only query after ``row_limit`` rows
+
+    SELECT and WITH queries are wrapped in ``SELECT * FROM (...) LIMIT``;
+    the server stops reading once the outer LIMIT is met. They never get
+    ``max_result_rows``: that setting also caps intermediate results (JOIN
+    right-hand sides, subqueries, per-shard results of Distributed tables)
+    and would silently truncate data before aggregation. SHOW/DESCRIBE
+    have no intermediate results and get ``max_result_rows`` with
+    ``result_overflow_mode='break'``. One row beyond the limit is requested
+    so truncation can be detected. Returns ``(query, settings)``; explicit
+    ``max_result_rows`` settings win, and SELECTs with a FORMAT clause are
+    left alone.
+    """
+    settings = dict(settings or {})
+    head = query.lstrip().split(None, 1)
+    keyword = head[0].lower().lstrip('(') if head else ''
+    if (not row_limit or 'max_result_rows' in settings
+            or keyword not in ('select', 'with', 'show', 'describe', 'desc')):
+        return query, settings
+    if keyword in ('select', 'with'):
+        if re.search(r'\bFORMAT\b', mask_literals(query), re.I):
+            return query, settings
+        body = query.strip().rstrip(';')
+        return f'SELECT * FROM ({body}\n) LIMIT {row_limit + 1}', settings
+    settings['max_result_rows'] = row_limit + 1
+    settings['result_overflow_mode'] = 'break'
+    return query, settings
+
+
+class QueryDeadline:
+    """Context manager that kills a query server-side once its deadline passes
+
+    ``kill`` is called with the query_id from a timer thread. The KILL makes
+    the server end the query with an exception, which unblocks the worker
+    thread; that exception is re-raised as ``QueryTimeoutError``.
+    """
+
+    def __init__(self, query_id: str, timeout: float, kill):
+        self.query_id = query_id
+        self.timeout = timeout
+        self.expired = False
+        self._kill = kill
+        self._timer = None
+
+    def _expire(self):
+        self.expired = True
+        log.warning(f"Query {self.query_id} passed its {self.timeout}s deadline; killing it")
+        try:
+            self._kill(self.query_id)
+        except Exception as e:
+            log.error(f"Failed to kill query {self.query_id}: {e}")
+
+    def __enter__(self):
+        if self.timeout:
+            self._timer = threading.Timer(self.timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._timer is not None:
+            self._timer.cancel()
+        if (self.expired and exc_type is not None
+                and issubclass(exc_type, Exception)
+                and not issubclass(exc_type, QueryTimeoutError)):
+            raise QueryTimeoutError(self.query_id, self.timeout) from exc
+        return False
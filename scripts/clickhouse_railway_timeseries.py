@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Incremental time-bucket caching for the Railway ClickHouse engine
+"Last N days" charts re-scan their whole window on every refresh although
+only the newest bucket changes. This caches a time-series query's rows per
+closed time bucket and only asks ClickHouse for the still-open tail and any
+buckets missing from the cache, then merges the two.
+"""
+
+import logging
+import threading
+from datetime import date, datetime, timezone
+
+from clickhouse_railway_cache import ResultCache, make_cache_key
+from clickhouse_railway_result import RowResult
+from clickhouse_railway_settings import DEFAULT_PROFILE, resolve_settings
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SETTLE_SECONDS = 300  # a bucket is closed this long after it ends (late data)
+DEFAULT_BUCKET_TTL = 7 * 24 * 3600  # closed buckets don't change; LRU bounds memory
+DEFAULT_TIMESERIES_CACHE_BYTES = 64 * 1024 * 1024  # used when the engine has no result cache
+
+
+def to_epoch(value) -> float:
+    """Seconds since the epoch; naive datetimes and dates are taken as UTC"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+    return float(value)
+
+
+def from_epoch(seconds: float) -> datetime:
+    """Naive UTC datetime, the form clickhouse-driver substitutes into queries"""
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+class TimeSeriesStats:
+    """Bucket hit/miss counters for a TimeBucketCache"""
+
+    def __init__(self):
+        self.requests = 0
+        self.buckets_cached = 0  # closed buckets served from the cache
+        self.buckets_queried = 0  # closed buckets fetched from ClickHouse
+        self.open_buckets_queried = 0
+        self.queries = 0
+
+    def as_dict(self) -> dict:
+        stats = dict(vars(self))
+        closed = self.buckets_cached + self.buckets_queried
+        stats['bucket_hit_ratio'] = self.buckets_cached / closed if closed else 0.0
+        return stats
+
+
+class TimeBucketCache:
+    """Per-bucket cache in front of ``engine.execute()`` for time-series queries
+
+    The query must filter its time column with ``%(start)s`` (inclusive)
+    and ``%(end)s`` (exclusive) and return the bucket start, grouped by a
+    bucket expression of the same width (``toStartOfHour(ts)``,
+    ``toStartOfInterval(ts, INTERVAL 15 minute)`` ...), in
+    ``bucket_column``. Buckets are aligned to the epoch in UTC.
+
+    A bucket is closed once it ended ``settle`` seconds ago; closed buckets
+    are cached (empty ones included) for ``ttl`` seconds. The open tail is
+    queried every time and never cached.
+    """
+
+    def __init__(self, engine, cache: ResultCache = None,
+                 settle: float = DEFAULT_SETTLE_SECONDS, ttl: float = DEFAULT_BUCKET_TTL):
+        self.engine = engine
+        self.cache = cache or engine.result_cache or ResultCache(
+            max_bytes=DEFAULT_TIMESERIES_CACHE_BYTES, default_ttl=ttl
+        )
+        self.settle = settle
+        self.ttl = ttl
+        self.stats = TimeSeriesStats()
+        self._lock = threading.Lock()
+
+    def _bucket_key(self, base: str, bucket_seconds: int, bucket_start: float) -> str:
+        return f'{base}:ts:{bucket_seconds}:{int(bucket_start)}'
+
+    def execute(self, query: str, bucket_column: str, bucket_seconds: int,
+                start, end, params: dict = None, settings: dict = None,
+                now=None, **kwargs) -> RowResult:
+        """Run a time-series query over ``[start, end)``, reusing cached buckets
+
+        ``start`` is rounded down to a bucket boundary. Rows come back in
+        ascending bucket order. Extra ``kwargs`` (``profile``, ``timeout``)
+        are passed to ``engine.execute()``.
+        """
+        if bucket_seconds <= 0:
+            raise ValueError(f"bucket_seconds must be positive, got {bucket_seconds}")
+        params = dict(params or {})
+        first = to_epoch(start) // bucket_seconds * bucket_seconds
+        last = to_epoch(end)
+        closed_before = min(last, to_epoch(now or datetime.now(timezone.utc)) - self.settle)
+
+        resolved, _ = resolve_settings(
+            kwargs.get('profile', DEFAULT_PROFILE), settings, None, self.engine.engine_settings
+        )
+        base = make_cache_key(query, params, resolved, scope=self.engine._cache_scope())
+        buckets = []  # (bucket_start, closed)
+        bucket = first
+        while bucket < last:
+            buckets.append((bucket, bucket + bucket_seconds <= closed_before))
+            bucket += bucket_seconds
+
+        rows_by_bucket, columns_with_types = {}, None
+        missing = []
+        for bucket, closed in buckets:
+            cached = self.cache.get(self._bucket_key(base, bucket_seconds, bucket)) if closed else None
+            if cached is not None:
+                columns_with_types, rows_by_bucket[bucket] = cached
+            else:
+                missing.append((bucket, closed))
+
+        # Consecutive missing buckets are fetched with one range query
+        runs = []
+        for bucket, closed in missing:
+            if runs and runs[-1][1] == bucket:
+                runs[-1][1] = bucket + bucket_seconds
+            else:
+                runs.append([bucket, bucket + bucket_seconds])
+
+        truncated = set()  # buckets from range queries cut off at the row limit
+        for run_start, run_end in runs:
+            result = self.engine.execute(
+                query, use_cache=False, settings=settings,
+                params=dict(params, start=from_epoch(run_start), end=from_epoch(min(run_end, last))),
+                **kwargs
+            )
+            columns_with_types = result.columns_with_types
+            index = result.columns.index(bucket_column)
+            bucket = run_start
+            while bucket < run_end:
+                rows_by_bucket.setdefault(bucket, [])
+                if result.truncated:
+                    truncated.add(bucket)
+                bucket += bucket_seconds
+            for row in result.rows:
+                row_bucket = to_epoch(row[index]) // bucket_seconds * bucket_seconds
+                rows_by_bucket.setdefault(row_bucket, []).append(row)
+
+        closed_queried = 0
+        for bucket, closed in missing:
+            if closed and bucket not in truncated:
+                closed_queried += 1
+                self.cache.set(
+                    self._bucket_key(base, bucket_seconds, bucket),
+                    (columns_with_types, rows_by_bucket.get(bucket, [])),
+                    ttl=self.ttl,
+                )
+
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.queries += len(runs)
+            self.stats.buckets_cached += len(buckets) - len(missing)
+            self.stats.buckets_queried += closed_queried
+            self.stats.open_buckets_queried += len(missing) - closed_queried
+        if runs:
+            log.debug(
+                f"Time-series query: {len(buckets) - len(missing)} buckets cached, "
+                f"{len(missing)} queried in {len(runs)} range(s)"
+            )
+
+        rows = []
+        for bucket in sorted(rows_by_bucket):
+            rows.extend(rows_by_bucket[bucket])
+        return RowResult(rows, columns_with_types or [], truncated=bool(truncated))
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return self.stats.as_dict()
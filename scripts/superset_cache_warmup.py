@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Dashboard cache warm-up after deploys and on a schedule
+Ranks dashboards by recent views in Superset's action log, then runs the
+saved query context of each of their charts so the results land in
+DATA_CACHE_CONFIG before users arrive. Queries run a few at a time and
+are started at a bounded rate, so a warm-up never floods ClickHouse.
+Entries that are still fresh are skipped; ones about to expire are
+recomputed, which is what the scheduled Celery run is for. After a
+deploy it runs detached and waits for the web server's health check, so
+it never delays startup.
+
+Usage:
+    python3 superset_cache_warmup.py rank                 # dashboards that would be warmed
+    python3 superset_cache_warmup.py warm --budget 90     # run once now
+    python3 superset_cache_warmup.py warm --wait-for http://localhost:8088/health
+                                                          # post-deploy run (superset_init.sh)
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TOP_DASHBOARDS = 20
+DEFAULT_LOOKBACK_DAYS = 7
+DEFAULT_CONCURRENCY = 4         # chart queries in flight at once
+DEFAULT_RATE = 2.0              # chart queries started per second
+DEFAULT_REFRESH_WINDOW = 900    # seconds; entries expiring sooner are recomputed
+DEFAULT_SCHEDULE = 600          # seconds between scheduled runs (Celery beat)
+DEFAULT_WAIT_TIMEOUT = 600      # seconds to wait for the web server before giving up
+WARMUP_TASK_NAME = 'railway.cache_warmup'
+
+
+class RateLimiter:
+    """Spaces calls to ``wait()`` at least ``1 / rate`` seconds apart across threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self, deadline: float = None) -> bool:
+        """Block until this caller's slot; False if the slot falls after ``deadline``"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            if deadline is not None and slot >= deadline:
+                return False
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+
+def wait_for_server(url: str, timeout: float = DEFAULT_WAIT_TIMEOUT,
+                    interval: float = 5.0) -> bool:
+    """Poll ``url`` until it answers 200; False if ``timeout`` passes first"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=interval) as response:
+                if response.status == 200:
+                    return True
+        except Exception:
+            pass
+        if time.monotonic() + interval >= deadline:
+            return False
+        time.sleep(interval)
+
+
+def rank_dashboards(top: int = DEFAULT_TOP_DASHBOARDS,
+                    lookback_days: int = DEFAULT_LOOKBACK_DAYS) -> list:
+    """``(dashboard_id, views)`` most viewed first, from the ``logs`` table
+
+    Needs an app context. Falls back to the most recently changed
+    dashboards when nothing was logged yet, such as on a fresh install.
+    """
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import func
+
+    from superset.extensions import db
+    from superset.models.core import Log
+    from superset.models.dashboard import Dashboard
+
+    since = datetime.utcnow() - timedelta(days=lookback_days)
+    views = func.count(Log.id)
+    ranked = (
+        db.session.query(Log.dashboard_id, views)
+        .filter(Log.dttm >= since, Log.dashboard_id.isnot(None))
+        .group_by(Log.dashboard_id)
+        .order_by(views.desc())
+        .limit(top)
+        .all()
+    )
+    if ranked:
+        return [(dashboard_id, count) for dashboard_id, count in ranked]
+    recent = (
+        db.session.query(Dashboard.id)
+        .order_by(Dashboard.changed_on.desc())
+        .limit(top)
+        .all()
+    )
+    return [(dashboard_id, 0) for (dashboard_id,) in recent]
+
+
+def dashboard_chart_ids(dashboard_ids) -> list:
+    """Chart ids of ``dashboard_ids``, in dashboard rank order, each chart once"""
+    from superset.extensions import db
+    from superset.models.dashboard import Dashboard
+
+    dashboards = {
+        dashboard.id: dashboard
+        for dashboard in db.session.query(Dashboard).filter(Dashboard.id.in_(dashboard_ids))
+    }
+    chart_ids, seen = [], set()
+    for dashboard_id in dashboard_ids:
+        dashboard = dashboards.get(dashboard_id)
+        if dashboard is None:
+            continue
+        for chart in dashboard.slices:
+            if chart.id not in seen:
+                seen.add(chart.id)
+                chart_ids.append(chart.id)
+    return chart_ids
+
+
+def remaining_ttl(query_context):
+    """Shortest remaining lifetime of a chart's cached query results
+
+    None when any of them is missing or the data cache cannot report
+    lifetimes, which both mean the chart needs running.
+    """
+    from superset.extensions import cache_manager
+
+    backend = cache_manager.data_cache.cache
+    if not hasattr(backend, 'ttl'):
+        return None
+    remaining = []
+    for query_obj in query_context.queries:
+        ttl = backend.ttl(query_context.query_cache_key(query_obj))
+        if ttl is None:
+            return None
+        remaining.append(ttl)
+    return min(remaining) if remaining else None
+
+
+def warm_chart(chart_id: int, refresh_window: float = DEFAULT_REFRESH_WINDOW) -> str:
+    """Fill the data cache for one chart: 'warmed', 'refreshed', 'fresh' or 'skipped'
+
+    Needs an app context and a user (for row-level security). Charts saved
+    before Superset stored query contexts have nothing to replay and are
+    skipped; opening them once in Explore fixes that.
+    """
+    from superset.extensions import db
+    from superset.models.slice import Slice
+
+    chart = db.session.query(Slice).get(chart_id)
+    if chart is None:
+        return 'skipped'
+    query_context = chart.get_query_context()
+    if query_context is None:
+        return 'skipped'
+    ttl = remaining_ttl(query_context)
+    if ttl is not None and ttl > refresh_window:
+        return 'fresh'
+    # A present entry about to expire would be served as-is without force
+    query_context.force = ttl is not None
+    query_context.get_payload()
+    return 'refreshed' if ttl is not None else 'warmed'
+
+
+def warm_up(app, top: int = DEFAULT_TOP_DASHBOARDS,
+            lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+            concurrency: int = DEFAULT_CONCURRENCY, rate: float = DEFAULT_RATE,
+            budget: float = None, refresh_window: float = DEFAULT_REFRESH_WINDOW,
+            username: str = None) -> dict:
+    """Warm the charts of the ``top`` dashboards; returns per-status counts
+
+    Each worker thread gets its own app context and session. Charts whose
+    start slot falls after ``budget`` seconds are counted as 'not_started';
+    queries already running are left to finish.
+    """
+    from superset.extensions import db, security_manager
+    from superset.utils.core import override_user
+
+    started = time.monotonic()
+    deadline = started + budget if budget else None
+    with app.app_context():
+        ranked = rank_dashboards(top, lookback_days)
+        chart_ids = dashboard_chart_ids([dashboard_id for dashboard_id, _ in ranked])
+    limiter = RateLimiter(rate)
+    username = username or os.environ.get('WARMUP_USERNAME') or os.environ.get('ADMIN_USERNAME', 'admin')
+
+    def run(chart_id):
+        if not limiter.wait(deadline):
+            return 'not_started'
+        with app.app_context():
+            try:
+                user = security_manager.find_user(username=username)
+                with override_user(user):
+                    return warm_chart(chart_id, refresh_window)
+            finally:
+                db.session.remove()
+
+    stats = {'dashboards': len(ranked), 'charts': len(chart_ids)}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency),
+                            thread_name_prefix='cache-warmup') as executor:
+        futures = {executor.submit(run, chart_id): chart_id for chart_id in chart_ids}
+        for future in as_completed(futures):
+            try:
+                status = future.result()
+            except Exception as e:
+                log.warning(f"Warm-up of chart {futures[future]} failed: {e}")
+                status = 'failed'
+            stats[status] = stats.get(status, 0) + 1
+    stats['seconds'] = round(time.monotonic() - started, 1)
+    log.info(f"Cache warm-up: {stats}")
+    return stats
+
+
+def _register_task():
+    """Celery task for the beat schedule in superset_config.py, if Superset is importable"""
+    try:
+        from flask import current_app
+        from superset.extensions import celery_app
+    except ImportError:
+        return None
+
+    @celery_app.task(name=WARMUP_TASK_NAME, ignore_result=True)
+    def scheduled_warm_up(**kwargs):
+        return warm_up(current_app._get_current_object(), **kwargs)
+
+    return scheduled_warm_up
+
+
+scheduled_warm_up = _register_task()
+
+
+def _build_app():
+    # Outside gunicorn and Celery the app needs the same FAB workarounds
+    # as the init steps, which db_upgrade_safe.py installs
+    sys.path.insert(0, '/app/scripts')
+    try:
+        from db_upgrade_safe import _build_app as build
+    except ImportError:
+        from superset.app import create_app as build
+    return build()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP_DASHBOARDS)
+    parser.add_argument('--lookback-days', type=int, default=DEFAULT_LOOKBACK_DAYS)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rank', help='list the dashboards a warm-up would cover')
+    warm = sub.add_parser('warm', help='run the warm-up once')
+    warm.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    warm.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                      help='chart queries started per second')
+    warm.add_argument('--budget', type=float, default=None,
+                      help='seconds after which no further chart is started')
+    warm.add_argument('--refresh-window', type=float, default=DEFAULT_REFRESH_WINDOW)
+    warm.add_argument('--username', default=None)
+    warm.add_argument('--wait-for', default=None, metavar='URL',
+                      help='health check URL to wait for before starting')
+    warm.add_argument('--wait-timeout', type=float, default=DEFAULT_WAIT_TIMEOUT)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='[cache_warmup] %(message)s')
+
+    if args.command == 'warm' and args.wait_for:
+        if not wait_for_server(args.wait_for, args.wait_timeout):
+            log.warning(f"{args.wait_for} did not come up within {args.wait_timeout:.0f}s; "
+                        f"skipping warm-up")
+            return 1
+    app = _build_app()
+    if args.command == 'rank':
+        with app.app_context():
+            for dashboard_id, views in rank_dashboards(args.top, args.lookback_days):
+                print(f"dashboard {dashboard_id}: {views} views")
+        return 0
+
+    stats = warm_up(
+        app, top=args.top, lookback_days=args.lookback_days,
+        concurrency=args.concurrency, rate=args.rate, budget=args.budget,
+        refresh_window=args.refresh_window, username=args.username,
+    )
+    print(f"Warmed {stats.get('warmed', 0)}, refreshed {stats.get('refreshed', 0)}, "
+          f"fresh {stats.get('fresh', 0)}, skipped {stats.get('skipped', 0)}, "
+          f"failed {stats.get('failed', 0)}, not started {stats.get('not_started', 0)} "
+          f"of {stats['charts']} charts on {stats['dashboards']} dashboards "
+          f"in {stats['seconds']}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Metadata-database connection pool sizing and metrics for superset_config.py
+Sizes SQLAlchemy's pool from the gunicorn worker/thread topology and the
+Postgres connection budget instead of the library defaults, swaps the
+per-checkout ``pool_pre_ping`` round trip for a ping only after a connection
+has sat idle, and counts checkout waits, overflow connections and pool
+timeouts per process.
+
+Usage:
+    python3 superset_db_pool.py plan          # pool sizes for the current environment
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import weakref
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 100    # Postgres max_connections shared by every process
+DEFAULT_RESERVED_CONNECTIONS = 10  # kept free for the MCP server, init scripts, psql
+DEFAULT_IDLE_PING_AFTER = 30     # seconds idle before a checkout pings first
+DEFAULT_POOL_RECYCLE = 1800      # seconds; the idle ping catches dropped connections sooner
+DEFAULT_POOL_TIMEOUT = 10        # seconds a checkout waits before raising
+SLOW_CHECKOUT_SECONDS = 1.0      # checkout waits logged as warnings
+
+PGBOUNCER_MODES = ('session', 'transaction')
+
+_pools = weakref.WeakSet()
+
+
+def server_topology(env=os.environ) -> dict:
+    """Gunicorn processes and per-process concurrency, from run-server.sh's env"""
+    workers = int(env.get('SERVER_WORKER_AMOUNT', 1))
+    worker_class = env.get('SERVER_WORKER_CLASS', 'gthread')
+    if worker_class == 'gthread':
+        concurrency = int(env.get('SERVER_THREADS_AMOUNT', 20))
+    elif worker_class in ('gevent', 'eventlet'):
+        concurrency = int(env.get('SERVER_WORKER_CONNECTIONS', 1000))
+    else:
+        concurrency = 1
+    return {'workers': max(1, workers), 'worker_class': worker_class,
+            'concurrency': max(1, concurrency)}
+
+
+def size_pool(workers: int, concurrency: int,
+              max_connections: int = DEFAULT_MAX_CONNECTIONS,
+              reserved: int = DEFAULT_RESERVED_CONNECTIONS,
+              pgbouncer: str = None) -> dict:
+    """``pool_size``/``max_overflow`` for one process of ``workers``
+
+    Half a process's concurrency stays open; overflow covers the rest, so a
+    burst can use every thread but idle workers hold only the steady-state
+    connections. Both are capped so that all workers together stay within
+    ``max_connections - reserved``. Behind PgBouncer in transaction mode
+    client connections are cheap and PgBouncer caps the server side, so the
+    pool keeps one connection per thread and never overflows.
+    """
+    if pgbouncer == 'transaction':
+        return {'pool_size': concurrency, 'max_overflow': 0}
+    budget = max(1, (max_connections - reserved) // workers)
+    ceiling = min(concurrency, budget)
+    pool_size = max(1, min(math.ceil(concurrency / 2), ceiling))
+    return {'pool_size': pool_size, 'max_overflow': max(0, ceiling - pool_size)}
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that times checkouts and pings connections only after idling
+
+    ``idle_ping_after`` is a class attribute because ``create_engine`` only
+    forwards its own pool arguments; ``engine_options`` sets it.
+    """
+
+    idle_ping_after = DEFAULT_IDLE_PING_AFTER
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'checkouts': 0, 'checkout_wait_total': 0.0, 'checkout_wait_max': 0.0,
+            'slow_checkouts': 0, 'timeouts': 0, 'overflow_opened': 0, 'overflow_peak': 0,
+            'idle_pings': 0, 'stale_connections': 0,
+        }
+        event.listen(self, 'checkin', self._on_checkin)
+        event.listen(self, 'checkout', self._on_checkout)
+        _pools.add(self)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        overflow_before = self.overflow()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.stats['timeouts'] += 1
+            log.warning(
+                f"Metadata DB pool exhausted: {self.checkedout()} checked out, "
+                f"overflow {self.overflow()}/{self._max_overflow}"
+            )
+            raise
+        wait = time.perf_counter() - started
+        overflow = max(0, self.overflow())
+        with self._stats_lock:
+            stats = self.stats
+            stats['checkouts'] += 1
+            stats['checkout_wait_total'] += wait
+            stats['checkout_wait_max'] = max(stats['checkout_wait_max'], wait)
+            if overflow > max(0, overflow_before):
+                stats['overflow_opened'] += 1
+            stats['overflow_peak'] = max(stats['overflow_peak'], overflow)
+            if wait >= SLOW_CHECKOUT_SECONDS:
+                stats['slow_checkouts'] += 1
+        if wait >= SLOW_CHECKOUT_SECONDS:
+            log.warning(f"Metadata DB checkout waited {wait:.2f}s ({self.status()})")
+        return connection
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _on_checkin(dbapi_connection, connection_record):
+        connection_record.info['checked_in_at'] = time.monotonic()
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        """Ping a connection that idled past ``idle_ping_after``; replace it if dead
+
+        Raising DisconnectionError makes the pool discard the connection and
+        retry the checkout with a fresh one, as ``pool_pre_ping`` does.
+        """
+        checked_in_at = connection_record.info.get('checked_in_at')
+        if checked_in_at is None or time.monotonic() - checked_in_at < self.idle_ping_after:
+            return
+        self._count('idle_pings')
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        except Exception as e:
+            self._count('stale_connections')
+            log.info(f"Discarding stale metadata DB connection: {e}")
+            raise exc.DisconnectionError() from e
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        checkouts = stats['checkouts']
+        stats['checkout_wait_avg'] = stats['checkout_wait_total'] / checkouts if checkouts else 0.0
+        stats.update({
+            'pool_size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_out': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow': max(0, self.overflow()),
+        })
+        return stats
+
+
+def engine_options(uri: str, env=os.environ) -> dict:
+    """``SQLALCHEMY_ENGINE_OPTIONS`` for the metadata database at ``uri``
+
+    Environment:
+        METADATA_DB_MAX_CONNECTIONS   Postgres max_connections (default 100)
+        METADATA_DB_RESERVED          connections left for non-web processes
+        METADATA_DB_PGBOUNCER         'transaction' or 'session' when behind PgBouncer
+        METADATA_DB_POOL_SIZE / METADATA_DB_MAX_OVERFLOW   explicit overrides
+        METADATA_DB_IDLE_PING_AFTER   seconds idle before a checkout pings
+    """
+    if uri.startswith('sqlite'):
+        return {'echo': False}
+
+    pgbouncer = env.get('METADATA_DB_PGBOUNCER') or None
+    if pgbouncer is not None and pgbouncer not in PGBOUNCER_MODES:
+        log.warning(f"Ignoring METADATA_DB_PGBOUNCER={pgbouncer!r}; expected one of {PGBOUNCER_MODES}")
+        pgbouncer = None
+    topology = server_topology(env)
+    sizes = size_pool(
+        topology['workers'], topology['concurrency'],
+        max_connections=int(env.get('METADATA_DB_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)),
+        reserved=int(env.get('METADATA_DB_RESERVED', DEFAULT_RESERVED_CONNECTIONS)),
+        pgbouncer=pgbouncer,
+    )
+    if env.get('METADATA_DB_POOL_SIZE'):
+        sizes['pool_size'] = int(env['METADATA_DB_POOL_SIZE'])
+    if env.get('METADATA_DB_MAX_OVERFLOW'):
+        sizes['max_overflow'] = int(env['METADATA_DB_MAX_OVERFLOW'])
+
+    MeteredQueuePool.idle_ping_after = float(
+        env.get('METADATA_DB_IDLE_PING_AFTER', DEFAULT_IDLE_PING_AFTER)
+    )
+    options = {
+        'poolclass': MeteredQueuePool,
+        'pool_size': sizes['pool_size'],
+        'max_overflow': sizes['max_overflow'],
+        'pool_timeout': DEFAULT_POOL_TIMEOUT,
+        'pool_recycle': DEFAULT_POOL_RECYCLE,
+        # Reuse the most recently returned connection so surplus ones idle
+        # out instead of every connection being kept warm
+        'pool_use_lifo': True,
+        'echo': False,
+    }
+    return options
+
+
+def get_pool_stats() -> list:
+    """Stats for every metadata pool in this process"""
+    return [pool.get_stats() for pool in list(_pools)]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    plan = sub.add_parser('plan', help='print the pool options derived from the environment')
+    plan.add_argument('--uri', default=os.environ.get('SQLALCHEMY_DATABASE_URI', 'postgresql://'))
+    args = parser.parse_args(argv)
+
+    topology = server_topology()
+    options = engine_options(args.uri)
+    options.pop('poolclass', None)
+    print(json.dumps({'topology': topology, 'engine_options': options}, indent=2))
+    if 'pool_size' in options:
+        per_process = options['pool_size'] + options['max_overflow']
+        print(f"Worst case: {topology['workers']} worker(s) x {per_process} = "
+              f"{topology['workers'] * per_process} connections")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
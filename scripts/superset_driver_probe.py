@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Lazy database-driver probing for superset_config.py
+Every gunicorn worker, Celery process and `superset` CLI call loads the
+config; importing psycopg2, clickhouse_connect, clickhouse_driver and PIL
+there just to print their versions costs each of them measurable start-up
+time. This finds drivers with importlib metadata instead of importing them,
+caches the answer on disk per image, and profiles real import costs on
+demand.
+
+Usage:
+    python3 superset_driver_probe.py probe              # print (and cache) driver status
+    python3 superset_driver_probe.py profile            # import cost of each driver
+    python3 superset_driver_probe.py profile superset_config
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import sysconfig
+import time
+
+log = logging.getLogger(__name__)
+
+# label -> (import name, distribution name)
+PROBED_DRIVERS = {
+    'PostgreSQL (psycopg2)': ('psycopg2', 'psycopg2-binary'),
+    'ClickHouse Connect (HTTP)': ('clickhouse_connect', 'clickhouse-connect'),
+    'ClickHouse Driver (native)': ('clickhouse_driver', 'clickhouse-driver'),
+    'Pillow (screenshots, PDF)': ('PIL', 'pillow'),
+    'MongoDB (pymongo)': ('pymongo', 'pymongo'),
+    'MySQL (mysqlclient)': ('MySQLdb', 'mysqlclient'),
+    'MSSQL (pymssql)': ('pymssql', 'pymssql'),
+}
+
+# Written at image build time (see Dockerfile); a stale or unwritable file
+# just means probing again
+DEFAULT_PROBE_CACHE = os.environ.get('SUPERSET_DRIVER_PROBE_CACHE', '/app/.driver_probe.json')
+
+_IMPORTTIME_RE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S.*)$')
+
+_status = None
+
+
+def image_key() -> str:
+    """Changes whenever the interpreter or the venv's installed packages change
+
+    Installing or removing a package rewrites the site-packages directory,
+    which moves its mtime. Only the interpreter's own site-packages count,
+    so extra ``sys.path`` entries added by the config don't change the key.
+    """
+    parts = [sys.version, sys.prefix]
+    for path in sorted({sysconfig.get_paths()['purelib'], sysconfig.get_paths()['platlib']}):
+        if os.path.isdir(path):
+            parts.append(f'{path}:{os.stat(path).st_mtime_ns}')
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _version(module: str, distribution: str):
+    from importlib import metadata
+
+    for name in (distribution, module):
+        try:
+            return metadata.version(name)
+        except metadata.PackageNotFoundError:
+            continue
+    return None
+
+
+def probe() -> dict:
+    """``{label: {'module', 'available', 'version'}}`` without importing any driver"""
+    status = {}
+    for label, (module, distribution) in PROBED_DRIVERS.items():
+        try:
+            available = importlib.util.find_spec(module) is not None
+        except (ImportError, ValueError):
+            available = False
+        status[label] = {
+            'module': module,
+            'available': available,
+            'version': _version(module, distribution) if available else None,
+        }
+    return status
+
+
+def get_driver_status(cache_path: str = DEFAULT_PROBE_CACHE, refresh: bool = False) -> dict:
+    """Driver status, read from ``cache_path`` when it was written for this image
+
+    Memoized per process; a miss probes once and tries to write the cache.
+    """
+    global _status
+    if _status is not None and not refresh:
+        return _status
+    key = image_key()
+    if not refresh:
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('image_key') == key:
+                _status = cached['drivers']
+                return _status
+        except (OSError, ValueError, KeyError):
+            pass
+    _status = probe()
+    try:
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'image_key': key, 'drivers': _status}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        log.debug(f"Driver probe cache {cache_path} not written: {e}")
+    return _status
+
+
+def driver_available(module: str) -> bool:
+    """True if a probed driver module can be imported (without importing it)"""
+    return any(
+        info['module'] == module and info['available']
+        for info in get_driver_status().values()
+    )
+
+
+def profile_imports(modules, python: str = sys.executable, env: dict = None) -> list:
+    """``(module, cumulative_ms, self_ms, error)`` per module, slowest first
+
+    Each module is imported in a fresh interpreter under ``-X importtime``,
+    so a module's cost includes everything it pulls in that the bare
+    interpreter had not already loaded.
+    """
+    results = []
+    for module in modules:
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [python, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True, env=env,
+        )
+        wall = (time.perf_counter() - started) * 1000
+        if completed.returncode != 0:
+            results.append((module, None, None, completed.stderr.strip().splitlines()[-1:]))
+            continue
+        cumulative = self_us = None
+        for line in completed.stderr.splitlines():
+            match = _IMPORTTIME_RE.match(line)
+            if match and match.group(3).strip() == module:
+                self_us, cumulative = int(match.group(1)), int(match.group(2))
+        results.append((
+            module,
+            cumulative / 1000 if cumulative is not None else wall,
+            self_us / 1000 if self_us is not None else None,
+            None,
+        ))
+    results.sort(key=lambda result: -(result[1] or 0))
+    return results
+
+
+def _print_status(status: dict):
+    for label, info in status.items():
+        if info['available']:
+            print(f"✓ {label}: {info['version'] or 'installed'}")
+        else:
+            print(f"✗ {label}: not installed")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cache', default=DEFAULT_PROBE_CACHE)
+    sub = parser.add_subparsers(dest='command', required=True)
+    probe_parser = sub.add_parser('probe', help='print driver status, writing the cache if stale')
+    probe_parser.add_argument('--refresh', action='store_true', help='ignore the cached result')
+    profile = sub.add_parser('profile', help='import cost of each module in a fresh interpreter')
+    profile.add_argument('modules', nargs='*',
+                         help='modules to profile (default: every probed driver)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'probe':
+        _print_status(get_driver_status(args.cache, refresh=args.refresh))
+        return 0
+
+    modules = args.modules or [module for module, _ in PROBED_DRIVERS.values()]
+    print(f"{'module':<28}{'cumulative (ms)':>18}{'self (ms)':>12}")
+    print('-' * 58)
+    for module, cumulative, self_ms, error in profile_imports(modules):
+        if cumulative is None:
+            print(f"{module:<28}{'failed':>18}  {error[0] if error else ''}")
+        else:
+            self_text = f'{self_ms:.1f}' if self_ms is not None else '-'
+            print(f"{module:<28}{cumulative:>18.1f}{self_text:>12}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
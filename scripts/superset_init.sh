@@ -58,46 +58,9 @@ for attempt in range(1, max_attempts + 1):
 echo "======================================================================"
 echo "Testing ClickHouse Driver Support"
 echo "======================================================================"
-python3 -c "
-import sys
-print('Python path:', sys.path)
-try:
-    import clickhouse_connect
-    print('✓ ClickHouse Connect (HTTP) imported successfully')
-    print('  Version:', clickhouse_connect.__version__)
-    print('  Features: High-performance HTTP driver with SQLAlchemy support')
-except ImportError as e:
-    print('✗ ClickHouse Connect import failed:', e)
-
-try:
-    import clickhouse_driver
-    print('✓ ClickHouse Driver (Native) imported successfully')
-    print('  Version:', clickhouse_driver.__version__)
-    print('  Features: Native protocol support for Railway compatibility')
-except ImportError as e:
-    print('✗ ClickHouse Driver import failed:', e)
-
-try:
-    from sqlalchemy import create_engine
-    print('✓ SQLAlchemy imported successfully')
-except ImportError as e:
-    print('✗ SQLAlchemy import failed:', e)
-
-try:
-    from sqlalchemy.dialects import registry
-    registry.register('clickhouse', 'clickhouse_driver.dbapi.extras.dialect', 'ClickHouseDialect')
-    registry.register('clickhouse+native', 'clickhouse_driver.dbapi.extras.dialect', 'ClickHouseDialect')
-    print('✓ ClickHouse native dialects registered successfully')
-except Exception as e:
-    print('✗ Dialect registration failed:', e)
-
-try:
-    from PIL import Image
-    import PIL
-    print(f'✓ Pillow (PIL) version {PIL.__version__} - Screenshot and PDF generation enabled')
-except ImportError as e:
-    print('✗ Pillow (PIL) not available:', e)
-"
+# Driver status comes from the probe cached at image build time; nothing is
+# imported here, so this costs milliseconds instead of several driver imports
+python3 /app/superset_driver_probe.py probe
 
 echo "======================================================================"
 echo "Superset Database Initialization"
@@ -206,5 +169,46 @@ if [ -z "${SKIP_MCP:-}" ]; then
     sleep 3
 fi
 
+# Warm the data cache for the most viewed dashboards once the web server is
+# up. Only worthwhile with Redis: without it every process has its own
+# in-memory cache and this one exits right after. It runs detached like the
+# MCP server and waits for /health, so chart queries still in flight can
+# never hold up Railway's health check; WARMUP_BUDGET only bounds how long
+# new charts keep being started.
+if [ -n "${REDIS_URL:-}" ] && [ -z "${SKIP_WARMUP:-}" ]; then
+    mkdir -p /app/superset_home/logs
+    chown superset /app/superset_home/logs 2>/dev/null || true
+    setsid nohup su -s /bin/bash superset -c "python3 /app/superset_cache_warmup.py warm \
+        --wait-for http://localhost:${SUPERSET_PORT:-${PORT:-8088}}/health \
+        --budget ${WARMUP_BUDGET:-90} --concurrency ${WARMUP_CONCURRENCY:-4} \
+        --rate ${WARMUP_RATE:-2}" \
+        >> /app/superset_home/logs/cache-warmup.log 2>&1 < /dev/null &
+    echo "✓ Cache warm-up scheduled (pid: $!) — logs at /app/superset_home/logs/cache-warmup.log"
+fi
+
+# Start the Celery workers and beat when a broker is configured, so SQL Lab
+# and chart queries run off the web workers. Interactive queries get their
+# own worker; exports and cache warm-up share a smaller one, so neither can
+# hold up a chart. Each is detached like the MCP server.
+if [ -n "${CELERY_BROKER_URL:-${REDIS_URL:-}}" ] && [ -z "${SKIP_CELERY:-}" ] \
+        && [ "${SUPERSET_ASYNC_QUERIES:-1}" = "1" ]; then
+    mkdir -p /app/superset_home/logs
+    chown superset /app/superset_home/logs 2>/dev/null || true
+    CELERY_APP="--app=superset.tasks.celery_app:app"
+    start_celery() {
+        local name=$1
+        shift
+        setsid nohup su -s /bin/bash superset -c \
+            "/app/.venv/bin/celery $CELERY_APP $*" \
+            >> "/app/superset_home/logs/celery-$name.log" 2>&1 < /dev/null &
+        echo "✓ Celery $name starting (pid: $!) — logs at /app/superset_home/logs/celery-$name.log"
+    }
+    start_celery interactive worker -n interactive@%h -Q interactive \
+        --concurrency="${CELERY_INTERACTIVE_CONCURRENCY:-4}" -O fair
+    start_celery background worker -n background@%h -Q exports,warmup,celery \
+        --concurrency="${CELERY_BACKGROUND_CONCURRENCY:-2}" -O fair
+    start_celery beat beat --pidfile= --schedule=/tmp/celerybeat-schedule
+fi
+
 # Start the web server as the superset user in the foreground.
 exec su -s /bin/bash superset -c "/usr/bin/run-server.sh"
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+File-backed query results store on the persistent DATA_DIR volume
+A cachelib-compatible ``RESULTS_BACKEND`` that keeps results as files
+instead of in Redis memory. SQL Lab hands the backend an opaque,
+already-compressed payload and reads it back whole, so for Superset this
+is a disk-backed store, not a pager. Arrow tables stored directly
+(``put_table()``, e.g. from ``ClickHouseRailwayEngine.execute_to_store()``)
+are written as LZ4-compressed Arrow IPC files in fixed-size record
+batches and read back through a memory map, so ``read_page()`` only
+touches the batches a page overlaps. A janitor keeps the directory under
+a byte budget by deleting the least recently read results first.
+
+Usage:
+    python3 superset_results_store.py stats /app/superset_home/data/results
+    python3 superset_results_store.py sweep /app/superset_home/data/results --max-bytes 1073741824
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from cachelib.base import BaseCache
+
+log = logging.getLogger(__name__)
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # blobs fall back to zlib
+    lz4_frame = None
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3   # volume space for results
+DEFAULT_TIMEOUT = 24 * 3600         # seconds a result stays readable
+DEFAULT_BATCH_ROWS = 4096           # rows per Arrow record batch; a page decodes whole batches
+DEFAULT_SWEEP_INTERVAL = 60         # seconds between janitor runs per process
+SWEEP_TARGET = 0.9                  # sweep down to this fraction of max_bytes
+
+# Blob header: magic, codec, expiry (unix time, 0 = never)
+_BLOB_MAGIC = b'SRB1'
+_BLOB_HEADER = struct.Struct('<4scd')
+_RAW, _PICKLE_ZLIB, _PICKLE_LZ4 = b'r', b'z', b'l'
+_ARROW_MAGIC = b'ARROW1'
+
+# Schema metadata keys on stored Arrow files
+_META_EXPIRES = b'superset_results.expires'
+_META_OFFSETS = b'superset_results.batch_offsets'
+
+
+def _arrow_compression():
+    import pyarrow as pa
+
+    return 'lz4' if pa.Codec.is_available('lz4_frame') else None
+
+
+class FileResultsBackend(BaseCache):
+    """cachelib backend storing each result as a file under ``path``
+
+    ``get()`` returns what ``set()`` stored: bytes, any picklable value, or
+    a ``pyarrow.Table``. ``read_page()`` and ``num_rows()`` work on stored
+    tables without reading them whole. Every process sweeps the directory
+    at most every ``sweep_interval`` seconds, or sooner once it has written
+    a tenth of ``max_bytes``; concurrent sweeps are harmless.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 default_timeout: int = DEFAULT_TIMEOUT,
+                 batch_rows: int = DEFAULT_BATCH_ROWS,
+                 compression: str = 'auto',
+                 sweep_interval: float = DEFAULT_SWEEP_INTERVAL):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.batch_rows = batch_rows
+        self.compression = compression
+        self.sweep_interval = sweep_interval
+        self._written_since_sweep = 0
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0,
+                      'bytes_written': 0, 'pages': 0, 'swept_files': 0, 'swept_bytes': 0}
+
+    def _count(self, name: str, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.res')
+
+    def _expires(self, timeout) -> float:
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else 0.0
+
+    # -- writing --------------------------------------------------------
+
+    def _write(self, key: str, write) -> bool:
+        """Write through ``write(fileobj)`` to a temp file, then rename into place"""
+        target = self._file(key)
+        tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            # Created on first write, by whichever user runs the query, not
+            # by whoever happened to load the config first
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                write(f)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, target)
+        except Exception as e:
+            log.warning(f"Results store write of {key} failed: {e}")
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return False
+        self._count('stores')
+        self._count('bytes_written', size)
+        with self._lock:
+            self._written_since_sweep += size
+            due = (self._written_since_sweep >= self.max_bytes / 10
+                   or time.monotonic() - self._last_sweep >= self.sweep_interval)
+        if due:
+            self.sweep()
+        return True
+
+    def _write_blob(self, key: str, value, expires: float) -> bool:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            codec, body = _RAW, value
+        else:
+            raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if lz4_frame is not None:
+                codec, body = _PICKLE_LZ4, lz4_frame.compress(raw)
+            else:
+                codec, body = _PICKLE_ZLIB, zlib.compress(raw, 1)
+
+        def write(f):
+            f.write(_BLOB_HEADER.pack(_BLOB_MAGIC, codec, expires))
+            f.write(body)
+
+        return self._write(key, write)
+
+    def put_table(self, key: str, table, timeout=None) -> bool:
+        """Store a ``pyarrow.Table`` (or RecordBatch) as a compressed Arrow IPC file"""
+        import pyarrow as pa
+
+        if isinstance(table, pa.RecordBatch):
+            table = pa.Table.from_batches([table])
+        batches = table.to_batches(max_chunksize=self.batch_rows)
+        offsets = [0]
+        for batch in batches:
+            offsets.append(offsets[-1] + batch.num_rows)
+        metadata = dict(table.schema.metadata or {})
+        metadata[_META_EXPIRES] = repr(self._expires(timeout)).encode('ascii')
+        metadata[_META_OFFSETS] = json.dumps(offsets).encode('ascii')
+        schema = table.schema.with_metadata(metadata)
+        compression = _arrow_compression() if self.compression == 'auto' else self.compression
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+
+        def write(f):
+            with pa.ipc.new_file(f, schema, options=options) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+
+        return self._write(key, write)
+
+    def set(self, key: str, value, timeout=None) -> bool:
+        if type(value).__module__.startswith('pyarrow') and hasattr(value, 'to_batches'):
+            return self.put_table(key, value, timeout)
+        return self._write_blob(key, value, self._expires(timeout))
+
+    def add(self, key: str, value, timeout=None) -> bool:
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    # -- reading --------------------------------------------------------
+
+    def _open_table(self, key: str):
+        """Memory-mapped Arrow reader for ``key`` and its batch offsets, or None"""
+        import pyarrow as pa
+
+        target = self._file(key)
+        try:
+            with open(target, 'rb') as f:
+                if f.read(len(_ARROW_MAGIC)) != _ARROW_MAGIC:
+                    return None
+            reader = pa.ipc.open_file(pa.memory_map(target, 'r'))
+        except (OSError, pa.ArrowInvalid):
+            return None
+        metadata = reader.schema.metadata or {}
+        expires = float(metadata.get(_META_EXPIRES, b'0'))
+        if expires and expires <= time.time():
+            self._count('expired')
+            self._remove(target)
+            return None
+        offsets = json.loads(metadata.get(_META_OFFSETS, b'null'))
+        if offsets is None:
+            offsets = [0]
+            for i in range(reader.num_record_batches):
+                offsets.append(offsets[-1] + reader.get_batch(i).num_rows)
+        self._touch(target)
+        return reader, offsets
+
+    def _read_blob(self, target: str):
+        # Blobs are always returned whole, so a plain read is the one copy needed
+        with open(target, 'rb') as f:
+            magic, codec, expires = _BLOB_HEADER.unpack(f.read(_BLOB_HEADER.size))
+            if magic != _BLOB_MAGIC:
+                raise ValueError(f"{target} is not a results blob")
+            if expires and expires <= time.time():
+                return None, True
+            body = f.read()
+        if codec == _RAW:
+            return body, False
+        if codec == _PICKLE_LZ4:
+            if lz4_frame is None:
+                raise RuntimeError("Result is lz4-compressed but lz4 is not installed")
+            return pickle.loads(lz4_frame.decompress(body)), False
+        return pickle.loads(zlib.decompress(body)), False
+
+    def get(self, key: str):
+        target = self._file(key)
+        try:
+            with open(target, 'rb') as f:
+                magic = f.read(len(_ARROW_MAGIC))
+        except OSError:
+            self._count('misses')
+            return None
+        if magic == _ARROW_MAGIC:
+            opened = self._open_table(key)
+            if opened is None:
+                self._count('misses')
+                return None
+            self._count('hits')
+            return opened[0].read_all()
+        try:
+            value, expired = self._read_blob(target)
+        except (OSError, ValueError, struct.error) as e:
+            log.warning(f"Results store read of {key} failed: {e}")
+            self._count('misses')
+            return None
+        if expired:
+            self._count('expired')
+            self._count('misses')
+            self._remove(target)
+            return None
+        self._touch(target)
+        self._count('hits')
+        return value
+
+    def num_rows(self, key: str):
+        """Row count of a stored table, from its footer metadata; None if absent"""
+        opened = self._open_table(key)
+        return opened[1][-1] if opened is not None else None
+
+    def read_page(self, key: str, offset: int, limit: int):
+        """Rows ``[offset, offset + limit)`` of a stored table; None if absent
+
+        Only the record batches overlapping the page are read from the
+        memory map; uncompressed batches are not even copied.
+        """
+        import pyarrow as pa
+
+        opened = self._open_table(key)
+        if opened is None:
+            self._count('misses')
+            return None
+        reader, offsets = opened
+        total = offsets[-1]
+        offset = max(0, min(offset, total))
+        end = min(total, offset + max(0, limit))
+        first = max(0, bisect.bisect_right(offsets, offset) - 1)
+        batches = []
+        index = first
+        while index < reader.num_record_batches and offsets[index] < end:
+            batches.append(reader.get_batch(index))
+            index += 1
+        self._count('pages')
+        if not batches:
+            return reader.schema.empty_table()
+        page = pa.Table.from_batches(batches, schema=reader.schema)
+        return page.slice(offset - offsets[first], end - offset)
+
+    def has(self, key: str) -> bool:
+        target = self._file(key)
+        try:
+            with open(target, 'rb') as f:
+                head = f.read(_BLOB_HEADER.size)
+        except OSError:
+            return False
+        if head.startswith(_ARROW_MAGIC):
+            return self._open_table(key) is not None
+        try:
+            magic, _, expires = _BLOB_HEADER.unpack(head)
+        except struct.error:
+            return False
+        return magic == _BLOB_MAGIC and (not expires or expires > time.time())
+
+    # -- removal --------------------------------------------------------
+
+    @staticmethod
+    def _touch(target: str):
+        # mtime marks the last read, which is what the janitor evicts by
+        try:
+            os.utime(target)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(target: str) -> bool:
+        # Readers holding a memory map keep their pages until they unmap
+        try:
+            os.unlink(target)
+            return True
+        except OSError:
+            return False
+
+    def delete(self, key: str) -> bool:
+        return self._remove(self._file(key))
+
+    def _entries(self):
+        try:
+            return list(os.scandir(self.path))
+        except FileNotFoundError:
+            return []
+
+    def clear(self) -> bool:
+        for entry in self._entries():
+            if entry.name.endswith('.res'):
+                self._remove(entry.path)
+        return True
+
+    def sweep(self, max_bytes: int = None) -> dict:
+        """Drop stale temp files and least recently read results until under budget
+
+        Results unread for longer than ``default_timeout`` are removed
+        regardless of the budget; per-result expiry is enforced on read.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            self._last_sweep = time.monotonic()
+            self._written_since_sweep = 0
+        now = time.time()
+        max_age = self.default_timeout or None
+        files, total, removed, freed = [], 0, 0, 0
+        for entry in self._entries():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            stale_tmp = entry.name.endswith('.tmp') and now - st.st_mtime > 3600
+            unread = max_age and entry.name.endswith('.res') and now - st.st_mtime > max_age
+            if stale_tmp or unread:
+                if self._remove(entry.path):
+                    removed, freed = removed + 1, freed + st.st_size
+                continue
+            if entry.name.endswith('.res'):
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        unread_removed = removed
+        if total > max_bytes:
+            target = max_bytes * SWEEP_TARGET
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                if self._remove(path):
+                    removed, freed = removed + 1, freed + size
+                total -= size
+        self._count('swept_files', removed)
+        self._count('swept_bytes', freed)
+        if removed:
+            log.info(f"Results store sweep removed {removed} files ({freed / 1024 ** 2:.1f}MB)")
+        return {'remaining': len(files) - (removed - unread_removed), 'bytes': total,
+                'removed': removed, 'freed': freed}
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    stats = sub.add_parser('stats', help='file count and bytes used')
+    stats.add_argument('path')
+    sweep = sub.add_parser('sweep', help='run the janitor once')
+    sweep.add_argument('path')
+    sweep.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES)
+    args = parser.parse_args(argv)
+
+    if args.command == 'stats':
+        sizes = [entry.stat().st_size for entry in os.scandir(args.path)
+                 if entry.name.endswith('.res')]
+        print(f"{len(sizes)} results, {sum(sizes) / 1024 ** 2:.1f}MB in {args.path}")
+        return 0
+    result = FileResultsBackend(args.path, max_bytes=args.max_bytes).sweep()
+    print(f"Removed {result['removed']} files ({result['freed'] / 1024 ** 2:.1f}MB); "
+          f"{result['remaining']} remain")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Two-tier cache backend for every Superset cache region
+A size-bounded in-process L1 (the byte-budget LRU from
+clickhouse_railway_cache) sits in front of a shared Redis L2. Payloads are
+pickled once, compressed above a size threshold before they go to Redis,
+and concurrent misses on the same key can wait for the first caller to
+fill it instead of all recomputing it.
+
+Used from superset_config.py as ``'CACHE_TYPE': 'superset_tiered_cache.TieredCache'``
+with these region keys on top of flask-caching's own:
+
+    CACHE_L1_MAX_BYTES        in-process budget (0: no L1 while Redis is configured)
+    CACHE_L1_TIMEOUT          cap on L1 lifetime, bounding staleness across workers
+    CACHE_COMPRESS_THRESHOLD  payloads at least this large are compressed for Redis
+    CACHE_STAMPEDE_WAIT       seconds a miss waits for another caller's fill (0: off)
+    CACHE_STAMPEDE_LOCK_TIMEOUT  seconds a fill claim is held before it expires
+"""
+
+import logging
+import os
+import pickle
+import threading
+import time
+import zlib
+
+from flask_caching.backends.base import BaseCache
+
+from clickhouse_railway_cache import ResultCache
+
+log = logging.getLogger(__name__)
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # zlib still works, just slower
+    lz4_frame = None
+
+DEFAULT_L1_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_COMPRESS_THRESHOLD = 16 * 1024
+DEFAULT_STAMPEDE_LOCK_TIMEOUT = 30
+NEVER_EXPIRES = 10 * 365 * 24 * 3600  # L1 lifetime for timeout=0 entries
+
+# First byte of every L2 payload
+_RAW, _ZLIB, _LZ4 = b'\x00', b'\x01', b'\x02'
+
+
+def encode(value, compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD):
+    """``(pickle, payload)``: the raw pickle and the tagged, maybe compressed L2 form"""
+    raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if compress_threshold and len(raw) >= compress_threshold:
+        if lz4_frame is not None:
+            return raw, _LZ4 + lz4_frame.compress(raw)
+        return raw, _ZLIB + zlib.compress(raw, 1)
+    return raw, _RAW + raw
+
+
+def decode_raw(payload: bytes) -> bytes:
+    """The pickle inside an L2 payload"""
+    codec, body = payload[:1], payload[1:]
+    if codec == _LZ4:
+        if lz4_frame is None:
+            raise RuntimeError("Cache payload is lz4-compressed but lz4 is not installed")
+        return lz4_frame.decompress(body)
+    if codec == _ZLIB:
+        return zlib.decompress(body)
+    return body
+
+
+class TieredCache(BaseCache):
+    """flask-caching backend: per-process L1 in front of a shared Redis L2
+
+    The L1 holds raw pickles, so every hit returns a fresh copy just as
+    ``SimpleCache`` does. Without ``redis`` the L1 is the only tier and
+    behaves like a budgeted ``SimpleCache``. With it, ``l1_timeout`` caps
+    how long a worker may serve an entry another worker has since changed
+    or deleted; ``l1_max_bytes=0`` turns the L1 off for such regions.
+
+    Stampede protection (``stampede_wait`` > 0): the first miss claims the
+    key (an L2 ``SET NX`` lock), later misses poll for up to
+    ``stampede_wait`` seconds for the value. A claim ends with the claiming
+    thread's ``set()``, or with ``release_claims()``, which the factory runs
+    at app-context teardown: a request that only probed the cache, like
+    Superset's ``force_cached`` check before queueing an async chart query,
+    must not leave later callers waiting. Waiters stop as soon as the claim
+    is gone.
+    """
+
+    def __init__(self, redis=None, key_prefix: str = '', default_timeout: int = 300,
+                 l1_max_bytes: int = DEFAULT_L1_MAX_BYTES, l1_timeout: int = None,
+                 compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+                 stampede_wait: float = 0,
+                 stampede_lock_timeout: int = DEFAULT_STAMPEDE_LOCK_TIMEOUT,
+                 **kwargs):
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.redis = redis
+        self.key_prefix = key_prefix or ''
+        self.l1 = None
+        if l1_max_bytes or redis is None:
+            self.l1 = ResultCache(
+                max_bytes=l1_max_bytes or DEFAULT_L1_MAX_BYTES,
+                default_ttl=default_timeout or NEVER_EXPIRES,
+            )
+        self.l1_timeout = l1_timeout
+        self.compress_threshold = compress_threshold
+        self.stampede_wait = stampede_wait
+        self.stampede_lock_timeout = stampede_lock_timeout
+        self._filling = {}  # key -> (claim expiry (monotonic), thread id, L2 token)
+        self._local = threading.local()  # keys claimed by the current thread
+        self._lock = threading.Lock()
+        self.stats = {'l2_hits': 0, 'l2_misses': 0, 'l2_errors': 0, 'compressed': 0,
+                      'stampede_claims': 0, 'stampede_waits': 0, 'stampede_served': 0}
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        redis = None
+        url = config.get('CACHE_REDIS_URL')
+        if url:
+            from redis import from_url
+
+            redis = from_url(url)
+        kwargs.pop('ignore_delete_many_errors', None)
+        cache = cls(
+            redis, *args,
+            key_prefix=config.get('CACHE_KEY_PREFIX', ''),
+            l1_max_bytes=config.get('CACHE_L1_MAX_BYTES', DEFAULT_L1_MAX_BYTES),
+            l1_timeout=config.get('CACHE_L1_TIMEOUT'),
+            compress_threshold=config.get('CACHE_COMPRESS_THRESHOLD', DEFAULT_COMPRESS_THRESHOLD),
+            stampede_wait=config.get('CACHE_STAMPEDE_WAIT', 0),
+            stampede_lock_timeout=config.get(
+                'CACHE_STAMPEDE_LOCK_TIMEOUT', DEFAULT_STAMPEDE_LOCK_TIMEOUT
+            ),
+            **kwargs
+        )
+        if app is not None and cache.stampede_wait:
+            app.teardown_appcontext(lambda exc=None: cache.release_claims())
+        return cache
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _l1_ttl(self, timeout: int) -> int:
+        ttl = timeout or NEVER_EXPIRES
+        return min(ttl, self.l1_timeout) if self.l1_timeout else ttl
+
+    def _load(self, key: str):
+        """Raw pickle from L1, else from L2 (refilling L1), else None"""
+        if self.l1 is not None:
+            raw = self.l1.get(key)
+            if raw is not None:
+                return raw
+        if self.redis is None:
+            return None
+        try:
+            # One round trip for the payload and its remaining lifetime
+            pipe = self.redis.pipeline()
+            pipe.get(self.key_prefix + key)
+            pipe.ttl(self.key_prefix + key)
+            payload, remaining = pipe.execute()
+        except Exception as e:
+            self._count('l2_errors')
+            log.warning(f"Cache L2 read of {key} failed: {e}")
+            return None
+        if payload is None:
+            self._count('l2_misses')
+            return None
+        self._count('l2_hits')
+        raw = decode_raw(payload)
+        if self.l1 is not None:
+            # ttl is -1 for keys stored without expiry
+            timeout = remaining if remaining is not None and remaining > 0 else 0
+            self.l1.set(key, raw, ttl=self._l1_ttl(timeout), size=len(raw))
+        return raw
+
+    def get(self, key: str):
+        raw = self._load(key)
+        if raw is None and self.stampede_wait and not self._claim(key):
+            raw = self._wait_for(key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def _claimed_keys(self) -> set:
+        keys = getattr(self._local, 'keys', None)
+        if keys is None:
+            keys = self._local.keys = set()
+        return keys
+
+    def _claim(self, key: str) -> bool:
+        """True if this caller should compute ``key``; False if another caller is"""
+        now = time.monotonic()
+        me = threading.get_ident()
+        token = f'{os.getpid()}:{me}'.encode('ascii')
+        with self._lock:
+            held = self._filling.get(key)
+            if held is not None and held[0] > now:
+                return held[1] == me
+            self._filling[key] = (now + self.stampede_lock_timeout, me, token)
+        if self.redis is not None:
+            try:
+                claimed = self.redis.set(
+                    f'{self.key_prefix}fill:{key}', token,
+                    nx=True, ex=self.stampede_lock_timeout,
+                )
+            except Exception as e:
+                log.warning(f"Cache fill claim for {key} failed: {e}")
+                claimed = True
+            if not claimed:
+                with self._lock:
+                    self._filling.pop(key, None)
+                return False
+        self._claimed_keys().add(key)
+        self._count('stampede_claims')
+        return True
+
+    def _claim_held(self, key: str) -> bool:
+        """True while some caller, here or in another process, holds a fill claim on ``key``"""
+        with self._lock:
+            held = self._filling.get(key)
+            if held is not None and held[0] > time.monotonic():
+                return True
+        if self.redis is None:
+            return False
+        try:
+            return bool(self.redis.exists(f'{self.key_prefix}fill:{key}'))
+        except Exception:
+            return False
+
+    def _wait_for(self, key: str):
+        """Poll for another caller's fill of ``key``
+
+        None after ``stampede_wait`` seconds, or as soon as the claim is
+        released without a value.
+        """
+        self._count('stampede_waits')
+        deadline = time.monotonic() + self.stampede_wait
+        delay = 0.02
+        while time.monotonic() < deadline:
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, 0.5)
+            raw = self._load(key)
+            if raw is not None:
+                self._count('stampede_served')
+                return raw
+            if not self._claim_held(key):
+                return None
+        return None
+
+    def _release(self, key: str):
+        self._claimed_keys().discard(key)
+        with self._lock:
+            held = self._filling.pop(key, None)
+        if held is not None and self.redis is not None:
+            fill_key = f'{self.key_prefix}fill:{key}'
+            try:
+                # Only drop the L2 claim this process took
+                if self.redis.get(fill_key) == held[2]:
+                    self.redis.delete(fill_key)
+            except Exception as e:
+                log.warning(f"Cache fill release for {key} failed: {e}")
+
+    def release_claims(self):
+        """Release every fill claim the current thread still holds"""
+        for key in list(self._claimed_keys()):
+            self._release(key)
+
+    def _store(self, key: str, value, timeout, only_new: bool = False) -> bool:
+        timeout = self._normalize_timeout(timeout)
+        raw, payload = encode(value, self.compress_threshold)
+        if payload[:1] != _RAW:
+            self._count('compressed')
+        stored = True
+        if self.redis is not None:
+            try:
+                stored = bool(self.redis.set(
+                    self.key_prefix + key, payload,
+                    ex=timeout if timeout > 0 else None, nx=only_new,
+                ))
+            except Exception as e:
+                self._count('l2_errors')
+                log.warning(f"Cache L2 write of {key} failed: {e}")
+                stored = False
+        elif only_new and self.l1 is not None and self.l1.get(key) is not None:
+            stored = False
+        if stored and self.l1 is not None:
+            self.l1.set(key, raw, ttl=self._l1_ttl(timeout), size=len(raw))
+        self._release(key)
+        return stored
+
+    def set(self, key: str, value, timeout=None) -> bool:
+        return self._store(key, value, timeout)
+
+    def add(self, key: str, value, timeout=None) -> bool:
+        return self._store(key, value, timeout, only_new=True)
+
+    def delete(self, key: str) -> bool:
+        if self.l1 is not None:
+            self.l1.invalidate(key)
+        if self.redis is None:
+            return True
+        try:
+            return bool(self.redis.delete(self.key_prefix + key))
+        except Exception as e:
+            log.warning(f"Cache L2 delete of {key} failed: {e}")
+            return False
+
+    def has(self, key: str) -> bool:
+        if self.l1 is not None and self.l1.get(key) is not None:
+            return True
+        if self.redis is None:
+            return False
+        try:
+            return bool(self.redis.exists(self.key_prefix + key))
+        except Exception as e:
+            log.warning(f"Cache L2 lookup of {key} failed: {e}")
+            return False
+
+    def ttl(self, key: str):
+        """Seconds until ``key`` expires (``NEVER_EXPIRES`` if it never does), None if absent
+
+        Redis is authoritative when configured; otherwise the L1 answers.
+        """
+        if self.redis is None:
+            return self.l1.ttl(key)
+        try:
+            remaining = self.redis.ttl(self.key_prefix + key)
+        except Exception as e:
+            log.warning(f"Cache L2 TTL lookup of {key} failed: {e}")
+            return None
+        if remaining is None or remaining == -2:
+            return None
+        return NEVER_EXPIRES if remaining == -1 else remaining
+
+    def clear(self) -> bool:
+        if self.l1 is not None:
+            self.l1.invalidate()
+        if self.redis is None:
+            return True
+        if not self.key_prefix:
+            log.warning("Refusing to clear a Redis cache region without a key prefix")
+            return False
+        try:
+            keys = list(self.redis.scan_iter(match=self.key_prefix + '*'))
+            if keys:
+                self.redis.delete(*keys)
+            return True
+        except Exception as e:
+            log.warning(f"Cache L2 clear failed: {e}")
+            return False
+
+    def get_stats(self) -> dict:
+        """L1 hit/miss/eviction counters plus L2, compression and stampede counters"""
+        with self._lock:
+            stats = dict(self.stats)
+        if self.l1 is not None:
+            stats['l1'] = self.l1.get_stats()
+        return stats
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from clickhouse_railway_cache import ResultCache
+
+
+class DictTier:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+
+def test_promoted_entries_keep_their_remaining_ttl(monkeypatch):
+    tier = DictTier()
+    writer = ResultCache(default_ttl=300, second_tier=tier)
+    reader = ResultCache(default_ttl=300, second_tier=tier)
+    writer.set('k', [(1,)], ttl=10)
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 8)
+    assert reader.get('k') == [(1,)]
+    assert reader.ttl('k') == pytest.approx(2, abs=0.5)
+
+
+def test_expired_second_tier_entries_are_misses(monkeypatch):
+    tier = DictTier()
+    ResultCache(second_tier=tier).set('k', [(1,)], ttl=10)
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    reader = ResultCache(second_tier=tier)
+    assert reader.get('k') is None
+    assert reader.get_stats()['misses'] == 1
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from clickhouse_railway_advisor import PatternRecorder, load_patterns, propose_rollups
+from clickhouse_railway_result import is_truncated
+from clickhouse_railway_settings import QueryTimeoutError
+
+
+def test_execute_records_callers_sql_not_row_limit_wrapper(make_engine, tmp_path):
+    engine = make_engine(row_limit=100)
+    recorder = PatternRecorder(str(tmp_path / 'patterns.jsonl'))
+    engine.instrumentation.add_hook(recorder)
+    query = 'SELECT region, sum(value) AS total FROM events GROUP BY region'
+
+    engine.execute(query)
+    engine.execute(query)
+
+    assert engine.clients[0].queries[-1].startswith('SELECT * FROM (')
+    assert engine.instrumentation.history.records()[-1].query == query
+    recorder.flush()
+    proposals = propose_rollups(load_patterns(recorder.path))
+    assert [(rollup.table, rollup.aggregates) for rollup in proposals] == [
+        ('events', ['sum(value)'])
+    ]
+
+
+def test_arrow_results_report_truncation_and_store_is_not_capped(make_engine):
+    pytest.importorskip('pyarrow')
+    engine = make_engine(row_limit=2, client_options={'rows': [(1,), (2,), (3,)]})
+
+    table = engine.execute_columnar('SELECT x FROM t', arrow=True)
+    assert table.num_rows == 2
+    assert is_truncated(table)
+
+    stored = {}
+
+    class Store:
+        def put_table(self, key, table, timeout):
+            stored[key] = table
+            return True
+
+    assert engine.execute_to_store('SELECT x FROM t', Store(), 'k') == 3
+    assert not is_truncated(stored['k'])
+
+
+def test_coalesced_caller_gives_up_at_its_own_timeout(make_engine):
+    engine = make_engine(client_options={'delay': 1.0})
+    query = 'SELECT count() FROM events'
+    results = []
+    leader = threading.Thread(target=lambda: results.append(engine.execute(query, timeout=30)))
+    leader.start()
+    while engine.inflight.get_stats()['in_flight'] == 0:
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    with pytest.raises(QueryTimeoutError) as info:
+        engine.execute(query, timeout=0.2)
+    assert time.monotonic() - started < 0.8
+    assert not info.value.killed
+
+    leader.join()
+    assert len(results) == 1 and results[0].rows == [(1,)]
+    assert engine.coalescing_stats()['wait_timeouts'] == 1
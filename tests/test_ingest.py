@@ -0,0 +1,62 @@
+import gzip
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+pytest.importorskip('pandas')
+
+from clickhouse_railway_ingest import BulkLoader
+
+
+class FakeMetadata:
+    def invalidate(self, table):
+        pass
+
+    def get_columns(self, table):
+        return [{'name': 'id', 'type': 'UInt32'}, {'name': 'name', 'type': 'String'}]
+
+
+class FakeEngine:
+    def __init__(self):
+        self.metadata = FakeMetadata()
+        self.inserted = []
+
+    def insert_dataframe(self, table, dataframe, settings=None):
+        self.inserted.append(dataframe)
+        return len(dataframe)
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc')
+@pytest.mark.parametrize('name, format', [
+    ('upload.csv.gz', None), ('upload.data', 'csv'), ('upload.csv', None),
+])
+def test_streamed_csv_uploads_close_their_files(tmp_path, name, format):
+    data = b'id,name\n1,a\n2,b\n'
+    path = tmp_path / name
+    path.write_bytes(gzip.compress(data) if name.endswith('.gz') else data)
+    engine = FakeEngine()
+    before = open_fds()
+
+    progress = BulkLoader(engine, 'events', parse_workers=1).load(str(path), format=format)
+
+    assert progress.rows == 2
+    assert sum(len(frame) for frame in engine.inserted) == 2
+    assert open_fds() == before
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc')
+def test_failed_csv_upload_closes_its_file(tmp_path):
+    path = tmp_path / 'upload.csv'
+    path.write_bytes(b'id,name\n1,a\nnot-a-number,b\n')
+    before = open_fds()
+
+    with pytest.raises(Exception) as info:
+        BulkLoader(FakeEngine(), 'events', parse_workers=1).load(str(path))
+
+    assert info.traceback  # the traceback still references the loader's frames
+    assert open_fds() == before
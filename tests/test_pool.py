@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from clickhouse_railway_pool import ClickHousePool
+from conftest import FakeClient
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_child_gets_fresh_clients_and_leaves_parents_alone():
+    created = []
+
+    def factory():
+        created.append(FakeClient())
+        return created[-1]
+
+    pool = ClickHousePool(factory, min_size=1, max_size=2)
+    with pool.connection() as client:
+        client.connection.force_connect()
+    inherited = created[0]
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # child
+        os.close(read_end)
+        try:
+            with pool.connection() as client:
+                ok = (client is not inherited and not inherited.disconnected
+                      and pool.get_stats()['fork_resets'] == 1)
+            os.write(write_end, b'ok' if ok else b'fail')
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end, 'rb') as f:
+        verdict = f.read()
+    os.waitpid(pid, 0)
+
+    assert verdict == b'ok'
+    with pool.connection() as client:
+        assert client is inherited
+    assert pool.get_stats()['fork_resets'] == 0
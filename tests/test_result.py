@@ -0,0 +1,24 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+
+from clickhouse_railway_result import _concat_chunks, downcast_column
+
+
+def test_downcast_keeps_signed_columns_signed():
+    counts = downcast_column(np.array([0, 5, 200], dtype=np.int64))
+    assert counts.dtype == np.int16
+    assert (counts - np.int16(201)).min() < 0
+
+
+def test_downcast_narrows_unsigned_columns_as_unsigned():
+    assert downcast_column(np.array([0, 200], dtype=np.uint64)).dtype == np.uint8
+    assert downcast_column(np.array([-1, 100], dtype=np.int64)).dtype == np.int8
+    assert downcast_column(np.array([0, 2 ** 40], dtype=np.int64)).dtype == np.int64
+
+
+def test_concat_keeps_array_columns_one_dimensional():
+    column = _concat_chunks([((1, 2), (3, 4)), ((5, 6),)])
+    assert column.shape == (3,)
+    assert column[2] == (5, 6)